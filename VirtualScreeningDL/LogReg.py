@@ -12,14 +12,22 @@ The output of the model or prediction is then done by taking the argmax of the v
 This tutorial presents a stochastic gradient descent optimization method suitable for large datasets.
 """
 
-import cPickle
 import time
 import sys
+import os
 import numpy
+import scipy.sparse
 import theano
 import theano.tensor as T
+from sklearn import metrics
 from DataLoader import load_files_for_task, shared_dataset, prepare_cv_datalists, create_mega_batches
 
+# the training loop lives in the main repo (lib/theano/training_loop.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib.theano import training_loop
+from lib.theano import model_io
+from lib.theano import hogwild
+
 class LogisticRegression(object):
     """Multi-class Logistic Regression Class
     The logistic regression is fully described by a weight matrix :math:`W` and bias vector :math:`b`.
@@ -106,13 +114,36 @@ class LogisticRegression(object):
             raise NotImplementedError()
 
 
-def perform_cv_onefold(taskId, testFold, foldsActive, foldsInactive, multiplier, modelDir, predDir):
+def hogwild_train(classifier, trainDataset, n_epochs, learning_rate, batch_size, workers):
+    """
+    Lock-free asynchronous SGD of the classifier over workers processes (lib/theano/hogwild.py)
+    Validated by the AUC on the training set (the validation set above); leaves the best weights in the classifier.
+    """
+    train_x = scipy.sparse.csr_matrix(numpy.asarray(trainDataset[0], dtype=theano.config.floatX))
+    train_y = numpy.asarray(trainDataset[1], dtype='int32')
+
+    def validate(W, b):
+        return metrics.roc_auc_score(train_y, hogwild.predict(W, b, train_x)[:, 1])
+
+    model = hogwild.HogwildLR(train_x.shape[1], 2, theano.config.floatX)
+    result = model.train(train_x, train_y, validate, n_epochs=n_epochs, learning_rate=learning_rate,
+        batch_size=batch_size, num_workers=workers, eval_every=10., patience=5)
+
+    W, b = model.values()
+    classifier.W.set_value(W, borrow=True)
+    classifier.b.set_value(b, borrow=True)
+
+    return result
+
+def perform_cv_onefold(taskId, testFold, foldsActive, foldsInactive, multiplier, modelDir, predDir, workers=1):
     """
     Demonstrate stochastic gradient descent optimization of a log-linear model
     :type learning_rate: float
     :param learning_rate: learning rate used (factor for the stochastic gradient)
     :type n_epochs: int
     :param n_epochs: maximal number of epochs to run the optimizer
+    :type workers: int
+    :param workers: more than 1: train with lock-free asynchronous SGD over this many processes (hogwild_train)
     """
 
     learning_rate=0.1
@@ -121,7 +152,7 @@ def perform_cv_onefold(taskId, testFold, foldsActive, foldsInactive, multiplier,
     numBatchesPerSet = 100
     mega_batch_size = batch_size * numBatchesPerSet
 
-    writeModelFile = modelDir + 'Model.' + taskId + '.' + str(testFold) +'.pkl'
+    writeModelFile = modelDir + 'Model.' + taskId + '.' + str(testFold)
 
     cvSet = set([0,1,2,3,4])
     testFoldList = []
@@ -168,9 +199,13 @@ def perform_cv_onefold(taskId, testFold, foldsActive, foldsInactive, multiplier,
     trainSharedDataset = shared_dataset(train_set)
     testSharedDataset = shared_dataset(test_set)
 
-    train_set_x, train_set_y = trainSharedDataset
     test_set_x, test_set_y = testSharedDataset
     valid_set_x, valid_set_y = trainSharedDataset
+
+    # training megabatches are swapped into these (set_value) while training
+    train_set_x = theano.shared(numpy.asarray(train_set[0], dtype=theano.config.floatX), borrow=True)
+    train_shared_y = theano.shared(numpy.asarray(train_set[1], dtype=theano.config.floatX), borrow=True)
+    train_set_y = T.cast(train_shared_y, 'int32')
     print "Finished creating datasets."
 
     ####################### BUILD ACTUAL MODEL #######################
@@ -231,86 +266,68 @@ def perform_cv_onefold(taskId, testFold, foldsActive, foldsInactive, multiplier,
     ################ TRAIN MODEL ################
     #print '... training the model'
     # early-stopping parameters
-    patience = 5000  # look as this many examples regardless
-    patience_increase = 2  # wait this much longer when a new best is found
-    improvement_threshold = 0.995  # a relative improvement of this much is considered significant
-    validation_frequency = min(n_train_totalbatches, patience / 2)
+    stopping = training_loop.EarlyStopping(metric='loss', patience=5000,
+        patience_increase=2, improvement_threshold=0.995)
+    validation_frequency = min(n_train_totalbatches, stopping.patience / 2)
     print "Validation Frequency: ", validation_frequency
     # go through this many minibatches before checking the network on the validation set; in this case we check every epoch
 
-    best_validation_loss = numpy.inf
-    test_score = 0.
-    start_time = time.clock()
-
-    done_looping = False
-    epoch = 0
-    countCumulMiniBatchesTrained = 0
-    while (epoch < n_epochs) and (not done_looping):
-        epoch = epoch + 1
-        # this is the key point where he changed things; 
-        # he's loading 10k to 15k tems into shared data each iteration
-        # loading 300megs of data into shared data breaks the system; 
-        # this prevents that issue
-        for megabatch_index in xrange(n_train_megabatches):
+    # one epoch = every minibatch of every megabatch. Only one megabatch is
+    # loaded into shared data at a time; loading 300megs of data into shared
+    # data breaks the system
+    steps = []
+    for megabatch_index in xrange(n_train_megabatches):
+        rows_megabatch = trainDatasetList[megabatch_index][3]
+        n_minibatches = (rows_megabatch + batch_size - 1) / batch_size
+        steps.extend([(megabatch_index, i) for i in xrange(n_minibatches)])
+
+    loaded = [0]
+    def train_step(step_index):
+        megabatch_index, minibatch_index = steps[step_index]
+        if (megabatch_index != loaded[0]):
             trainDatasetMB = trainDatasetList[megabatch_index]
-            train_set = (trainDatasetMB[0], trainDatasetMB[1])
-            trainSharedDataset = shared_dataset(train_set)
-            train_set_x, train_set_y = trainSharedDataset
-
-            nextMB = (megabatch_index + 1)% n_train_megabatches
-            validDatasetMB = trainDatasetList[nextMB]
-            valid_set = (validDatasetMB[0], validDatasetMB[1])
-            validSharedDataset = shared_dataset(valid_set)
-            valid_set_x, valid_set_y = trainSharedDataset
-
-            for minibatch_index in xrange(n_train_minibatches):
-                minibatch_avg_cost = train_model(minibatch_index)
-                countCumulMiniBatchesTrained += 1
-                actualMinibatch = (megabatch_index*numBatchesPerSet)+ minibatch_index
-                # print "Megabatch: ", megabatch_index, " Minibatch: ", minibatch_index, " Actual MB: ", actualMinibatch, " countCumulMiniBatchesTrained: ", countCumulMiniBatchesTrained
-                if (countCumulMiniBatchesTrained + 1) % validation_frequency == 0:
-                    print "Validating for: ", countCumulMiniBatchesTrained,
-                    # compute zero-one loss on validation set
-                    validation_losses = [validate_model(i)
-                                            for i in xrange(n_valid_batches)]
-                    this_validation_loss = numpy.mean(validation_losses)
-
-                    print( 'epoch %i, minibatch %i/%i, validation error %f %%' %
-                        (epoch,  actualMinibatch%n_train_totalbatches, n_train_totalbatches, this_validation_loss * 100.) )
-
-                    # if we got the best validation score until now
-                    if this_validation_loss < best_validation_loss:
-                        #improve patience if loss improvement is good enough
-                        if this_validation_loss < best_validation_loss *  \
-                            improvement_threshold:
-                            patience = max(patience, countCumulMiniBatchesTrained * patience_increase)
-
-                        best_validation_loss = this_validation_loss
-                        # test it on the test set
-
-                        test_losses = [test_model(i) for i in xrange(n_test_batches)]
-                        test_score = numpy.mean(test_losses)
-
-                        # save the best model
-                        with open(writeModelFile, 'w') as f:
-                            cPickle.dump(classifier, f)
-
-                if patience <= countCumulMiniBatchesTrained:
-                    done_looping = True
-                    break
-
-    end_time = time.clock()
-
-    print( ('Optimization complete for %d with best validation score of %f %% with test performance %f %%')
-        % (testFold, best_validation_loss * 100., test_score * 100.) )
-    print 'The code ran for %d epochs, with %f epochs/sec' % (epoch, 1. * epoch / (end_time - start_time))
-    # print >> sys.stderr, ('The code for file ' + os.path.split(__file__)[1] + ' ran for %.1fs' % ((end_time - start_time)))
+            train_set_x.set_value(numpy.asarray(trainDatasetMB[0], dtype=theano.config.floatX), borrow=True)
+            train_shared_y.set_value(numpy.asarray(trainDatasetMB[1], dtype=theano.config.floatX), borrow=True)
+            loaded[0] = megabatch_index
+
+        return train_model(minibatch_index)
+
+    def validate():
+        # compute zero-one loss on validation set
+        validation_losses = [validate_model(i) for i in xrange(n_valid_batches)]
+        return {'loss': numpy.mean(validation_losses)}
+
+    best = {'test_score': 0.}
+    def on_best(epoch, step_index, scores):
+        # test it on the test set
+        test_losses = [test_model(i) for i in xrange(n_test_batches)]
+        best['test_score'] = numpy.mean(test_losses)
+
+    if (workers > 1):
+        result = hogwild_train(classifier, trainDataset, n_epochs, learning_rate, batch_size, workers)
+        stopping.update(validate()['loss'], 0)
+        on_best(result['epochs'], 0, None)
+    else:
+        result = training_loop.train(train_step, len(steps), n_epochs, validate,
+            stopping, validation_frequency=validation_frequency,
+            deadline=training_loop.get_deadline(), params=classifier.params,
+            on_best=on_best)
+    epoch = result['epochs']
+
+    print( ('Optimization complete for %d (%s) with best validation score of %f %% with test performance %f %%')
+        % (testFold, result['stopped'], stopping.best * 100., best['test_score'] * 100.) )
+    print 'The code ran for %d epochs, with %f epochs/sec' % (epoch, 1. * epoch / result['seconds'])
+    # print >> sys.stderr, ('The code for file ' + os.path.split(__file__)[1] + ' ran for %.1fs' % (result['seconds']))
 
     # end-snippet-4
     # Now we do the predictions
 
-    # load the saved best model for this fold
-    classifier = cPickle.load(open(writeModelFile))
+    # the classifier holds the best weights again; write them once
+    model_io.save_model(writeModelFile, 'lr', hidden=[],
+        output=[p.get_value(borrow=True) for p in classifier.params],
+        meta={'target': taskId, 'fold': testFold, 'n_bits': 32 * 32,
+              'metrics': {'valid_error': float(stopping.best),
+                          'test_error': float(best['test_score'])}})
 
     # compile a predictor function
     predict_model = theano.function( inputs=[classifier.input],  outputs=[classifier.y_pred,classifier.p_y_given_x])
@@ -365,6 +382,8 @@ if __name__ == '__main__':
     start_time_main = time.clock()
 
     workingDir = sys.argv[2]
+    # more than 1 worker: lock-free asynchronous SGD (hogwild_train)
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
     modelDir = workingDir + 'Models/'
     predDir = workingDir + 'Predictions/'
     print filePath, workingDir, modelDir, predDir
@@ -382,7 +401,7 @@ if __name__ == '__main__':
         foldsActive, foldsInactive, multiplier = load_files_for_task(activeFile, inactiveFile)
         for fold in range(0,5):
             print 'inside fold', fold
-            perform_cv_onefold(taskId, fold, foldsActive, foldsInactive, multiplier, modelDir, predDir)
+            perform_cv_onefold(taskId, fold, foldsActive, foldsInactive, multiplier, modelDir, predDir, workers)
 
         end_time_file = time.clock()
         print 'The full run for: ',words[0],' took: %f secs.' % (end_time_file - start_time_file)
@@ -0,0 +1,108 @@
+"""
+**************************************************************************
+Data Parallel Fine-Tuning Benchmark
+**************************************************************************
+
+Scaling of synchronous data parallel DBN fine-tuning (see
+lib/theano/data_parallel.py) from 1 to K worker processes: times SGD steps
+of the P-STNN [2000, 100] on random fingerprints & reports steps/sec, the
+speedup over 1 worker & the scaling efficiency (speedup / workers). Also
+checks that a K worker step gives the same weights as the compiled single
+process step.
+
+$ python bench_data_parallel.py [max_workers] [batch_size] [steps]
+
+e.g. on a 16 core node, one BLAS thread per worker:
+$ OPENBLAS_NUM_THREADS=1 python bench_data_parallel.py 16 100
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 28 Sept 2015
+"""
+
+# use a pre-warmed compile cache ($DBN_COMPILE_CACHE) if there is one; this has
+# to happen before theano is imported
+from lib.theano import compile_cache
+compile_cache.use_compile_cache()
+
+import multiprocessing, sys, time
+import numpy
+from lib.theano import data_parallel
+from th_deep_belief_net import get_template
+
+
+
+def random_data(rows, n_ins=1024, seed=0):
+    """ fingerprints with 5% of the bits on & balanced labels """
+    rng = numpy.random.RandomState(seed)
+    x = (rng.rand(rows, n_ins) < 0.05).astype('float64')
+    y = rng.randint(0, 2, rows)
+
+    return x, y
+
+
+
+def max_difference(template, sgd, learning_rate=0.1):
+    """ weights after one K worker step vs. one compiled step """
+    template.reset()
+    template.train_fn(0, learning_rate)
+    expected = [p.get_value() for p in template.dbn.params]
+
+    template.reset()
+    sgd.step(0, learning_rate)
+
+    return max([abs(p.get_value(borrow=True) - e).max()
+        for p, e in zip(template.dbn.params, expected)])
+
+
+
+def main(args):
+
+    max_workers = int(args[1]) if len(args) > 1 else \
+        multiprocessing.cpu_count()
+    batch_size = int(args[2]) if len(args) > 2 else 100
+    steps = int(args[3]) if len(args) > 3 else 20
+
+    x, y = random_data(batch_size * steps)
+    template = get_template(n_ins=1024, hidden_layers_sizes=[2000, 100],
+                            n_outs=2, batch_size=batch_size)
+    template.set_data([(x, y), (x[:batch_size], y[:batch_size]),
+                       (x[:batch_size], y[:batch_size])])
+    grad_fn = template.grad_function()
+    train_x = template.train_x.get_value(borrow=True)
+    train_y = template.train_y.get_value(borrow=True).astype('int32')
+
+    print '%i cores, batch %i, %i steps per run' % (
+        multiprocessing.cpu_count(), batch_size, steps)
+    print '%8s %10s %10s %10s %12s %12s' % ('workers', 'secs/step',
+        'steps/sec', 'speedup', 'efficiency', 'max diff')
+
+    base = None
+    for workers in range(1, max_workers + 1):
+        sgd = data_parallel.DataParallelSGD(template.dbn.params, grad_fn,
+            train_x, train_y, batch_size, workers).start()
+        try:
+            diff = max_difference(template, sgd)
+            sgd.step(0, 0.1)
+
+            start = time.time()
+            for index in range(steps):
+                sgd.step(index, 0.1)
+            seconds = (time.time() - start) / steps
+        finally:
+            sgd.stop()
+
+        if(base is None):
+            base = seconds
+        print '%8i %10.4f %10.2f %9.2fx %11.0f%% %12.2e' % (workers, seconds,
+            1. / seconds, base / seconds, 100. * base / seconds / workers,
+            diff)
+
+
+
+if __name__ == '__main__':
+    start_time = time.clock()
+
+    main(sys.argv)
+
+    end_time = time.clock()
+    print 'runtime: %.2f secs.' % (end_time - start_time)
@@ -0,0 +1,141 @@
+"""
+**************************************************************************
+Hogwild! Logistic Regression Benchmark
+**************************************************************************
+
+Time to a target validation AUC of the single process theano LR trainer
+(th_logistic_regression.build_model) vs. lock-free asynchronous SGD (see
+lib/theano/hogwild.py) with 1 to K worker processes, on the same folds,
+learning rate & batch size:
+
+$ python bench_hogwild.py <dataset> <target> [max_workers] [target_auc]
+      [n_epochs]
+
+e.g. on a 16 core node, one BLAS thread per worker:
+$ OPENBLAS_NUM_THREADS=1 python bench_hogwild.py MUV 466 16
+
+The target defaults to 99% of the best validation AUC of the single process
+run. The single process time only counts training (it's validated between
+epochs); the hogwild times are wall clock (the main process validates
+while the workers train).
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 29 Sept 2015
+"""
+
+# use a pre-warmed compile cache ($DBN_COMPILE_CACHE) if there is one; this has
+# to happen before theano is imported
+from lib.theano import compile_cache
+compile_cache.use_compile_cache()
+
+import multiprocessing, sys, time
+import numpy, theano
+import scipy.sparse
+from sklearn import metrics
+from lib.theano import helpers
+from lib.theano import hogwild
+from th_logistic_regression import build_model, build_predict_function
+
+
+
+def auc(labels, scores):
+    fpr, tpr, thresholds = metrics.roc_curve(labels, scores)
+    return metrics.auc(fpr, tpr)
+
+
+
+def time_to(trace, target_auc):
+    """ seconds of the first (seconds, epochs, auc) reaching target_auc """
+    for seconds, epochs, score in trace:
+        if(score >= target_auc):
+            return seconds, epochs
+    return None, None
+
+
+
+def single_process(datasets, n_epochs, learning_rate, batch_size):
+    """ [(training seconds, epochs, validation auc) ...] per epoch """
+    (train_x, train_y), (valid_x, valid_y), test_xy = datasets
+    shared = [helpers.shared_dataset(data_xy) for data_xy in datasets]
+    classifier, train_model, validate_model, test_model = build_model(shared,
+        batch_size, learning_rate, n_in=train_x.shape[1])
+    predict_model = build_predict_function(classifier)
+    n_train_batches = len(train_x) / batch_size
+    valid_x = numpy.asarray(valid_x, dtype=theano.config.floatX)
+
+    trace = []
+    seconds = 0.
+    for epoch in range(1, n_epochs + 1):
+        start = time.time()
+        for index in xrange(n_train_batches):
+            train_model(index)
+        seconds += time.time() - start
+        trace.append((seconds, float(epoch),
+            auc(valid_y, predict_model(valid_x)[1][:, 1])))
+
+    return trace
+
+
+
+def main(args):
+
+    if(len(args) < 3):
+        print 'usage: <dataset> <target> [max_workers] [target_auc] [n_epochs]'
+        return
+
+    data_type, target = args[1], args[2]
+    max_workers = int(args[3]) if len(args) > 3 else \
+        multiprocessing.cpu_count()
+    target_auc = float(args[4]) if len(args) > 4 else None
+    n_epochs = int(args[5]) if len(args) > 5 else 10
+    learning_rate, batch_size = 0.1, 100
+
+    fold_path = helpers.get_fold_path(data_type)
+    fnames = helpers.build_targets(fold_path, data_type)[target]
+    datasets, test_y = helpers.th_load_data2_raw(data_type, fold_path, target,
+        fnames, 2, 1)
+    (train_x, train_y), (valid_x, valid_y), test_xy = datasets
+    sparse_valid_x = scipy.sparse.csr_matrix(valid_x, dtype='float64')
+
+    def validate(W, b):
+        return auc(valid_y, hogwild.predict(W, b, sparse_valid_x)[:, 1])
+
+    print '... single process theano trainer'
+    trace = single_process(datasets, n_epochs, learning_rate, batch_size)
+    if(target_auc is None):
+        target_auc = 0.99 * max([score for s, e, score in trace])
+
+    rows = [('theano', trace)]
+    for workers in range(1, max_workers + 1):
+        print '... hogwild, %i workers' % workers
+        model = hogwild.HogwildLR(train_x.shape[1])
+        result = model.train(train_x, train_y, validate, n_epochs=n_epochs,
+            learning_rate=learning_rate, batch_size=batch_size,
+            num_workers=workers, target_score=target_auc, eval_every=0.25,
+            verbose=False)
+        rows.append(('hogwild %i' % workers, result['trace']))
+
+    print '%i cores, %i training rows, target validation auc %f' % (
+        multiprocessing.cpu_count(), len(train_x), target_auc)
+    print '%-12s %12s %10s %10s %10s' % ('trainer', 'secs to auc',
+        'epochs', 'speedup', 'best auc')
+    base = time_to(trace, target_auc)[0]
+    for name, trace in rows:
+        seconds, epochs = time_to(trace, target_auc)
+        best = max([score for s, e, score in trace])
+        if(seconds is None):
+            print '%-12s %12s %10s %10s %10.6f' % (name, '-', '-', '-', best)
+        else:
+            speedup = '-' if base is None else '%.2fx' % (base / seconds)
+            print '%-12s %12.2f %10.2f %10s %10.6f' % (name, seconds, epochs,
+                speedup, best)
+
+
+
+if __name__ == '__main__':
+    start_time = time.clock()
+
+    main(sys.argv)
+
+    end_time = time.clock()
+    print 'runtime: %.2f secs.' % (end_time - start_time)
@@ -0,0 +1,165 @@
+"""
+**************************************************************************
+Fine-Tuning Optimizer Benchmark
+**************************************************************************
+
+Wall time to the best validation AUC of the fine-tuning update rules (see
+lib/theano/optimizers.py) on a few targets. The RBM stack is pretrained
+once per target; every optimizer fine-tunes the P-STNN [2000, 100] from that
+same stack with AUC early stopping (patience: 30 epochs), on run_DBN's folds:
+
+$ python bench_optimizers.py <dataset> <target[,target...]>
+      [optimizer[:lr],...] [training_epochs] [lr schedule]
+
+e.g.
+$ python bench_optimizers.py MUV 466,548,600 sgd,momentum,nesterov,adam 200
+$ python bench_optimizers.py Tox21 nr-ar,sr-are sgd,rmsprop,adam:0.0005 200
+
+sgd, momentum & nesterov default to run_DBN's learning rate (0.05), rmsprop
+& adam to 0.001. The time to best only counts fine-tuning steps &
+validations, not compiling or pretraining.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 30 Sept 2015
+"""
+
+# use a pre-warmed compile cache ($DBN_COMPILE_CACHE) if there is one; this has
+# to happen before theano is imported
+from lib.theano import compile_cache
+compile_cache.use_compile_cache()
+
+import sys, time
+import numpy
+from sklearn import metrics
+from lib.theano import helpers
+from lib.theano import training_loop
+from lib.theano import optimizers
+from th_deep_belief_net import get_template
+
+
+
+def auc(labels, scores):
+    fpr, tpr, thresholds = metrics.roc_curve(labels, scores)
+    return metrics.auc(fpr, tpr)
+
+
+
+def pretrain(datasets, pretraining_epochs, pretrain_lr, batch_size):
+    """ the RBM stack every optimizer starts from """
+    template = get_template(n_ins=1024, hidden_layers_sizes=[2000, 100],
+                            n_outs=2, batch_size=batch_size)
+    template.set_data(datasets)
+    training_loop.pretrain(template.pretraining_fns, template.n_train_batches,
+        pretraining_epochs, pretrain_lr)
+
+    return template.rbm_values()
+
+
+
+def finetune(datasets, layers, optimizer, finetune_lr, lr_schedule,
+             training_epochs, batch_size):
+    """ fine-tune from layers; returns the seconds, epoch & scores at the """
+    """ best validation AUC """
+    template = get_template(n_ins=1024, hidden_layers_sizes=[2000, 100],
+                            n_outs=2, batch_size=batch_size,
+                            optimizer=optimizer)
+    template.set_data(datasets)
+    template.set_rbm_values(layers)
+    n_train_batches = template.n_train_batches
+    schedule = optimizers.get_schedule(lr_schedule, finetune_lr)
+
+    stopping = training_loop.EarlyStopping(metric='auc',
+        patience=30 * n_train_batches, patience_increase=2.0,
+        improvement_threshold=0.995)
+    learning_rate = {'value': finetune_lr}
+    best = {}
+    start = time.time()
+
+    def on_epoch(epoch):
+        learning_rate['value'] = schedule(epoch)
+
+    def validate():
+        return {'auc': auc(template.valid_labels, template.predict_valid())}
+
+    def on_best(epoch, minibatch_index, scores):
+        best.update({'seconds': time.time() - start, 'epoch': epoch,
+            'valid_auc': scores['auc']})
+        best['test_auc'] = auc(template.test_labels, template.predict_test())
+
+    result = training_loop.train(
+        train_fn=lambda minibatch_index: template.train_fn(minibatch_index,
+            learning_rate['value']),
+        n_train_batches=n_train_batches,
+        n_epochs=training_epochs,
+        validate=validate,
+        stopping=stopping,
+        on_epoch=on_epoch,
+        on_best=on_best,
+        verbose=False
+    )
+    best['total_seconds'] = result['seconds']
+    best['epochs'] = result['epochs']
+
+    return best
+
+
+
+def main(args):
+
+    if(len(args) < 3):
+        print 'usage: <dataset> <target[,target...]> [optimizer[:lr],...] ' + \
+            '[training_epochs] [lr schedule]'
+        return
+
+    data_type = args[1]
+    targets = args[2].split(',')
+    specs = args[3].split(',') if len(args) > 3 else \
+        ['sgd', 'momentum', 'nesterov', 'rmsprop', 'adam']
+    training_epochs = int(args[4]) if len(args) > 4 else 200
+    lr_schedule = args[5] if len(args) > 5 else None
+    pretraining_epochs, pretrain_lr, finetune_lr = 10, 0.0000003, 0.05
+    batch_size = 100
+
+    fold_path = helpers.get_fold_path(data_type)
+    fnames = helpers.build_targets(fold_path, data_type)
+
+    rows = []
+    for target in targets:
+        # run_DBN's folds
+        datasets, test_set_labels = helpers.th_load_data2_raw(data_type,
+            fold_path, target, fnames[target], 1, 0)
+        print '... pretraining ' + target
+        layers = pretrain(datasets, pretraining_epochs, pretrain_lr,
+            batch_size)
+
+        for spec in specs:
+            optimizer, lr = optimizers.parse_optimizer(spec, finetune_lr)
+            print '... fine-tuning ' + target + ' with ' + optimizer + \
+                ' (lr %g)' % lr
+            best = finetune(datasets, layers, optimizer, lr, lr_schedule,
+                training_epochs, batch_size)
+            rows.append((target, spec, optimizer, lr, best))
+
+    print '%-10s %-10s %9s %10s %10s %10s %10s %10s' % ('target', 'optimizer',
+        'lr', 'valid auc', 'test auc', 'best epoch', 'secs best', 'secs total')
+    for target, spec, optimizer, lr, best in rows:
+        print '%-10s %-10s %9g %10.6f %10.6f %10i %10.2f %10.2f' % (target,
+            optimizer, lr, best['valid_auc'], best['test_auc'], best['epoch'],
+            best['seconds'], best['total_seconds'])
+
+    print 'mean over targets:'
+    for spec in specs:
+        bests = [best for t, s, o, lr, best in rows if s == spec]
+        print '%-14s valid auc %f, %.2f secs to best' % (spec,
+            numpy.mean([b['valid_auc'] for b in bests]),
+            numpy.mean([b['seconds'] for b in bests]))
+
+
+
+if __name__ == '__main__':
+    start_time = time.clock()
+
+    main(sys.argv)
+
+    end_time = time.clock()
+    print 'runtime: %.2f secs.' % (end_time - start_time)
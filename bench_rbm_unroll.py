@@ -0,0 +1,116 @@
+"""
+**************************************************************************
+Unrolled vs. Scan CD-k Benchmark
+**************************************************************************
+
+Per-minibatch time of the DBN's RBM pretraining steps (one per layer) with
+the CD-k Gibbs chain built by theano.scan vs. unrolled in the graph (see
+RBM.get_cost_updates & rbm.max_unrolled_k), for k = 1 .. max_k, on
+run_DBN's folds:
+
+$ python bench_rbm_unroll.py <dataset> <target> [max_k] [hidden layers]
+      [n_batches]
+
+e.g.
+$ python bench_rbm_unroll.py MUV 466 5 2000,100 200
+
+Both graphs start from the same weights; the times leave out compiling
+(reported separately) & the first call.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 2 Oct 2015
+"""
+
+# use a pre-warmed compile cache ($DBN_COMPILE_CACHE) if there is one; this has
+# to happen before theano is imported
+from lib.theano import compile_cache
+compile_cache.use_compile_cache()
+
+import sys, time
+import numpy
+from lib.theano import helpers
+from lib.theano import rbm
+from th_deep_belief_net import DBN
+
+
+
+def time_steps(layers, train_set_x, batch_size, k, unroll, n_batches,
+               pretrain_lr):
+    """ (compile seconds, [seconds per minibatch step of each layer]) """
+    # unroll the chain for any k, or for none
+    rbm.max_unrolled_k = k if unroll else 0
+    dbn = DBN(numpy_rng=numpy.random.RandomState(123), n_ins=1024,
+              hidden_layers_sizes=layers, n_outs=2)
+
+    start = time.time()
+    fns = dbn.pretraining_functions(train_set_x=train_set_x,
+        batch_size=batch_size, k=k)
+    compile_seconds = time.time() - start
+
+    total_batches = train_set_x.get_value(borrow=True).shape[0] / batch_size
+    step_seconds = []
+    for fn in fns:
+        fn(index=0, lr=pretrain_lr)
+        start = time.time()
+        for i in xrange(n_batches):
+            fn(index=i % total_batches, lr=pretrain_lr)
+        step_seconds.append((time.time() - start) / n_batches)
+
+    return compile_seconds, step_seconds
+
+
+
+def main(args):
+
+    if(len(args) < 3):
+        print 'usage: <dataset> <target> [max_k] [hidden layers] [n_batches]'
+        return
+
+    data_type, target = args[1], args[2]
+    max_k = int(args[3]) if len(args) > 3 else 5
+    layers = [int(n) for n in args[4].split(',')] if len(args) > 4 else \
+        [2000, 100]
+    n_batches = int(args[5]) if len(args) > 5 else 200
+    batch_size, pretrain_lr = 100, 0.0000003
+    default_max_unrolled_k = rbm.max_unrolled_k
+
+    fold_path = helpers.get_fold_path(data_type)
+    fnames = helpers.build_targets(fold_path, data_type)[target]
+    datasets, test_y = helpers.th_load_data2_raw(data_type, fold_path, target,
+        fnames, 1, 0)
+    train_set_x, train_set_y = helpers.shared_dataset(datasets[0])
+
+    rows = []
+    for k in range(1, max_k + 1):
+        for unroll in [False, True]:
+            graph = 'unrolled' if unroll else 'scan'
+            print '... CD-%i, %s' % (k, graph)
+            compile_seconds, step_seconds = time_steps(layers, train_set_x,
+                batch_size, k, unroll, n_batches, pretrain_lr)
+            rows.append((k, graph, compile_seconds, step_seconds))
+    rbm.max_unrolled_k = default_max_unrolled_k
+
+    print 'layers %s, batch size %i, %i minibatches per layer' % (
+        ','.join([str(n) for n in layers]), batch_size, n_batches)
+    print '%-3s %-9s %12s %s %12s %8s' % ('k', 'graph', 'compile secs',
+        ' '.join(['%12s' % ('ms layer %i' % i) for i in range(len(layers))]),
+        'ms per step', 'speedup')
+    scan = {}
+    for k, graph, compile_seconds, step_seconds in rows:
+        step = sum(step_seconds)
+        if(graph == 'scan'):
+            scan[k] = step
+        print '%-3i %-9s %12.2f %s %12.3f %7.2fx' % (k, graph,
+            compile_seconds,
+            ' '.join(['%12.3f' % (1000. * s) for s in step_seconds]),
+            1000. * step, scan[k] / step)
+
+
+
+if __name__ == '__main__':
+    start_time = time.clock()
+
+    main(sys.argv)
+
+    end_time = time.clock()
+    print 'runtime: %.2f secs.' % (end_time - start_time)
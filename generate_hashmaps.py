@@ -6,108 +6,126 @@ Generate Hashmaps
 Use our active files to build sparse truth sets (items not in the set are 
 implicitly negative across the board)
 
-row format:
-<hash_id> <binary_strings>
-
+Output (see lib/theano/hashmap.py):
+hashmaps/<data_type>.labels.npz     sparse compound x target label matrix (CSR)
+hashmaps/<data_type>.keys.npy       \\  indexed hashmap used by
+hashmaps/<data_type>.labels.npy     /   generate_multitask
 
+All active files are parsed in parallel (one file / target per job) & the
+label matrix is built from the (compound, target) pairs with array ops, so
+no per-compound rows are ever kept in memory.
 
 @author: Jason Feriante <feriante@cs.wisc.edu>
 @date: 10 July 2015
 """
 
-import generate_folds, os, sys, random, time, re
-from lib.theano import helpers
+import generate_folds, os, sys, random, time
+import numpy as np
+from multiprocessing import Pool
+from lib.theano import data_helpers
+from lib.theano import hashmap as indexed
 
 
 
-def gen_hashmap(data_type):
+def read_actives(job):
+    """ hash every compound in one active file; job = (col_id, path) """
+    col_id, path = job
 
-    # place to store the completed hashmap
-    hashmap_path = 'hashmaps/' + data_type + '.hm'
-    fold_path = helpers.get_fold_path(data_type)
+    bitstrings = []
+    with open(path) as f:
+        for line in f:
+            # this is the structure 
+            # [hash_id, is_active, native_id, fold, bitstring]
+            parts = line.rstrip('\n').split(r' ')
+            assert(int(parts[1]) == 1)
+            bitstrings.append(parts[4])
 
-    # rev_targets lets us get information by col_id instead of target
+    return col_id, indexed.compound_hashes(bitstrings)
 
-    # each file is a column, build the dataset in the same order
-    
-    # we only include actives
-    hashmap = {}
 
-    rev_targets, target_columns = helpers.get_rev_targets(data_type)
+
+def gen_hashmap(data_type, processes=None):
+
+    fold_path = data_helpers.get_fold_path(data_type)
+
+    # rev_targets lets us get information by col_id instead of target
+    # each file is a column, build the dataset in the same order
+    rev_targets, target_columns = data_helpers.get_rev_targets(data_type)
     num_cols = len(target_columns)
 
-    base_row = [0] * num_cols
-    overlap = 0
-    count = 0
-
-    for col_id in range(num_cols):
-
-        target = rev_targets[col_id]['target']
-        fname = rev_targets[col_id]['fname']
-        # print 'now on ' + str(col_id)
-        # add only active file entries to the hashmap
-        with open(fold_path + '/' + fname) as f:
-            lines = f.readlines()
-            for line in lines:
-                # this is the structure 
-                # [hash_id, is_active, native_id, fold, bitstring]
-                parts = line.rstrip('\n').split(r' ')
-                hash_id = parts[4]
-                is_active = int(parts[1])
-                assert(is_active == 1)
-
-                if(hash_id in hashmap):
-                    # there's overlap of bitstrings, even in the same dataset
-                    # print hash_id 
-                    # print target
-                    # print fname
-                    # exit(0)
-                    # the row already exists
-                    overlap += 1
-                    row = hashmap[hash_id]
-                    row[col_id] = 1
-                    # add our new column
-                else:
-                    row = base_row[:]
-                    row[col_id] = 1
-                    hashmap[hash_id] = row
-
-                count += 1
-                # update the active in this row    
-
-    # print 'dumped hashmap for dataset: ' + data_type
-    # print str(count) + ' items found'
-    # print str(overlap) + ' total overlap'
-
-    new_count = 0
-    for row in hashmap.iteritems():
-        new_count += sum(row[1])
+    # we only include actives
+    jobs = [(col_id, fold_path + '/' + rev_targets[col_id]['fname'])
+        for col_id in range(num_cols)]
+
+    pool = Pool(processes)
+    col_hashes = [None] * num_cols
+    for col_id, hashes in pool.imap_unordered(read_actives, jobs):
+        col_hashes[col_id] = hashes
+    pool.close()
+    pool.join()
+
+    # one (compound, target) pair per active row
+    hashes = np.concatenate(col_hashes)
+    cols = np.concatenate([np.repeat(col_id, len(col_hashes[col_id]))
+        for col_id in range(num_cols)]).astype(np.int64)
+    count = len(hashes)
+    del col_hashes
+
+    # there's overlap of bitstrings, even in the same dataset; merge them
+    keys, rows = np.unique(hashes, return_inverse=True)
+    pairs = np.unique(rows.astype(np.int64) * num_cols + cols)
+    rows = pairs // num_cols
+    cols = pairs % num_cols
+    del hashes, pairs
+
+    labels = indexed.write_label_matrix(data_type, keys, rows, cols, num_cols)
+
+    new_count = int(labels['data'].sum())
     print data_type + ': ' + str(new_count) + ' items in final hashmap. ' + \
         str(count - new_count) + ' bitstrings merged'
 
+    actives_per_target = np.bincount(cols, minlength=num_cols)
+    print str(len(keys)) + ' compounds, ' + \
+        str(actives_per_target.sum()) + ' confirmed_actives'
+
+    # binary version used by generate_multitask
+    dense = np.zeros((len(keys), num_cols), dtype=np.uint8)
+    dense[rows, cols] = 1
+    num_rows = indexed.write_indexed_hashmap(data_type, keys, dense)
+    print 'wrote indexed hashmap for ' + data_type + ': ' + str(num_rows) + \
+        ' compounds'
 
-    confirmed_actives = 0
-    print 'Dumping the hashmap to disk'
-    with open(hashmap_path, 'w') as file_obj:
-        for line in hashmap.iteritems():
-            
-            # build a row... 
-            bitstring = line[0]
-            is_actives = ' '.join(map(str, line[1]))  
-            row = bitstring + ' ' + is_actives
 
-            """row format: <1024 bitstring> <is_active, 1 per target>"""
-            file_obj.write(row + '\n')
 
-            confirmed_actives += len(re.findall('1', is_actives))
+def index_hashmap(data_type):
+    """ convert an existing hashmaps/<data_type>.hm into the binary format """
+    hashmap = data_helpers.load_hashmap(data_type)
+    bitstrings = hashmap.keys()
+    hashes = indexed.compound_hashes(bitstrings)
+    labels = np.array([hashmap[b] for b in bitstrings], dtype=np.uint8)
 
-    print str(confirmed_actives) + ' confirmed_actives'
+    num_rows = indexed.write_indexed_hashmap(data_type, hashes, labels)
+    print 'wrote indexed hashmap for ' + data_type + ': ' + str(num_rows) + \
+        ' compounds'
 
 
 
 def main(args):
     if(len(args) < 2):
         print 'usage: <tox21, dud_e, muv, or pcba>'
+        print 'usage: <tox21, dud_e, muv, or pcba> index'
+        print 'index: only convert an existing .hm file to the binary format'
+        return
+
+    if(len(args) > 2 and args[2] == 'index'):
+        # converting an existing hashmap is quick; no need for the guard below
+        data_types = {'tox21': 'Tox21', 'dud_e': 'DUD-E', 'dude': 'DUD-E',
+            'muv': 'MUV', 'pcba': 'PCBA'}
+        if(args[1] not in data_types):
+            print 'dataset param not found. options: tox21, dud_e, muv, or pcba'
+            return
+
+        index_hashmap(data_types[args[1]])
         return
 
     ################################################################################
@@ -8,94 +8,96 @@ Randomly sample with replacement & generate multitask datasets
 -Use stratified sampling across all tasks with replacement to fill the batches
 -Target is about 10k items per file
 
+All compounds of the dataset live in one shared table (see
+lib/theano/compound_table.py); a batch is just an array of table rows, so
+all samples of a task are drawn at once & the labels come from a single
+vectorized lookup. Batches are written by a pool of workers, each batch with
+its own RandomState(seed + batch number) so the output doesn't depend on the
+number of workers.
+
 @author: Jason Feriante <feriante@cs.wisc.edu>
 @date: 26 July 2015
 """
-import os, hashlib, sys, random, time, math
-from lib.theano import helpers
+import sys, time, math
+import numpy as np
+from multiprocessing import Pool
+from lib.theano.compound_table import load_compound_table
 
 
+# rows per multitask file (approximately)
+batch_rows = 10000
 
-def gen_multitask(data_type, size = False):
+# shared with the pool workers (set before the pool is forked)
+table = None
 
-    print "Loading hashmap for " + str(data_type)
-    hashmap = helpers.load_string_col_hashmap(data_type, size)
-    rev_targets, target_columns = helpers.get_rev_targets(data_type)
 
-    """Load data from the existing folds"""
-    fold_path = helpers.get_fold_path(data_type)
 
-    if(helpers.is_numeric(size) and size > 0 and size < 260):
-        # Hardcode PCBA to 40 targets
-        new_target_columns = []
-        new_targets = {}
-        # truncate things to contain 40 columns for PCBA
-        for col_id in range(size):
-            new_targets[col_id] = rev_targets[col_id]
-            new_target_columns.append(target_columns[col_id])
+def sample_batch(table, task_ratio, rng):
+    """ draw task_ratio inactives & task_ratio actives from every task """
+    """ returns shuffled table rows & fold ids """
+    rows = []
+    for col_id in range(len(table.actives)):
+        inactives = table.inactives[col_id]
+        actives = table.actives[col_id]
 
-        # wipe out the rev target data
-        rev_targets.clear()
-        rev_targets = new_targets
-        target_columns = new_target_columns
-        
+        # one inactive, then one active; task_ratio times
+        pairs = np.empty((task_ratio, 2), dtype=np.int64)
+        pairs[:, 0] = inactives[rng.randint(0, len(inactives), task_ratio)]
+        pairs[:, 1] = actives[rng.randint(0, len(actives), task_ratio)]
+        rows.append(pairs.ravel())
 
-    # build task object to contain the datasets
-    tasks = {}
-    for col_id in range(len(target_columns)):
+    rows = np.concatenate(rows)
 
-        target = rev_targets[col_id]['target']
-        tasks[target] = {'actives': [], 'inactives': [], 
-            'active_count':0, 'inactive_count':0}
+    # each pair gets the next fold id, 0 to 4 (round robin within a task)
+    folds = np.tile(np.repeat(np.arange(task_ratio) % 5, 2), len(table.actives))
 
+    # pre-shuffle the data
+    shuffle = rng.permutation(len(rows))
+
+    return rows[shuffle], folds[shuffle]
+
+
+
+def format_rows(table, rows, folds):
+    """ build every line of a batch file in one uint8 matrix """
+    """ row format: <bitstring> fl<fold> <label, 1 per target> """
+    n_bits = table.n_bits
+    num_cols = table.labels.shape[1]
+    width = n_bits + 5 + 2 * num_cols
+
+    lines = np.empty((len(rows), width), dtype=np.uint8)
+    lines[:, :n_bits] = table.unpack(rows) + ord('0')
+    lines[:, n_bits:n_bits + 3] = np.fromstring(' fl', dtype=np.uint8)
+    lines[:, n_bits + 3] = folds + ord('0')
+    lines[:, n_bits + 4:width - 1:2] = ord(' ')
+    lines[:, n_bits + 5:width:2] = table.labels[rows] + ord('0')
+    lines[:, width - 1] = ord('\n')
+
+    return lines
 
-    print "Building active / inactive sets for " + str(data_type)
 
-    # Load actives
-    count_actives = 0
-    """<target>_actives.fl"""
-    for col_id in range(len(target_columns)):
-        target = rev_targets[col_id]['target']
-        fname = rev_targets[col_id]['fname']
 
-        with open(fold_path + '/' + fname) as f:
-            lines = f.readlines()
+def write_batch(job):
+    """ sample & write one multitask file; job = (filename, task_ratio, seed) """
+    filename, task_ratio, seed = job
 
-            for line in lines:
-                # [hash_id, is_active, native_id, fold, bitstring]
-                parts = line.rstrip('\n').split(r' ')
-                bitstring = parts[4]
-                is_active = int(parts[1])
-                assert(is_active == 1)
-                tasks[target]['actives'].append(bitstring)
-                count_actives += 1
+    rng = np.random.RandomState(seed)
+    rows, folds = sample_batch(table, task_ratio, rng)
 
+    # write the batch to disk
+    with open(filename, 'wb') as file_obj:
+        file_obj.write(format_rows(table, rows, folds).tostring())
 
-    # Load inactives
-    count_inactives = 0
-    """<target>_inactives.fl"""
-    for col_id in range(len(target_columns)):
-        target = rev_targets[col_id]['target']
-        fname = target + '_inactives.fl'
+    return len(rows)
 
-        with open(fold_path + '/' + fname) as f:
-            lines = f.readlines()
 
-            for line in lines:
-                # [hash_id, is_active, native_id, fold, bitstring]
-                parts = line.rstrip('\n').split(r' ')
-                bitstring = parts[4]
-                is_active = int(parts[1])
-                assert(is_active == 0)
-                tasks[target]['inactives'].append(bitstring)
-                count_inactives += 1
 
+def gen_multitask(data_type, size = None, seed = 1234, processes = None):
 
+    global table
 
-    for col_id in range(len(target_columns)):
-        target = rev_targets[col_id]['target']
-        tasks[target]['inactive_count'] = len(tasks[target]['inactives']) - 1
-        tasks[target]['active_count'] = len (tasks[target]['actives']) - 1
+    print "Building active / inactive sets for " + str(data_type)
+    table = load_compound_table(data_type, size, processes)
 
     # now, we use tasks to "multitask"... 
     # build a set of 10k items
@@ -104,80 +106,42 @@ def gen_multitask(data_type, size = False):
     # 3-sample randomly with replacment
     # 4-write to file with the 'truth' column in the hashmap
     # not in hashmap = all targets inactive
-    #iterate through each task drawing 10 active & 10 inactive randomly
     
-
     # we will make random batches around the size of the original dataset
-    multitask_size = count_inactives + count_actives
+    multitask_size = sum([len(ids) for ids in table.actives]) + \
+        sum([len(ids) for ids in table.inactives])
 
     # let's give each task an equal proportion for now 
     # (this is very naive, considering variations in batch size)
     # however, each target counts equal weight towards overall accuracy
-    task_count = len(target_columns)
+    task_count = len(table.actives)
 
     # this is really 1/2 the ratio since we sample once from each data-type
-    task_ratio = int(math.ceil( (10000.0 / task_count) / 2 ) )
+    task_ratio = int(math.ceil( (float(batch_rows) / task_count) / 2 ) )
 
-    # build default set of inactive columns
-    inactive_cols = [0] * task_count
-    inactive_cols = ' '.join(str(v) for v in inactive_cols)
+    num_batches = int(math.ceil(multitask_size / float(batch_rows)))
 
     """ where we will store our multitask batches """
     multitask_path = 'multitask/' + data_type + '/batch'
 
-    print "Writing out multitask files for " + str(data_type)
-
-    batch_count = 0
-    # keep building batches until we make 'enough'
-    while(multitask_size > 0):
-        
-        multitask = []
-        #draw stratified samples based on the ratio
-        for col_id in range(len(target_columns)):
-
-            fold = 0
-            for i in range(task_ratio):
-                target = rev_targets[col_id]['target']
-
-                # generate a foldID
-                fold_id = ' fl' + str(fold) + ' '
-
-                # insert an inactive
-                inactive = random.choice(tasks[target]['inactives'])
-                if inactive in hashmap:
-                    multitask.append(inactive + fold_id + hashmap[inactive])
-                else:
-                    multitask.append(inactive + fold_id + inactive_cols)
-                
-                # insert an active
-                active = random.choice(tasks[target]['actives'])
-                if active in hashmap:
-                    multitask.append(inactive + fold_id + hashmap[active])
-                else:
-                    # this should never happen
-                    raise ValueError('active not in hashmap!!!')
-
-                fold += 1
-                if(fold >= 5):
-                    fold = 0
-
-
-        # pre-shuffle the data
-        random.shuffle(multitask)
+    print "Writing out " + str(num_batches) + " multitask files for " + \
+        str(data_type) + " (" + str(len(table)) + " compounds, " + \
+        str(task_count) + " tasks)"
 
+    jobs = []
+    for batch_count in range(num_batches):
         # prevent the files from falling into a strange ordering
         batch_name = str(batch_count).zfill(5)
-
-        # write the batch to disk
         filename = multitask_path + batch_name + '.fl'
-        with open(filename, 'w') as file_obj:
-            for row in multitask:
-                file_obj.write(row + '\n')
+        jobs.append((filename, task_ratio, seed + batch_count))
 
+    pool = Pool(processes)
+    num_rows = sum(pool.imap_unordered(write_batch, jobs))
+    pool.close()
+    pool.join()
+
+    print str(num_rows) + " rows written"
 
-        batch_count += 1
-        multitask_size -= 10000
-    
 
 def main(args):
     """ Evenly draw from all datasets to create minibatches """
@@ -195,6 +159,11 @@ def main(args):
 
     dataset = args[1]
 
+    # all label columns unless told otherwise
+    size = None
+    if(len(args) > 2):
+        size = int(args[2])
+
     # in case of typos
     if(dataset == 'dude'):
         dataset = 'dud_e'
@@ -203,20 +172,15 @@ def main(args):
         + dataset + "........."
 
     if(dataset == 'tox21'):
-        gen_multitask('Tox21')
+        gen_multitask('Tox21', size)
 
     elif(dataset == 'dud_e'):
-        gen_multitask('DUD-E')
+        gen_multitask('DUD-E', size)
 
     elif(dataset == 'muv'):
-        gen_multitask('MUV')
+        gen_multitask('MUV', size)
 
     elif(dataset == 'pcba'):
-        # PCBA is massive; this setting allows a smaller multitask dataset
-        # to be created
-        if(len(args) > 2):
-            size = int(args[2])
-
         gen_multitask('PCBA', size)
     else:
         print 'dataset param not found. options: tox21, dud_e, muv, or pcba'
@@ -0,0 +1,154 @@
+"""
+**************************************************************************
+Checkpoints
+**************************************************************************
+
+Periodic checkpoints so a preempted (or SIGTERM'd) job picks up where it
+left off instead of starting over. A checkpoint holds:
+
+shared      values of the theano shared variables handed to the Checkpoint:
+            parameters, RBM visible biases, optimizer state & the state of
+            the MRG_RandomStreams
+numpy_rng   numpy's global random state, plus the state of every
+            RandomState handed to the Checkpoint
+progress    where the driver was: phase (pretrain / finetune), layer, epoch,
+            minibatch, early stopping state & best-so-far metrics
+key         the settings of the run; a checkpoint of another run (other
+            target, fold, architecture, learning rates ...) is ignored
+
+Checkpoints are written to a temp file & renamed over the old one, so a
+job killed in the middle of a write still has the previous checkpoint.
+Jobs only get a short grace period after SIGTERM: install_sigterm_handler
+turns SIGTERM into a flag the training loops check after every minibatch
+(they checkpoint & stop; the driver then exits).
+
+Checkpoints go to $DBN_CHECKPOINT_DIR (default: checkpoints/) & are removed
+once a run completes.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 18 Sept 2015
+"""
+
+import cPickle, os, signal, sys, time
+import numpy
+
+
+checkpoint_env = 'DBN_CHECKPOINT_DIR'
+checkpoint_dir = 'checkpoints'
+
+# set by the SIGTERM handler
+terminate_requested = False
+
+
+
+def sigterm_handler(signum, frame):
+    global terminate_requested
+    terminate_requested = True
+    print >> sys.stderr, 'SIGTERM: checkpointing after this minibatch'
+
+
+
+def install_sigterm_handler():
+    """ SIGTERM sets terminate_requested instead of killing the process """
+    signal.signal(signal.SIGTERM, sigterm_handler)
+
+
+
+def get_checkpoint_path(name):
+    """ checkpoint file for a run name, e.g. 'dbn.MUV.466.0' """
+    path = os.environ.get(checkpoint_env, checkpoint_dir)
+    return os.path.join(path, name + '.ckpt')
+
+
+
+def atomic_dump(obj, path):
+    """ pickle obj to path via a temp file + rename """
+    dir_name = os.path.dirname(path)
+    if(len(dir_name) > 0 and not os.path.isdir(dir_name)):
+        os.makedirs(dir_name)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        cPickle.dump(obj, f, cPickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+
+class Checkpoint(object):
+    """ save / restore the state of one training run """
+
+    def __init__(self, path, shared, rngs=None, key=None, every=600):
+        """
+        :type path: string
+        :param path: checkpoint file (see get_checkpoint_path)
+
+        :type shared: list of theano shared variables
+        :param shared: everything the run updates: params, optimizer state,
+                       random stream states
+
+        :type rngs: list of numpy.random.RandomState
+        :param rngs: random generators to save besides numpy's global one
+
+        :type key: dict
+        :param key: the settings of the run; must match to resume
+
+        :type every: float
+        :param every: seconds between periodic checkpoints
+        """
+        self.path = path
+        self.shared = list(shared)
+        self.rngs = list(rngs or [])
+        self.key = key
+        self.every = every
+        self.last_save = time.time()
+
+    def due(self):
+        """ time for a periodic checkpoint (or we're being terminated) """
+        return terminate_requested or time.time() - self.last_save >= self.every
+
+    def save(self, progress):
+        """ write the checkpoint; progress is the driver's position """
+        atomic_dump({
+            'key': self.key,
+            'shared': [s.get_value() for s in self.shared],
+            'numpy_rng': numpy.random.get_state(),
+            'rngs': [rng.get_state() for rng in self.rngs],
+            'progress': progress,
+            }, self.path)
+        self.last_save = time.time()
+
+    def load(self):
+        """ restore the saved state; returns the saved progress or None """
+        if(not os.path.exists(self.path)):
+            return None
+
+        with open(self.path, 'rb') as f:
+            state = cPickle.load(f)
+
+        if(state['key'] != self.key or len(state['shared']) != len(self.shared)):
+            print >> sys.stderr, 'ignoring checkpoint of another run: ' + self.path
+            return None
+
+        for s, value in zip(self.shared, state['shared']):
+            s.set_value(value)
+        numpy.random.set_state(state['numpy_rng'])
+        for rng, rng_state in zip(self.rngs, state['rngs']):
+            rng.set_state(rng_state)
+
+        print '... resuming from ' + self.path
+        return state['progress']
+
+    def remove(self):
+        """ the run completed; the next one starts fresh """
+        if(os.path.exists(self.path)):
+            os.remove(self.path)
+
+
+
+def exit_if_terminated():
+    """ exit after the final checkpoint if SIGTERM was received """
+    if(terminate_requested):
+        print >> sys.stderr, 'terminated; resume by running the job again'
+        sys.exit(143)
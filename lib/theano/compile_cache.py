@@ -0,0 +1,107 @@
+"""
+**************************************************************************
+Theano Compile Cache
+**************************************************************************
+
+A job array starts dozens of theano processes at once; they all wait on the
+lock of the default compiledir (~/.theano) & each compiles the same C ops
+from cold. Instead:
+
+1. fill a cache directory once, per architecture & float type:
+   $ python th_warm_cache.py <cache_dir> [float32|float64]
+
+2. point the jobs at it:
+   export DBN_COMPILE_CACHE=<cache_dir>
+
+Every driver then copies the (read-only) cache into its own scratch
+directory before theano is imported & uses the copy as its compiledir: no
+lock contention between jobs & nothing left to compile.
+
+This module must not import theano; the flags have to be set first.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 14 Sept 2015
+"""
+
+import atexit, os, shutil, sys, tempfile
+
+
+cache_env = 'DBN_COMPILE_CACHE'
+
+# compiledir of this process once use_compile_cache has set it up
+local_cache = None
+
+
+
+def set_theano_flags(**flags):
+    """ add / replace flags in THEANO_FLAGS (before theano is imported) """
+    current = os.environ.get('THEANO_FLAGS', '')
+    kept = [f for f in current.split(',')
+        if len(f) > 0 and f.split('=')[0].strip() not in flags]
+    for name in sorted(flags):
+        kept.append(name + '=' + str(flags[name]))
+
+    os.environ['THEANO_FLAGS'] = ','.join(kept)
+
+
+
+def get_scratch_dir():
+    """ node local scratch space (HTCondor / PBS), else the temp dir """
+    for name in ['_CONDOR_SCRATCH_DIR', 'TMPDIR']:
+        if(os.environ.get(name) and os.path.isdir(os.environ[name])):
+            return os.environ[name]
+
+    return tempfile.gettempdir()
+
+
+
+def use_compile_cache(cache_dir=None, scratch_dir=None):
+    """ copy the pre-warmed cache to scratch & make it theano's compiledir """
+    """ cache_dir defaults to $DBN_COMPILE_CACHE; does nothing if neither is """
+    """ set. Returns the compiledir in use (or None) """
+    global local_cache
+
+    if(local_cache is not None):
+        return local_cache
+
+    if(cache_dir is None):
+        cache_dir = os.environ.get(cache_env)
+    if(not cache_dir):
+        return None
+
+    if('theano' in sys.modules):
+        print >> sys.stderr, 'compile cache: theano is already imported, ' + \
+            'ignoring ' + cache_dir
+        return None
+
+    if(not os.path.isdir(cache_dir)):
+        print >> sys.stderr, 'compile cache not found: ' + cache_dir
+        return None
+
+    if(scratch_dir is None):
+        scratch_dir = get_scratch_dir()
+
+    job_dir = tempfile.mkdtemp(prefix='theano-', dir=scratch_dir)
+    atexit.register(shutil.rmtree, job_dir, True)
+
+    local_cache = os.path.join(job_dir, 'compiledir')
+    shutil.copytree(cache_dir, local_cache)
+    set_theano_flags(base_compiledir=local_cache)
+
+    return local_cache
+
+
+
+def warm_compile_cache(cache_dir, floatX='float64'):
+    """ compile straight into cache_dir (see th_warm_cache.py) """
+    if('theano' in sys.modules):
+        raise ValueError('warm_compile_cache must run before theano is imported')
+
+    if(not os.path.isdir(cache_dir)):
+        os.makedirs(cache_dir)
+
+    # the drivers imported while warming must not swap in another cache
+    os.environ.pop(cache_env, None)
+    set_theano_flags(base_compiledir=os.path.abspath(cache_dir), floatX=floatX)
+
+    return os.path.abspath(cache_dir)
@@ -0,0 +1,211 @@
+"""
+**************************************************************************
+Compound Table
+**************************************************************************
+
+One shared table of the (deduplicated) compounds in a dataset's fold files,
+plus per-task index arrays into it. Used to build multitask batches without
+keeping millions of 1024 / 2048 character python strings around:
+
+fps         (n, n_bits / 8) uint8, packed fingerprints (np.packbits)
+hashes      (n,) uint64 compound hashes (see lib/theano/hashmap.py)
+folds       (n,) int8, fold of the compound for the multitask split,
+            assigned from its hash (hash_folds): the same for every target
+fold_mask   (n,) uint8, bit f is set if the compound is in fold f of any
+            target's fold files (the folds are assigned per file, so a
+            compound can be in several)
+labels      (n, num_cols) uint8 label columns from the indexed hashmap
+actives     actives[col_id] = int64 table rows of the task's actives
+inactives   inactives[col_id] = int64 table rows of the task's inactives
+
+The fold files are parsed in parallel (one file per job) & merged into the
+table in file order, so the table is the same no matter how many processes
+are used.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 05 Sept 2015
+"""
+
+import numpy as np
+from multiprocessing import Pool
+from lib.theano import data_helpers
+from lib.theano.hashmap import IndexedHashmap, compound_hashes
+
+
+# folds of the multitask split (see hash_folds)
+num_folds = 5
+
+
+
+# generate_folds assigns the folds per target file, so a compound can be in
+# the test fold of one target & the training folds of another. A multitask
+# minibatch carries every target's label, so its split needs one fold per
+# compound: this one, which differs from the fold files'.
+def hash_folds(hashes):
+    """ (n,) int8 fold of each compound hash """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    return (hashes % np.uint64(num_folds)).astype(np.int8)
+
+
+
+def pack_bitstrings(bitstrings):
+    """ list of equal length '0101...' strings -> (n, n_bits / 8) uint8 """
+    n_bits = len(bitstrings[0])
+    bits = np.frombuffer(''.join(bitstrings), dtype=np.uint8)
+    bits = bits.reshape(len(bitstrings), n_bits) - ord('0')
+
+    return np.packbits(bits, axis=1)
+
+
+
+def read_fold_file(job):
+    """ parse one fold file; job = (path, is_active) """
+    """ returns hashes, packed fingerprints, folds """
+    path, is_active = job
+
+    bitstrings = []
+    folds = []
+    with open(path) as f:
+        for line in f:
+            # [hash_id, is_active, native_id, fold, bitstring]
+            parts = line.rstrip('\n').split(r' ')
+            assert(int(parts[1]) == is_active)
+            folds.append(int(parts[3]))
+            bitstrings.append(parts[4])
+
+    if(len(bitstrings) == 0):
+        return np.zeros(0, dtype=np.uint64), None, np.zeros(0, dtype=np.int8)
+
+    return compound_hashes(bitstrings), pack_bitstrings(bitstrings), \
+        np.array(folds, dtype=np.int8)
+
+
+
+class CompoundTable(object):
+    """ deduplicated compounds of a dataset + per-task index arrays """
+
+    def __init__(self):
+        self.fps = None
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.folds = np.zeros(0, dtype=np.int8)
+        self.fold_mask = np.zeros(0, dtype=np.uint8)
+        self.labels = None
+        self.actives = []
+        self.inactives = []
+        self.n_bits = 0
+
+        # chunks waiting to be concatenated & a sorted view of the hashes
+        self._fps = []
+        self._hashes = []
+        self._fold_masks = []
+        self._sorted = np.zeros(0, dtype=np.uint64)
+        self._order = np.zeros(0, dtype=np.int64)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def merge(self, hashes, fps, folds):
+        """ add one file's compounds; returns the table row of each row """
+        if(len(hashes) == 0):
+            return np.zeros(0, dtype=np.int64)
+
+        uniq, first, inverse = np.unique(hashes, return_index=True,
+            return_inverse=True)
+
+        ids = np.empty(len(uniq), dtype=np.int64)
+        found = np.zeros(len(uniq), dtype=bool)
+        if(len(self._sorted) > 0):
+            pos = np.minimum(np.searchsorted(self._sorted, uniq),
+                len(self._sorted) - 1)
+            found = self._sorted[pos] == uniq
+            ids[found] = self._order[pos[found]]
+
+        new = ~found
+        num_new = int(new.sum())
+        ids[new] = np.arange(self._count, self._count + num_new)
+
+        # every fold this file puts each compound in
+        masks = np.zeros(len(uniq), dtype=np.uint8)
+        np.bitwise_or.at(masks, inverse,
+            np.left_shift(1, folds.astype(np.uint8)).astype(np.uint8))
+        self._fold_masks.append((ids, masks))
+
+        if(num_new > 0):
+            rows = first[new]
+            self._fps.append(fps[rows])
+            self._hashes.append(uniq[new])
+
+            keys = np.concatenate([self._sorted, uniq[new]])
+            order = np.concatenate([self._order, ids[new]])
+            sort = np.argsort(keys, kind='mergesort')
+            self._sorted = keys[sort]
+            self._order = order[sort]
+            self._count += num_new
+
+        return ids[inverse]
+
+    def finalize(self):
+        """ concatenate the merged chunks into the final arrays """
+        """ (call once, after the last merge) """
+        if(len(self._fps) > 0):
+            self.fps = np.concatenate(self._fps)
+            self.hashes = np.concatenate(self._hashes)
+            self.folds = hash_folds(self.hashes)
+            self.n_bits = self.fps.shape[1] * 8
+
+            self.fold_mask = np.zeros(self._count, dtype=np.uint8)
+            np.bitwise_or.at(self.fold_mask,
+                np.concatenate([ids for ids, masks in self._fold_masks]),
+                np.concatenate([masks for ids, masks in self._fold_masks]))
+
+        self._fps = []
+        self._hashes = []
+        self._fold_masks = []
+
+    def unpack(self, rows):
+        """ (len(rows), n_bits) uint8 matrix of {0, 1} fingerprints """
+        return np.unpackbits(self.fps[rows], axis=1)
+
+
+
+def load_compound_table(data_type, num_cols=None, processes=None):
+    """ build the compound table from the fold files of data_type """
+    """ if num_cols is given only the first num_cols targets are loaded """
+    fold_path = data_helpers.get_fold_path(data_type)
+    rev_targets, target_columns = data_helpers.get_rev_targets(data_type)
+
+    if(num_cols is None or num_cols > len(target_columns)):
+        num_cols = len(target_columns)
+
+    # <target>_actives.fl & <target>_inactives.fl for every task
+    jobs = []
+    for col_id in range(num_cols):
+        target = rev_targets[col_id]['target']
+        jobs.append((fold_path + '/' + rev_targets[col_id]['fname'], 1))
+        jobs.append((fold_path + '/' + target + '_inactives.fl', 0))
+
+    table = CompoundTable()
+    pool = Pool(processes)
+    # imap keeps the file order, so the table doesn't depend on the pool
+    for i, (hashes, fps, folds) in enumerate(pool.imap(read_fold_file, jobs)):
+        ids = table.merge(hashes, fps, folds)
+        if(i % 2 == 0):
+            table.actives.append(ids)
+        else:
+            table.inactives.append(ids)
+    pool.close()
+    pool.join()
+
+    table.finalize()
+
+    # one vectorized lookup for every compound in the dataset
+    hashmap = IndexedHashmap(data_type)
+    found, table.labels = hashmap.lookup(table.hashes, num_cols)
+
+    for col_id in range(num_cols):
+        if(not found[table.actives[col_id]].all()):
+            # this should never happen
+            raise ValueError('active not in hashmap!!!')
+
+    return table
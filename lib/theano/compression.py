@@ -0,0 +1,118 @@
+"""
+**************************************************************************
+Model Compression
+**************************************************************************
+
+Compresses the first layer of a trained model, the n_ins x n_hidden
+(1024 x 2000) matrix built in DBN.__init__ (the HiddenLayer sharing W with
+the first RBM), which is the costliest part of every forward pass:
+
+low_rank    truncated SVD: W ~= U . V with U (n_ins, rank) & V (rank,
+            n_hidden); the singular values are split evenly between them
+prune       magnitude pruning: the smallest |w| are set to zero, giving a
+            0/1 mask that fine-tuning keeps applied
+
+Both together prune the factors of the low-rank layer. The weights stay
+numpy arrays in model_io's layout (a low-rank layer is a (U, V) pair), so
+th_compress_model.py can fine-tune them in theano & save_model can write
+them. This module must not import theano.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 25 Sept 2015
+"""
+
+import numpy as np
+
+
+
+def low_rank(W, rank):
+    """ (U, V) of the best rank-r approximation of W (truncated SVD) """
+    n_in, n_out = W.shape
+    if(rank < 1 or rank > min(n_in, n_out)):
+        raise ValueError('rank must be between 1 and ' +
+            str(min(n_in, n_out)) + ', not: ' + str(rank))
+
+    U, s, Vt = np.linalg.svd(W, full_matrices=False)
+    root = np.sqrt(s[:rank])
+
+    return (np.ascontiguousarray(U[:, :rank] * root),
+            np.ascontiguousarray(root[:, np.newaxis] * Vt[:rank]))
+
+
+
+def prune(W, sparsity):
+    """ W with the smallest sparsity fraction of |w| zeroed & its 0/1 mask """
+    if(sparsity < 0 or sparsity >= 1):
+        raise ValueError('sparsity must be in [0, 1), not: ' + str(sparsity))
+
+    k = int(round(sparsity * W.size))
+    if(k == 0):
+        return W.copy(), np.ones_like(W)
+
+    magnitude = np.abs(W)
+    threshold = np.partition(magnitude.ravel(), k - 1)[k - 1]
+    mask = (magnitude > threshold).astype(W.dtype)
+
+    return W * mask, mask
+
+
+
+def compress(W, rank=None, sparsity=0.):
+    """
+    Compress one layer
+
+    :type rank: int
+    :param rank: rank of the factorization; None keeps W whole
+
+    :type sparsity: float
+    :param sparsity: fraction of the weights (of each factor) to prune
+
+    returns the weights, W or (U, V), & the masks of the pruned arrays
+    (a matching W or (U, V) of masks; None if nothing is pruned)
+    """
+    arrays = [W] if rank is None else list(low_rank(W, rank))
+
+    masks = None
+    if(sparsity > 0):
+        pruned = [prune(a, sparsity) for a in arrays]
+        arrays = [a for a, mask in pruned]
+        masks = [mask for a, mask in pruned]
+        masks = masks[0] if rank is None else tuple(masks)
+
+    return (arrays[0] if rank is None else tuple(arrays)), masks
+
+
+
+def layer_macs(W, density=1.):
+    """ multiply-adds per compound of a first layer, skipping zero weights """
+    """ density: fraction of the input bits that are on """
+    if(isinstance(W, tuple)):
+        U, V = W
+        return density * np.count_nonzero(U) + np.count_nonzero(V)
+
+    return density * np.count_nonzero(W)
+
+
+
+def model_macs(model, density=1.):
+    """ multiply-adds per compound of a model_io.Model """
+    """ density < 1 counts the first layer as a gather-sum over on bits """
+    if(len(model.hidden) == 0):
+        return density * model.W_out.size
+
+    macs = layer_macs(model.hidden[0][0], density)
+    for W, b in model.hidden[1:]:
+        macs += W.size
+
+    return macs + model.W_stacked.size
+
+
+
+def num_weights(model):
+    """ nonzero weights of a model_io.Model """
+    arrays = [model.W_out, model.b_out]
+    for W, b in model.hidden:
+        arrays.extend(list(W) if isinstance(W, tuple) else [W])
+        arrays.append(b)
+
+    return sum([np.count_nonzero(a) for a in arrays])
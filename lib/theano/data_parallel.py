@@ -0,0 +1,182 @@
+"""
+**************************************************************************
+Data Parallel SGD
+**************************************************************************
+
+Synchronous data parallel fine-tuning over local worker processes: every
+minibatch is split into K shards, K - 1 forked workers & the main process
+each compute the gradient of their shard, the gradients are averaged
+(weighted by shard size, so the step equals the single process step) &
+the parameters are updated in lockstep.
+
+Parameters & gradients live in shared memory (multiprocessing RawArrays
+viewed as numpy arrays): before a step the main process copies its
+parameters into the shared buffer, each worker points its own parameters
+at it & writes its gradients into its own slot. Only (begin, end) row
+ranges go through the pipes; the training set is inherited by the workers
+when they're forked, so call start() after the data is in place.
+
+DataParallelSGD.step(index, lr) has the signature of the compiled train
+functions, so it drops into training_loop.train as train_fn.
+
+Every worker runs its own BLAS; set OPENBLAS_NUM_THREADS (or
+OMP_NUM_THREADS / MKL_NUM_THREADS) to cores / K to avoid oversubscription.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 28 Sept 2015
+"""
+
+import multiprocessing
+import numpy
+from multiprocessing.sharedctypes import RawArray
+
+
+ctypes_codes = {'float32': 'f', 'float64': 'd'}
+
+
+
+def shared_array(shape, dtype):
+    """ numpy view of a zeroed RawArray (inherited by forked processes) """
+    size = int(numpy.prod(shape))
+    raw = RawArray(ctypes_codes[str(numpy.dtype(dtype))], size)
+
+    return numpy.frombuffer(raw, dtype=dtype, count=size).reshape(shape)
+
+
+
+def split_views(flat, shapes):
+    """ views of consecutive blocks of flat with the given shapes """
+    views = []
+    offset = 0
+    for shape in shapes:
+        size = int(numpy.prod(shape))
+        views.append(flat[offset:offset + size].reshape(shape))
+        offset += size
+
+    return views
+
+
+
+def worker_loop(sgd, worker, conn):
+    """ compute shard gradients until told to stop (None) """
+    while True:
+        job = conn.recv()
+        if(job is None):
+            break
+        sgd.compute(worker, job[0], job[1], set_params=True)
+        conn.send(True)
+
+
+
+class DataParallelSGD(object):
+    """ lockstep minibatch SGD with gradients averaged over K processes """
+
+    def __init__(self, params, grad_fn, train_x, train_y, batch_size,
+                 num_workers=2):
+        """
+        :type params: list of theano shared variables
+        :param params: the parameters, in the order grad_fn returns their
+                       gradients
+
+        :type grad_fn: theano function
+        :param grad_fn: grad_fn(x, y) returns [cost] + the gradient of every
+                        param; compiled before start() so workers inherit it
+
+        :type train_x: numpy array
+        :param train_x: the training inputs (rows)
+
+        :type train_y: numpy array
+        :param train_y: the training labels
+
+        :type num_workers: int
+        :param num_workers: K, the number of processes sharing a minibatch
+                            (the main process counts as one)
+        """
+        if(num_workers < 1 or num_workers > batch_size):
+            raise ValueError('num_workers must be between 1 and the batch ' +
+                'size, not: ' + str(num_workers))
+
+        self.params = list(params)
+        self.grad_fn = grad_fn
+        self.train_x = train_x
+        self.train_y = train_y
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+
+        values = [p.get_value(borrow=True) for p in self.params]
+        self.shapes = [v.shape for v in values]
+        dtype = values[0].dtype
+        total = sum([v.size for v in values])
+
+        # parameters, one gradient slot & one cost per worker
+        self.param_flat = shared_array((total,), dtype)
+        self.grad_flat = shared_array((num_workers, total), dtype)
+        self.costs = shared_array((num_workers,), 'float64')
+        self.param_views = split_views(self.param_flat, self.shapes)
+        self.grad_views = [split_views(self.grad_flat[k], self.shapes)
+            for k in range(num_workers)]
+
+        self.processes = []
+        self.conns = []
+
+    def start(self):
+        """ fork the K - 1 workers """
+        for worker in range(1, self.num_workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=worker_loop,
+                args=(self, worker, child))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+            self.conns.append(parent)
+
+        return self
+
+    def stop(self):
+        for conn in self.conns:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
+        self.processes = []
+        self.conns = []
+
+    def shards(self, begin, end):
+        """ K (begin, end) row ranges covering begin:end """
+        bounds = numpy.linspace(begin, end, self.num_workers + 1).astype(int)
+        return zip(bounds[:-1], bounds[1:])
+
+    def compute(self, worker, begin, end, set_params=False):
+        """ gradient of rows begin:end into the worker's slot """
+        if(set_params):
+            # point this process's parameters at the shared values
+            for param, view in zip(self.params, self.param_views):
+                param.set_value(view, borrow=True)
+
+        outputs = self.grad_fn(self.train_x[begin:end], self.train_y[begin:end])
+        self.costs[worker] = outputs[0]
+        for slot, grad in zip(self.grad_views[worker], outputs[1:]):
+            slot[...] = grad
+
+    def step(self, index, learning_rate):
+        """ one SGD step on minibatch index; returns its mean cost """
+        begin = index * self.batch_size
+        shards = self.shards(begin, begin + self.batch_size)
+
+        for param, view in zip(self.params, self.param_views):
+            view[...] = param.get_value(borrow=True)
+        for conn, (shard_begin, shard_end) in zip(self.conns, shards[1:]):
+            conn.send((shard_begin, shard_end))
+        self.compute(0, shards[0][0], shards[0][1])
+        for conn in self.conns:
+            conn.recv()
+
+        # each shard's gradient is a mean over its rows: weight by rows
+        weights = numpy.array([e - b for b, e in shards], dtype='float64')
+        weights /= weights.sum()
+        grad = numpy.dot(weights, self.grad_flat)
+        for param, g in zip(self.params, split_views(grad, self.shapes)):
+            value = param.get_value(borrow=True)
+            value -= learning_rate * g
+            param.set_value(value, borrow=True)
+
+        return float(numpy.dot(weights, self.costs))
@@ -0,0 +1,220 @@
+"""
+**************************************************************************
+Indexed Hashmaps
+**************************************************************************
+
+Compact, binary version of hashmaps/<data_type>.hm
+
+The text hashmap is keyed by the full 1024 / 2048 character bitstring, which
+costs gigabytes of python strings for PCBA just to look up labels. Here every
+compound is reduced to a 64 bit hash & the label columns are packed into a
+bitset matrix:
+
+hashmaps/<data_type>.keys.npy      uint64 compound hashes (sorted), shape (n,)
+hashmaps/<data_type>.labels.npy    uint8 packed labels, shape (n, ceil(cols/8))
+
+Row i of the label matrix belongs to keys[i]. Both files are memory-mapped on
+load & lookups are done for a whole batch of compounds at once (searchsorted).
+Compounds that are not in the hashmap are inactive across the board.
+
+generate_hashmaps also saves the same labels as a sparse compound x target
+matrix (scipy CSR layout, readable with scipy.sparse.load_npz):
+
+hashmaps/<data_type>.labels.npz    data / indices / indptr / shape / format
+                                   + keys (uint64 compound hash of each row)
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 02 Sept 2015
+"""
+
+import hashlib, os
+import numpy as np
+from lib.theano import data_helpers
+
+
+hashmap_dir = 'hashmaps'
+
+
+def get_index_paths(data_type):
+    """ keys / labels file names for this data_type """
+    base = hashmap_dir + '/' + data_type
+    return base + '.keys.npy', base + '.labels.npy'
+
+
+
+def get_label_matrix_path(data_type):
+    """ sparse label matrix file name for this data_type """
+    return hashmap_dir + '/' + data_type + '.labels.npz'
+
+
+
+def compound_hash(bitstring):
+    """ 64 bit hash of a fingerprint (the first 8 bytes of its sha1) """
+    return np.frombuffer(hashlib.sha1(bitstring).digest()[:8], dtype='<u8')[0]
+
+
+
+def compound_hashes(bitstrings):
+    """ vector of 64 bit hashes; one per bitstring """
+    if(len(bitstrings) == 0):
+        return np.zeros(0, dtype=np.uint64)
+
+    digests = ''.join([hashlib.sha1(b).digest()[:8] for b in bitstrings])
+    return np.frombuffer(digests, dtype='<u8').astype(np.uint64)
+
+
+
+def build_index(hashes, labels):
+    """ sort the compounds by hash & pack the label columns into bitsets """
+    """ labels: (n, num_cols) matrix of {0, 1} """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    labels = np.asarray(labels, dtype=np.uint8)
+    assert(labels.shape[0] == hashes.shape[0])
+
+    order = np.argsort(hashes, kind='mergesort')
+    keys = hashes[order]
+
+    # two different bitstrings with the same 64 bit hash would silently share
+    # labels; this is astronomically unlikely, but make sure.
+    if(np.any(keys[1:] == keys[:-1])):
+        raise ValueError('duplicate compound hash in hashmap (collision or ' +
+            'bitstrings were not merged)')
+
+    packed = np.packbits(labels[order], axis=1)
+
+    return keys, packed
+
+
+
+def write_indexed_hashmap(data_type, hashes, labels):
+    """ dump the binary hashmap for data_type to disk """
+    keys, packed = build_index(hashes, labels)
+    keys_path, labels_path = get_index_paths(data_type)
+
+    np.save(keys_path, keys)
+    np.save(labels_path, packed)
+
+    return len(keys)
+
+
+
+def write_label_matrix(data_type, keys, rows, cols, num_cols):
+    """ save the (row, col) active pairs as a CSR compound x target matrix """
+    """ rows / cols must be sorted by (row, col) without duplicates; row i """
+    """ belongs to compound keys[i] """
+    num_rows = len(keys)
+    indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=num_rows))
+
+    labels = {
+        'data': np.ones(len(cols), dtype=np.uint8),
+        'indices': np.asarray(cols, dtype=np.int32),
+        'indptr': indptr,
+        'shape': np.array([num_rows, num_cols]),
+        'format': 'csr',
+        'keys': np.asarray(keys, dtype=np.uint64),
+        }
+    np.savez_compressed(get_label_matrix_path(data_type), **labels)
+
+    return labels
+
+
+
+def load_label_matrix(data_type):
+    """ returns (keys, scipy.sparse.csr_matrix of labels) """
+    from scipy import sparse
+
+    with np.load(get_label_matrix_path(data_type)) as f:
+        keys = f['keys']
+        labels = sparse.csr_matrix((f['data'], f['indices'], f['indptr']),
+            shape=tuple(f['shape']))
+
+    return keys, labels
+
+
+
+def label_strings(labels):
+    """ format each row of a {0, 1} label matrix as '0 1 0 ...' (vectorized) """
+    labels = np.asarray(labels, dtype=np.uint8)
+    num_rows, num_cols = labels.shape
+    if(num_cols == 0):
+        return [''] * num_rows
+
+    chars = np.empty((num_rows, 2 * num_cols - 1), dtype=np.uint8)
+    chars[:, 1::2] = ord(' ')
+    chars[:, 0::2] = labels + ord('0')
+
+    return [row.tostring() for row in chars]
+
+
+
+class IndexedHashmap(object):
+    """ memory-mapped binary hashmap with vectorized batch lookups """
+
+    def __init__(self, data_type, num_cols=None, mmap_mode='r'):
+        """
+        :type data_type: string
+        :param data_type: DUD-E, MUV, Tox21 or PCBA
+
+        :type num_cols: int
+        :param num_cols: number of label columns (one per target); defaults to
+                        the size of the target list for data_type
+
+        :type mmap_mode: string
+        :param mmap_mode: passed to numpy.load; None loads it all into memory
+        """
+        keys_path, labels_path = get_index_paths(data_type)
+        if(not os.path.exists(keys_path) or not os.path.exists(labels_path)):
+            raise ValueError('indexed hashmap not found for ' + data_type +
+                '. run generate_hashmaps.py first')
+
+        if(num_cols is None):
+            num_cols = len(data_helpers.get_target_list(data_type))
+
+        self.data_type = data_type
+        self.keys = np.load(keys_path, mmap_mode=mmap_mode)
+        self.packed = np.load(labels_path, mmap_mode=mmap_mode)
+        self.num_cols = num_cols
+
+        assert(self.packed.shape[0] == self.keys.shape[0])
+        assert(self.packed.shape[1] * 8 >= num_cols)
+
+    def __len__(self):
+        return self.keys.shape[0]
+
+    def __contains__(self, bitstring):
+        found, rows = self.find(np.array([compound_hash(bitstring)]))
+        return bool(found[0])
+
+    def find(self, hashes):
+        """ returns (found mask, row index into the label matrix) """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if(len(self.keys) == 0):
+            return np.zeros(hashes.shape, dtype=bool), \
+                np.zeros(hashes.shape, dtype=np.int64)
+
+        rows = np.searchsorted(self.keys, hashes)
+        rows = np.minimum(rows, len(self.keys) - 1)
+        found = self.keys[rows] == hashes
+
+        return found, rows
+
+    def lookup(self, hashes, count=None):
+        """ labels for a batch of compound hashes """
+        """ returns (found mask, (n, num_cols) uint8 label matrix); compounds """
+        """ not in the hashmap get an all-zero (inactive) row. If count is """
+        """ given only the first count columns are returned """
+        if(count is None or count > self.num_cols):
+            count = self.num_cols
+
+        found, rows = self.find(hashes)
+        labels = np.zeros((len(found), count), dtype=np.uint8)
+        if(np.any(found)):
+            packed = np.asarray(self.packed[rows[found]])
+            labels[found] = np.unpackbits(packed, axis=1)[:, :count]
+
+        return found, labels
+
+    def lookup_bitstrings(self, bitstrings, count=None):
+        """ same as lookup, keyed by the raw bitstrings """
+        return self.lookup(compound_hashes(bitstrings), count)
@@ -0,0 +1,225 @@
+"""
+**************************************************************************
+Hogwild! Logistic Regression
+**************************************************************************
+
+Asynchronous, lock-free SGD of the softmax logistic regression (the model
+of th_logistic_regression.py & VirtualScreeningDL/LogReg.py) over local
+worker processes, after Niu et al., "Hogwild!: A Lock-Free Approach to
+Parallelizing Stochastic Gradient Descent" (2011).
+
+W & b live in shared memory (multiprocessing RawArrays viewed as numpy
+arrays, see data_parallel.shared_array). The training rows are shuffled
+once & split into K disjoint shards; each forked worker runs minibatch SGD
+over its own shard & writes its updates straight into the shared W & b
+without any locking. Fingerprints are sparse binary vectors, so a
+minibatch's gradient is zero outside the rows of W at its on bits & only
+those rows are written: workers rarely touch the same weights at the same
+time & the occasional lost update doesn't hurt convergence.
+
+The main process doesn't train: every eval_every seconds it takes a copy
+of W & b (a racy but consistent enough read), scores it with validate()
+& records (seconds, epochs, score). Workers are stopped as soon as the
+score reaches target_score, after patience validations without a better
+score or when every worker has done n_epochs passes over its shard; the
+best scoring copy is kept.
+
+This module must not import theano. Set OPENBLAS_NUM_THREADS=1 (or
+OMP_NUM_THREADS / MKL_NUM_THREADS): the updates are small & every worker
+runs its own BLAS.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 29 Sept 2015
+"""
+
+import multiprocessing, time
+import numpy
+import scipy.sparse
+from multiprocessing.sharedctypes import RawValue
+from lib.theano.data_parallel import shared_array
+
+
+
+def predict(W, b, x):
+    """ P(y | x) of the softmax regression, one row per compound """
+    z = x.dot(W) + b
+    z -= z.max(axis=1)[:, None]
+    e = numpy.exp(z)
+
+    return e / e.sum(axis=1)[:, None]
+
+
+
+def sgd_step(W, b, x, y, learning_rate):
+    """ one lock-free minibatch step, in place; x is a csr minibatch """
+    """ returns its mean negative log likelihood """
+    n = x.shape[0]
+    p = predict(W, b, x)
+    cost = -numpy.log(p[numpy.arange(n), y]).mean()
+
+    # d cost / d z of the mean negative log likelihood
+    p[numpy.arange(n), y] -= 1.
+    p /= n
+
+    # only the rows of W at the minibatch's on bits have a gradient
+    grad = x.T.dot(p)
+    rows = numpy.flatnonzero(grad.any(axis=1))
+    W[rows] -= learning_rate * grad[rows]
+    b -= learning_rate * p.sum(axis=0)
+
+    return cost
+
+
+
+def worker_loop(model, x, y, worker, learning_rate, batch_size, n_epochs,
+                seed):
+    """ SGD over one shard until n_epochs are done or the model stops """
+    rng = numpy.random.RandomState(seed + worker)
+    batches = [(x[begin:begin + batch_size], y[begin:begin + batch_size])
+        for begin in xrange(0, x.shape[0], batch_size)]
+
+    for epoch in xrange(n_epochs):
+        for index in rng.permutation(len(batches)):
+            if(model.stop.value):
+                return
+            batch_x, batch_y = batches[index]
+            sgd_step(model.W, model.b, batch_x, batch_y, learning_rate)
+            model.progress[worker] += 1
+
+
+
+class HogwildLR(object):
+    """ softmax logistic regression with W & b in shared memory """
+
+    def __init__(self, n_in, n_out=2, dtype='float64'):
+        """
+        :type n_in: int
+        :param n_in: number of input bits
+
+        :type n_out: int
+        :param n_out: number of classes
+
+        W & b start at zero, like th_logistic_regression.LogisticRegression
+        """
+        self.W = shared_array((n_in, n_out), dtype)
+        self.b = shared_array((n_out,), dtype)
+        self.stop = RawValue('i', 0)
+        self.progress = None
+
+    def values(self):
+        """ copies of (W, b) """
+        return self.W.copy(), self.b.copy()
+
+    def set_values(self, W, b):
+        self.W[...] = W
+        self.b[...] = b
+
+    def predict(self, x):
+        """ P(y = 1 | x) """
+        if(not scipy.sparse.issparse(x)):
+            x = numpy.asarray(x, dtype=self.W.dtype)
+        return predict(self.W, self.b, x)[:, 1]
+
+    def shards(self, n_rows, num_workers, seed):
+        """ K disjoint sets of shuffled row indices """
+        rows = numpy.random.RandomState(seed).permutation(n_rows)
+        return numpy.array_split(rows, num_workers)
+
+    def train(self, train_x, train_y, validate, n_epochs=10,
+              learning_rate=0.1, batch_size=100, num_workers=2,
+              target_score=None, eval_every=1., patience=None, seed=1234,
+              verbose=True):
+        """
+        :type train_x: numpy array or scipy.sparse matrix
+        :param train_x: the training fingerprints (rows)
+
+        :type train_y: numpy array
+        :param train_y: the training labels
+
+        :type validate: function
+        :param validate: validate(W, b) returns a score (higher is better,
+                         e.g. the validation AUC)
+
+        :type num_workers: int
+        :param num_workers: K, the number of training processes
+
+        :type target_score: float
+        :param target_score: stop the workers once validate reaches it
+
+        :type eval_every: float
+        :param eval_every: seconds between validations
+
+        :type patience: int
+        :param patience: stop after this many validations without a better
+                         score
+
+        returns {'trace': [(seconds, epochs, score) ...], 'best_score',
+        'seconds', 'epochs', 'stopped'}; the model holds the best weights
+        """
+        if(num_workers < 1):
+            raise ValueError('num_workers must be at least 1, not: ' +
+                str(num_workers))
+
+        x = scipy.sparse.csr_matrix(train_x, dtype=self.W.dtype)
+        y = numpy.asarray(train_y, dtype='int32')
+        shards = self.shards(x.shape[0], num_workers, seed)
+        batches_per_epoch = sum([(len(rows) + batch_size - 1) / batch_size
+            for rows in shards])
+
+        self.stop.value = 0
+        self.progress = shared_array((num_workers,), 'float64')
+
+        processes = []
+        for worker, rows in enumerate(shards):
+            # the shard is inherited by the forked worker
+            process = multiprocessing.Process(target=worker_loop,
+                args=(self, x[rows], y[rows], worker, learning_rate,
+                      batch_size, n_epochs, seed))
+            process.daemon = True
+            processes.append(process)
+
+        trace = []
+        best = {'score': None, 'values': self.values()}
+        stopped = 'epochs'
+        waited = 0
+        start = time.time()
+        for process in processes:
+            process.start()
+
+        try:
+            while True:
+                alive = [p for p in processes if p.is_alive()]
+                if(len(alive) > 0):
+                    alive[0].join(eval_every)
+
+                W, b = self.values()
+                score = validate(W, b)
+                epochs = self.progress.sum() / batches_per_epoch
+                trace.append((time.time() - start, epochs, score))
+                if(verbose):
+                    print '%8.2fs  epoch %6.2f  score %f' % trace[-1]
+
+                if(best['score'] is None or score > best['score']):
+                    best = {'score': score, 'values': (W, b)}
+                    waited = 0
+                else:
+                    waited += 1
+                if(target_score is not None and score >= target_score):
+                    stopped = 'target'
+                    break
+                if(patience is not None and waited >= patience):
+                    stopped = 'patience'
+                    break
+                if(len(alive) == 0):
+                    break
+        finally:
+            self.stop.value = 1
+            for process in processes:
+                process.join()
+
+        self.set_values(*best['values'])
+
+        return {'trace': trace, 'best_score': best['score'],
+                'seconds': time.time() - start,
+                'epochs': self.progress.sum() / batches_per_epoch,
+                'stopped': stopped}
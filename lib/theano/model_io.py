@@ -0,0 +1,348 @@
+"""
+**************************************************************************
+Model Files
+**************************************************************************
+
+Trained models are written as two files sharing one prefix:
+
+<prefix>.npz    the weight arrays: W0, b0, W1, b1 ... for the hidden layers &
+                W_out, b_out for the output layer. Multitask models stack
+                their per-task output layers: W_out is (num_tasks, n_in,
+                n_out) & b_out is (num_tasks, n_out)
+<prefix>.json   architecture & metadata: kind (lr, dbn or dbn_multi), layer
+                sizes, dataset, target, fold, bit width & metrics
+
+load_model rebuilds the forward pass in numpy (sigmoid hidden layers, a
+softmax output), so scoring & analysis don't need theano or the training
+code. This module must not import theano.
+
+The hidden layers are computed once per chunk & the output layers of all
+tasks are stacked side by side into one matrix, so every task's score comes
+out of a single GEMM. With 2 classes the softmax reduces to
+P(active) = sigmoid(z1 - z0), so scoring only needs one column per task.
+
+score_ensemble scores models of one architecture together, e.g. the five
+cross-validation models of a target, & returns the mean & variance over the
+models. Each model scores on its own: the first layer is a gather over the
+on bits (see below) & memory bound, so a single gather through all models'
+weights side by side does the same work & is no faster.
+
+The inputs are 0/1 fingerprints with few bits on, so the first layer is a
+gather-sum over the on bits (a sparse x dense product) rather than a dense
+GEMM over mostly zeros. Its weights can also be exported quantized
+(save_model / quantize_model): per column scaled int8 or int16, summed in
+int32 & scaled back once per column, for 4x / 8x smaller first layers.
+
+Compressed first layers (see lib/theano/compression.py) are stored as well:
+a low-rank layer as W0_u (n_ins, rank) & W0_v (rank, n_hidden), computed as
+(x . W0_u) . W0_v, and any first layer array that is mostly zeros (pruned) as
+CSR: <name>_data, <name>_indices, <name>_indptr & <name>_shape. Pruned arrays
+are scored dense again; sparse x sparse products are slower than the
+gather-sum at the first layer's density.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 21 Sept 2015
+"""
+
+import json, os, time
+import numpy as np
+from scipy import sparse
+
+
+format_version = 2
+kinds = ['lr', 'dbn', 'dbn_multi']
+quantized_types = ['int8', 'int16']
+
+
+
+def sigmoid(x):
+    return 1. / (1. + np.exp(-x))
+
+
+
+def softmax(x):
+    """ row-wise softmax over the last axis """
+    e = np.exp(x - x.max(axis=-1)[..., np.newaxis])
+    return e / e.sum(axis=-1)[..., np.newaxis]
+
+
+
+def quantize(W, dtype='int8'):
+    """ per column symmetric quantization: W ~= Wq * scale """
+    if(dtype not in quantized_types):
+        raise ValueError('quantized type must be one of ' +
+            ', '.join(quantized_types) + ', not: ' + str(dtype))
+
+    scale = np.abs(W).max(axis=0) / float(np.iinfo(dtype).max)
+    scale[scale == 0] = 1.
+
+    return np.round(W / scale).astype(dtype), scale.astype(W.dtype)
+
+
+
+def layer_shape(W):
+    """ (n_in, n_out) of a layer's weights, W or low-rank (U, V) """
+    if(isinstance(W, tuple)):
+        return W[0].shape[0], W[1].shape[1]
+
+    return W.shape
+
+
+
+def pack_sparse(arrays, name):
+    """ store arrays[name] as CSR if at least half of it is zeros """
+    W = arrays[name]
+    if(W.ndim != 2 or np.count_nonzero(W) > W.size / 2):
+        return
+
+    csr = sparse.csr_matrix(W)
+    del arrays[name]
+    arrays[name + '_data'] = csr.data
+    arrays[name + '_indices'] = csr.indices
+    arrays[name + '_indptr'] = csr.indptr
+    arrays[name + '_shape'] = np.array(W.shape)
+
+
+
+def unpack_sparse(arrays):
+    """ dense arrays again for every CSR stored array """
+    for name in [n[:-len('_indptr')] for n in arrays.keys()
+            if n.endswith('_indptr')]:
+        arrays[name] = sparse.csr_matrix((arrays.pop(name + '_data'),
+            arrays.pop(name + '_indices'), arrays.pop(name + '_indptr')),
+            shape=tuple(arrays.pop(name + '_shape'))).toarray()
+
+    return arrays
+
+
+
+def first_layer(x, W, b, scale=None):
+    """ x . W + b for the layer fed by the fingerprints """
+    """ integer (0/1) fingerprints: a gather-sum of the rows of W at the on """
+    """ bits; scale: per column scale of quantized (integer) weights; """
+    """ W = (U, V): a low-rank layer, (x . U) . V """
+    if(isinstance(W, tuple)):
+        U, V = W
+        return np.dot(first_layer(x, U, 0., scale), V) + b
+
+    x = np.asarray(x)
+    if(np.issubdtype(x.dtype, np.integer)):
+        if(scale is not None):
+            z = sparse.csr_matrix(x, dtype=np.int32).dot(W)
+        else:
+            z = sparse.csr_matrix(x, dtype=W.dtype).dot(W)
+    else:
+        z = np.dot(x, W)
+
+    if(scale is not None):
+        z = z.astype(scale.dtype) * scale
+
+    return z + b
+
+
+
+def save_model(prefix, kind, hidden, output, meta=None, quantized=None):
+    """
+    Write <prefix>.npz & <prefix>.json
+
+    :type kind: string
+    :param kind: 'lr', 'dbn' or 'dbn_multi'
+
+    :type hidden: list of (W, b) numpy pairs
+    :param hidden: the sigmoid hidden layers, input first (empty for lr);
+                   the first W may be a low-rank (U, V) pair
+
+    :type output: (W, b) numpy pair
+    :param output: the softmax output layer; stacked per task for dbn_multi
+
+    :type meta: dict
+    :param meta: dataset, target, fold, n_bits, metrics ... (JSON types)
+
+    :type quantized: string
+    :param quantized: 'int8' or 'int16' to store the first layer (the one
+                      applied to the fingerprints) quantized per column
+    """
+    if(kind not in kinds):
+        raise ValueError('model kind must be one of ' + ', '.join(kinds) +
+            ', not: ' + str(kind))
+
+    W_out, b_out = [np.asarray(a) for a in output]
+    if(kind == 'dbn_multi' and W_out.ndim != 3):
+        raise ValueError('dbn_multi output weights must be stacked per task')
+
+    arrays = {'W_out': W_out, 'b_out': b_out}
+    rank = None
+    for i, (W, b) in enumerate(hidden):
+        if(i == 0 and isinstance(W, tuple)):
+            arrays['W0_u'], arrays['W0_v'] = [np.asarray(a) for a in W]
+            rank = int(arrays['W0_u'].shape[1])
+        else:
+            arrays['W' + str(i)] = np.asarray(W)
+        arrays['b' + str(i)] = np.asarray(b)
+
+    if(quantized is not None):
+        if(kind == 'dbn_multi' and len(hidden) == 0):
+            raise ValueError('can only quantize the first layer of a dbn_multi')
+        if(rank is not None):
+            raise ValueError('can not quantize a low-rank first layer')
+        name = 'W0' if len(hidden) > 0 else 'W_out'
+        arrays[name], arrays[name + '_scale'] = quantize(arrays[name],
+            quantized)
+
+    for name in ['W0', 'W0_u', 'W0_v']:
+        if(name in arrays):
+            pack_sparse(arrays, name)
+
+    info = dict(meta or {})
+    info.update({
+        'format': format_version,
+        'kind': kind,
+        'n_ins': int(layer_shape(hidden[0][0])[0] if hidden else
+            W_out.shape[-2]),
+        'hidden_layers_sizes': [int(layer_shape(W)[1]) for W, b in hidden],
+        'n_outs': int(W_out.shape[-1]),
+        'num_tasks': int(W_out.shape[0]) if W_out.ndim == 3 else 1,
+        'dtype': str(W_out.dtype),
+        'quantized': quantized,
+        'rank': rank,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        })
+
+    dir_name = os.path.dirname(prefix)
+    if(len(dir_name) > 0 and not os.path.isdir(dir_name)):
+        os.makedirs(dir_name)
+
+    with open(prefix + '.npz', 'wb') as f:
+        np.savez(f, **arrays)
+    with open(prefix + '.json', 'w') as f:
+        json.dump(info, f, indent=2, sort_keys=True)
+
+
+
+def shared_pairs(values):
+    """ [W0, b0, W1, b1 ...] (e.g. theano params values) -> [(W0, b0) ...] """
+    return zip(values[0::2], values[1::2])
+
+
+
+class Model(object):
+    """ numpy forward pass of a saved model """
+
+    def __init__(self, info, hidden, output, scale=None):
+        """ scale: per column scale of a quantized first layer """
+        self.info = info
+        self.kind = info['kind']
+        self.hidden = hidden
+        self.W_out, self.b_out = output
+        self.scale = scale
+
+        # a quantized lr layer is tiny: back to floats
+        if(len(hidden) == 0 and scale is not None):
+            self.W_out = self.W_out * scale
+            self.scale = None
+
+        # single task models are 1 task models from here on
+        W = self.W_out if self.W_out.ndim == 3 else self.W_out[np.newaxis]
+        b = self.b_out if self.b_out.ndim == 2 else self.b_out[np.newaxis]
+        self.num_tasks, n_in, self.n_outs = W.shape
+
+        # (n_in, num_tasks * n_outs): all output layers in one GEMM
+        self.W_stacked = np.ascontiguousarray(
+            W.transpose(1, 0, 2).reshape(n_in, -1))
+        self.b_stacked = b.reshape(-1)
+
+        # (n_in, num_tasks): the logit of active minus inactive
+        self.W_score = None
+        if(self.n_outs == 2):
+            self.W_score = np.ascontiguousarray((W[:, :, 1] - W[:, :, 0]).T)
+            self.b_score = b[:, 1] - b[:, 0]
+
+    def hidden_output(self, x):
+        """ activations of the last hidden layer (x itself for lr) """
+        h = x
+        for i, (W, b) in enumerate(self.hidden):
+            if(i == 0):
+                h = sigmoid(first_layer(x, W, b, self.scale))
+            else:
+                h = sigmoid(np.dot(h, W) + b)
+
+        return h
+
+    def output_layer(self, h, W, b):
+        if(len(self.hidden) == 0):
+            return first_layer(h, W, b)
+
+        return np.dot(h, W) + b
+
+    def task_output(self, p):
+        """ drop the task axis of single task models """
+        return p if self.W_out.ndim == 3 else p[:, 0]
+
+    def predict_proba(self, x):
+        """ class probabilities: (rows, n_outs), or (rows, num_tasks, n_outs) """
+        h = self.hidden_output(x)
+        z = self.output_layer(h, self.W_stacked, self.b_stacked)
+        p = softmax(z.reshape(len(z), self.num_tasks, self.n_outs))
+
+        return self.task_output(p)
+
+    def score(self, x):
+        """ probability of the active class: (rows,) or (rows, num_tasks) """
+        if(self.W_score is None):
+            return self.predict_proba(x)[..., 1]
+
+        h = self.hidden_output(x)
+        return self.task_output(sigmoid(
+            self.output_layer(h, self.W_score, self.b_score)))
+
+    def predict(self, x):
+        """ most likely class: (rows,) or (rows, num_tasks) """
+        return self.predict_proba(x).argmax(axis=-1)
+
+
+
+def score_ensemble(models, x):
+    """ mean & variance of the scores of models: (rows,) or (rows, tasks) """
+    s = np.array([model.score(x) for model in models])
+    return s.mean(axis=0), s.var(axis=0)
+
+
+
+def load_model(prefix, dtype=None):
+    """ Model from <prefix>.npz & <prefix>.json (a trailing .npz is ok) """
+    """ dtype: e.g. 'float32' to score in single precision (~2x faster); """
+    """ quantized weights stay integers """
+    if(prefix.endswith('.npz') or prefix.endswith('.json')):
+        prefix = os.path.splitext(prefix)[0]
+
+    with open(prefix + '.json') as f:
+        info = json.load(f)
+    if(info.get('format', 0) > format_version):
+        raise ValueError('model format ' + str(info['format']) +
+            ' is newer than this loader: ' + prefix)
+
+    arrays = np.load(prefix + '.npz')
+    arrays = unpack_sparse(dict((name, arrays[name]) for name in arrays.files))
+    arrays = dict((name, a if dtype is None or
+        np.issubdtype(a.dtype, np.integer) else a.astype(dtype))
+        for name, a in arrays.items())
+    if('W0_u' in arrays):
+        arrays['W0'] = (arrays['W0_u'], arrays['W0_v'])
+    hidden = [(arrays['W' + str(i)], arrays['b' + str(i)])
+        for i in range(len(info['hidden_layers_sizes']))]
+    scale = arrays.get('W0_scale', arrays.get('W_out_scale'))
+
+    return Model(info, hidden, (arrays['W_out'], arrays['b_out']), scale)
+
+
+
+def quantize_model(prefix, out_prefix, dtype='int8'):
+    """ write a copy of a saved model with a quantized first layer """
+    model = load_model(prefix)
+    if(model.scale is not None or model.info.get('quantized')):
+        raise ValueError('model is already quantized: ' + prefix)
+
+    meta = dict(model.info)
+    meta['quantized_from'] = prefix
+    save_model(out_prefix, model.kind, model.hidden,
+        (model.W_out, model.b_out), meta, dtype)
@@ -0,0 +1,139 @@
+"""
+**************************************************************************
+Multitask File Reader
+**************************************************************************
+
+Parses a multitask batch file (multitask/<data_type>/batchNNNNN.fl) in one
+pass. Every line of the files written by generate_multitask has the same
+width:
+
+<bitstring> fl<fold> <label, 1 per target>
+
+so the whole file is read as one uint8 buffer, reshaped to (rows, width) &
+the fingerprints, folds & labels are cut out of it with column slices. Files
+that are not fixed width fall back to a (slower) line by line parse.
+
+The rows are then stably sorted by fold, so each fold is one contiguous
+block & pulling the train / valid / test sets is a slice.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 10 Sept 2015
+"""
+
+import numpy as np
+
+
+ZERO = ord('0')
+SPACE = ord(' ')
+NEWLINE = ord('\n')
+
+
+
+def parse_fixed_width(data):
+    """ x, y, folds of a fixed width file; None if it isn't fixed width """
+    width = data.find('\n') + 1
+    n_bits = data.find(' fl')
+    if(width == 0 or n_bits < 0 or len(data) % width != 0):
+        return None
+
+    num_labels = (width - n_bits - 5) // 2
+    if(num_labels < 0 or width != n_bits + 5 + 2 * num_labels):
+        return None
+
+    lines = np.frombuffer(data, dtype=np.uint8).reshape(-1, width)
+    marker = np.frombuffer(' fl', dtype=np.uint8)
+
+    if(not (lines[:, -1] == NEWLINE).all() or
+        not (lines[:, n_bits:n_bits + 3] == marker).all() or
+        not (lines[:, n_bits + 4:width - 1:2] == SPACE).all()):
+        return None
+
+    x = lines[:, :n_bits] - ZERO
+    folds = (lines[:, n_bits + 3] - ZERO).astype(np.int8)
+    y = lines[:, n_bits + 5:width:2] - ZERO
+
+    return x, y, folds
+
+
+
+def parse_lines(data):
+    """ line by line parse; for files with variable width rows """
+    x = []
+    y = []
+    folds = []
+    for line in data.splitlines():
+        bitstring, rest = line.split(' fl')
+        parts = rest.split(' ')
+        folds.append(int(parts[0]))
+        x.append(bitstring)
+        y.append(' '.join(parts[1:]))
+
+    n_bits = len(x[0])
+    x = np.frombuffer(''.join(x), dtype=np.uint8).reshape(-1, n_bits) - ZERO
+    y = np.array([np.fromstring(labels, dtype=np.uint8, sep=' ') for labels in y])
+
+    return x, y.astype(np.uint8), np.array(folds, dtype=np.int8)
+
+
+
+def read_multitask_file(path):
+    """ returns (x, y, folds): (n, n_bits) uint8 fingerprints, (n, num_labels) """
+    """ uint8 labels & (n,) int8 folds, in file order """
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if(len(data) == 0):
+        raise ValueError('empty multitask file: ' + path)
+    if(not data.endswith('\n')):
+        data += '\n'
+
+    parsed = parse_fixed_width(data)
+    if(parsed is None):
+        parsed = parse_lines(data)
+
+    return parsed
+
+
+
+class MultitaskFile(object):
+    """ one parsed multitask file, with its rows grouped by fold """
+
+    def __init__(self, path):
+        x, y, folds = read_multitask_file(path)
+
+        # stable sort: rows of a fold keep their file order
+        order = np.argsort(folds, kind='mergesort')
+        self.x = x[order]
+        self.y = y[order]
+        self.folds = folds[order]
+        self.num_labels = y.shape[1]
+        self.n_bits = x.shape[1]
+
+        # fold -> (start, end) of its block of rows
+        self.fold_ids = np.unique(self.folds)
+        starts = np.searchsorted(self.folds, self.fold_ids, side='left')
+        ends = np.searchsorted(self.folds, self.fold_ids, side='right')
+        self.bounds = dict(zip(self.fold_ids.tolist(), zip(starts, ends)))
+
+    def __len__(self):
+        return self.x.shape[0]
+
+    def fold_slice(self, fold):
+        """ slice of the rows that belong to fold (empty if none do) """
+        start, end = self.bounds.get(fold, (0, 0))
+        return slice(start, end)
+
+    def fold(self, fold):
+        """ (x, y) views of one fold """
+        rows = self.fold_slice(fold)
+        return self.x[rows], self.y[rows]
+
+    def split(self, fold_valid, fold_test):
+        """ (train, valid, test) sets; train is every other fold """
+        train = [self.fold_slice(f) for f in self.fold_ids.tolist()
+            if f != fold_valid and f != fold_test]
+
+        train_x = np.concatenate([self.x[s] for s in train] or [self.x[:0]])
+        train_y = np.concatenate([self.y[s] for s in train] or [self.y[:0]])
+
+        return (train_x, train_y), self.fold(fold_valid), self.fold(fold_test)
@@ -0,0 +1,100 @@
+"""
+**************************************************************************
+Multitask Sampler
+**************************************************************************
+
+Builds stratified multitask minibatches on demand, straight from the shared
+compound table (see lib/theano/compound_table.py) instead of reading the
+pre-materialized multitask/<data_type>/batchNNNNN.fl files.
+
+Each minibatch is made of (inactive, active) pairs, one pair per task in
+turn (the same stratification generate_multitask uses), so every task gets
+an equal share no matter how unbalanced it is. Samples are drawn with
+replacement from per-task index arrays restricted to the requested folds &
+written into preallocated buffers, so training sees fresh samples every
+epoch without a disk round-trip or duplicated fingerprints in memory.
+
+The folds are table.folds, one per compound from its hash (see
+compound_table.hash_folds), so no compound is in the training folds of one
+task & the test fold of another. They are not the folds of the per-target
+fold files the single-task drivers (run_DBN, th_logistic_regression ...)
+use, so multitask & single-task test AUCs are over different compounds.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 08 Sept 2015
+"""
+
+import numpy as np
+
+
+
+class MultitaskSampler(object):
+    """ stratified multitask minibatches drawn from a CompoundTable """
+
+    def __init__(self, table, folds, seed=1234):
+        """
+        :type table: lib.theano.compound_table.CompoundTable
+        :param table: compounds, labels & per-task active / inactive rows
+
+        :type folds: list of ints
+        :param folds: only compounds in these (hash) folds are sampled
+
+        :type seed: int
+        :param seed: seed for this sampler's RandomState
+        """
+        self.table = table
+        self.folds = list(folds)
+        self.rng = np.random.RandomState(seed)
+        self.num_tasks = len(table.actives)
+        self.n_bits = table.n_bits
+
+        in_folds = np.in1d(table.folds, self.folds)
+        self.actives = []
+        self.inactives = []
+        for col_id in range(self.num_tasks):
+            actives = np.unique(table.actives[col_id])
+            inactives = np.unique(table.inactives[col_id])
+            self.actives.append(actives[in_folds[actives]])
+            self.inactives.append(inactives[in_folds[inactives]])
+
+            if(len(self.actives[-1]) == 0 or len(self.inactives[-1]) == 0):
+                raise ValueError('task ' + str(col_id) + ' has no actives ' +
+                    'or no inactives in folds ' + str(self.folds))
+
+        # which task the next pair is drawn from (round robin across batches)
+        self.next_task = 0
+
+    def sample_rows(self, num_rows):
+        """ table rows for num_rows samples: (inactive, active) per task """
+        num_pairs = (num_rows + 1) // 2
+        tasks = (self.next_task + np.arange(num_pairs)) % self.num_tasks
+        self.next_task = (self.next_task + num_pairs) % self.num_tasks
+
+        rows = np.empty((num_pairs, 2), dtype=np.int64)
+        counts = np.bincount(tasks, minlength=self.num_tasks)
+        for col_id in np.flatnonzero(counts):
+            pairs = tasks == col_id
+            n = counts[col_id]
+            inactives = self.inactives[col_id]
+            actives = self.actives[col_id]
+            rows[pairs, 0] = inactives[self.rng.randint(0, len(inactives), n)]
+            rows[pairs, 1] = actives[self.rng.randint(0, len(actives), n)]
+
+        rows = rows.ravel()[:num_rows]
+
+        return rows[self.rng.permutation(num_rows)]
+
+    def fill(self, x, y):
+        """ fill preallocated x (n, n_bits) & y (n, num_tasks) in place """
+        rows = self.sample_rows(x.shape[0])
+        x[...] = self.table.unpack(rows)[:, :x.shape[1]]
+        y[...] = self.table.labels[rows]
+
+        return x, y
+
+    def allocate(self, num_rows, dtype_x='float64', dtype_y='float64'):
+        """ empty buffers for num_rows samples """
+        x = np.empty((num_rows, self.n_bits), dtype=dtype_x)
+        y = np.empty((num_rows, self.num_tasks), dtype=dtype_y)
+
+        return x, y
@@ -0,0 +1,193 @@
+"""
+**************************************************************************
+Optimizers
+**************************************************************************
+
+Update rules for the fine-tuning functions (DBN, DBNTemplate & DBN_multi)
+instead of hard-coded plain SGD:
+
+sgd         param - lr * grad
+momentum    classical momentum (mu = 0.9)
+nesterov    Nesterov's accelerated gradient (mu = 0.9), in the form of
+            Sutskever et al. (2013) that only needs the gradient at param
+rmsprop     Tieleman & Hinton (2012), rho = 0.9
+adam        Kingma & Ba (2015), beta1 = 0.9, beta2 = 0.999
+
+get_updates(name, params, gparams, learning_rate) returns the updates &
+the optimizer's state: one shared variable per param (two for adam, plus
+its step count) the drivers reset & checkpoint with the weights.
+
+Learning rate schedules map the epoch (1, 2, ...) to the learning rate &
+are applied by the drivers before every epoch (training_loop's on_epoch):
+
+constant        lr
+step:d:n        lr * d ** ((epoch - 1) / n), e.g. step:0.5:50
+exp:g           lr * g ** (epoch - 1), e.g. exp:0.99
+inv:d           lr / (1 + d * (epoch - 1)), e.g. inv:0.01
+
+On the command line an optimizer is '<name>[:lr]', e.g. adam:0.0005;
+rmsprop & adam default to smaller learning rates than sgd.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 30 Sept 2015
+"""
+
+import numpy, theano
+import theano.tensor as T
+
+
+# learning rates for optimizers that need a different scale than sgd
+default_learning_rates = {'rmsprop': 0.001, 'adam': 0.001}
+
+
+
+def zeros_like(param, suffix):
+    """ a zeroed shared variable of param's shape, for optimizer state """
+    value = param.get_value(borrow=True)
+    return theano.shared(numpy.zeros(value.shape, dtype=value.dtype),
+        name=str(param.name) + '_' + suffix, borrow=True)
+
+
+
+def sgd(params, gparams, learning_rate):
+    updates = [(param, param - gparam * learning_rate)
+        for param, gparam in zip(params, gparams)]
+
+    return updates, []
+
+
+
+def momentum(params, gparams, learning_rate, mu=0.9):
+    updates = []
+    state = []
+    for param, gparam in zip(params, gparams):
+        velocity = zeros_like(param, 'velocity')
+        new_velocity = mu * velocity - learning_rate * gparam
+        updates.append((velocity, new_velocity))
+        updates.append((param, param + new_velocity))
+        state.append(velocity)
+
+    return updates, state
+
+
+
+def nesterov(params, gparams, learning_rate, mu=0.9):
+    updates = []
+    state = []
+    for param, gparam in zip(params, gparams):
+        velocity = zeros_like(param, 'velocity')
+        new_velocity = mu * velocity - learning_rate * gparam
+        updates.append((velocity, new_velocity))
+        updates.append((param, param + mu * new_velocity -
+            learning_rate * gparam))
+        state.append(velocity)
+
+    return updates, state
+
+
+
+def rmsprop(params, gparams, learning_rate, rho=0.9, epsilon=1e-6):
+    updates = []
+    state = []
+    for param, gparam in zip(params, gparams):
+        mean_square = zeros_like(param, 'ms')
+        new_mean_square = rho * mean_square + (1. - rho) * T.sqr(gparam)
+        updates.append((mean_square, new_mean_square))
+        updates.append((param, param - learning_rate * gparam /
+            T.sqrt(new_mean_square + epsilon)))
+        state.append(mean_square)
+
+    return updates, state
+
+
+
+def adam(params, gparams, learning_rate, beta1=0.9, beta2=0.999,
+         epsilon=1e-8):
+    floatX = theano.config.floatX
+    step = theano.shared(numpy.asarray(0., dtype=floatX), name='adam_t')
+    new_step = step + 1.
+    # bias corrected step size
+    alpha = learning_rate * T.sqrt(1. - beta2 ** new_step) / \
+        (1. - beta1 ** new_step)
+
+    updates = [(step, new_step)]
+    state = [step]
+    for param, gparam in zip(params, gparams):
+        m = zeros_like(param, 'm')
+        v = zeros_like(param, 'v')
+        new_m = beta1 * m + (1. - beta1) * gparam
+        new_v = beta2 * v + (1. - beta2) * T.sqr(gparam)
+        updates.extend([(m, new_m), (v, new_v),
+            (param, param - alpha * new_m / (T.sqrt(new_v) + epsilon))])
+        state.extend([m, v])
+
+    return updates, state
+
+
+optimizers = {'sgd': sgd, 'momentum': momentum, 'nesterov': nesterov,
+    'rmsprop': rmsprop, 'adam': adam}
+
+
+
+def get_updates(name, params, gparams, learning_rate, **settings):
+    """
+    (updates, state) of an optimizer
+
+    :type name: string
+    :param name: sgd, momentum, nesterov, rmsprop or adam
+
+    :type learning_rate: float or theano scalar
+    :param learning_rate: a symbolic / shared learning rate can follow a
+                          schedule without recompiling
+
+    settings override the optimizer's defaults (mu, rho, beta1 ...)
+    """
+    if(name not in optimizers):
+        raise ValueError('unknown optimizer: ' + str(name) + '. options: ' +
+            ', '.join(sorted(optimizers)))
+
+    updates, state = optimizers[name](params, gparams, learning_rate,
+        **settings)
+
+    # keep update dtypes equal to the shared variables' (float32 runs)
+    return [(var, T.cast(value, var.dtype)) for var, value in updates], state
+
+
+
+def parse_optimizer(spec, learning_rate):
+    """ (name, learning rate) of '<name>[:lr]'; without an lr, the """
+    """ optimizer's default or else learning_rate """
+    parts = spec.split(':')
+    name = parts[0]
+    if(name not in optimizers):
+        raise ValueError('unknown optimizer: ' + str(name) + '. options: ' +
+            ', '.join(sorted(optimizers)))
+
+    if(len(parts) > 1):
+        return name, float(parts[1])
+
+    return name, default_learning_rates.get(name, learning_rate)
+
+
+
+def get_schedule(spec, learning_rate):
+    """ schedule(epoch) -> learning rate, see the module docstring """
+    parts = (spec or 'constant').split(':')
+    kind = parts[0]
+    try:
+        args = [float(a) for a in parts[1:]]
+    except ValueError:
+        raise ValueError('bad learning rate schedule: ' + spec)
+
+    if(kind == 'constant' and len(args) == 0):
+        return lambda epoch: learning_rate
+    elif(kind == 'step' and len(args) == 2):
+        drop, every = args[0], int(args[1])
+        return lambda epoch: learning_rate * drop ** ((epoch - 1) / every)
+    elif(kind == 'exp' and len(args) == 1):
+        return lambda epoch: learning_rate * args[0] ** (epoch - 1)
+    elif(kind == 'inv' and len(args) == 1):
+        return lambda epoch: learning_rate / (1. + args[0] * (epoch - 1))
+
+    raise ValueError('bad learning rate schedule: ' + spec + '. options: ' +
+        'constant, step:<drop>:<every>, exp:<gamma>, inv:<decay>')
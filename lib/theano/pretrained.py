@@ -0,0 +1,299 @@
+"""
+**************************************************************************
+Shared Pretrained RBM Stacks
+**************************************************************************
+
+Pretraining is unsupervised & the fingerprints are largely shared between
+the targets of a dataset, so the RBM stack is pretrained once per dataset &
+fold split on the deduplicated compound table (lib/theano/compound_table.py)
+instead of once per target. Every per-target run_DBN job then starts
+fine-tuning from the saved stack.
+
+Only compounds that are outside the split's validation & test folds in
+every target's fold files are used (table.fold_mask): generate_folds
+assigns the folds per file, so a compound in target A's training folds can
+be in target B's test fold & the stack is fine-tuned from for every
+target. They're streamed through the training buffer in chunks
+(ChunkFeeder), so the dataset never has to be held as floats in memory at
+once. On datasets whose targets share most compounds (PCBA) few or none
+are left; pretrain per target (PretrainCache) there instead.
+
+A stack is written as two files sharing one prefix:
+
+<prefix>.npz    W0, hbias0, vbias0, W1, hbias1, vbias1 ... per RBM
+<prefix>.json   dataset, folds, layer sizes, pretraining settings, the
+                number of compounds & the stack_version
+
+By default in $DBN_PRETRAINED_DIR (default: theano_saved/pretrained/) as
+<dataset>.<test_fold>.<valid_fold>.
+
+PretrainCache keeps per-target pretrained stacks in the same format, named
+by a hash of everything pretraining depends on: the training fingerprints
+(data_hash), the architecture, pretrain_lr, pretraining_epochs, k, the
+batch size & the seed. Runs that only change fine-tuning settings load the
+stack instead of pretraining again. The cache lives in $DBN_PRETRAIN_CACHE
+(default: theano_saved/pretrain_cache/) & is kept under
+$DBN_PRETRAIN_CACHE_MB megabytes (default 2048) by evicting the least
+recently used stacks.
+
+Stacks & cache entries written before the current stack_version (e.g.
+shared stacks of version 1, which only excluded a compound's first fold
+file row) are ignored & pretrained again.
+
+This module must not import theano.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 26 Sept 2015
+"""
+
+import hashlib, json, os, time
+import numpy as np
+
+
+pretrained_env = 'DBN_PRETRAINED_DIR'
+cache_env = 'DBN_PRETRAIN_CACHE'
+cache_size_env = 'DBN_PRETRAIN_CACHE_MB'
+
+# bumped whenever the rows a stack is pretrained on change; older stacks &
+# cache entries are ignored
+stack_version = 2
+
+
+
+def get_pretrained_path(data_type, test_fold, valid_fold):
+    """ prefix of the shared stack of a dataset & fold split """
+    pretrained_dir = os.environ.get(pretrained_env, 'theano_saved/pretrained')
+    return os.path.join(pretrained_dir, '%s.%i.%i' % (data_type, test_fold,
+        valid_fold))
+
+
+
+def pretraining_rows(table, test_fold, valid_fold):
+    """ compound table rows outside the validation & test folds of """
+    """ every target """
+    held_out = (1 << test_fold) | (1 << valid_fold)
+    return np.flatnonzero((table.fold_mask & held_out) == 0)
+
+
+
+class ChunkFeeder(object):
+    """ streams table rows through a shared training buffer in chunks """
+
+    def __init__(self, table, rows, shared_x, batch_size, chunk_rows=50000,
+                 dtype='float64', seed=1234):
+        """
+        :type table: lib.theano.compound_table.CompoundTable
+        :param table: the compounds
+
+        :type rows: numpy array of ints
+        :param rows: the table rows to train on; shuffled once (seed)
+
+        :type shared_x: theano shared variable
+        :param shared_x: the training buffer the pretraining functions read
+
+        :type chunk_rows: int
+        :param chunk_rows: rows per chunk (rounded down to whole minibatches)
+        """
+        self.table = table
+        self.rows = rows[np.random.RandomState(seed).permutation(len(rows))]
+        self.shared_x = shared_x
+        self.batch_size = batch_size
+        self.batches_per_chunk = max(1, chunk_rows / batch_size)
+        self.dtype = dtype
+        self.n_train_batches = len(self.rows) / batch_size
+        self.chunk = None
+
+    def load(self, chunk):
+        """ put chunk number chunk into the training buffer """
+        if(chunk == self.chunk):
+            return
+
+        rows_per_chunk = self.batches_per_chunk * self.batch_size
+        rows = self.rows[chunk * rows_per_chunk: (chunk + 1) * rows_per_chunk]
+        self.shared_x.set_value(self.table.unpack(rows).astype(self.dtype),
+            borrow=True)
+        self.chunk = chunk
+
+    def wrap(self, fn):
+        """ fn(index, lr) over the whole row set instead of the buffer """
+        def chunked_fn(index, lr):
+            self.load(index / self.batches_per_chunk)
+            return fn(index=index % self.batches_per_chunk, lr=lr)
+
+        return chunked_fn
+
+
+
+def save_stack(prefix, layers, meta=None):
+    """
+    Write <prefix>.npz & <prefix>.json
+
+    :type layers: list of (W, hbias, vbias) numpy arrays
+    :param layers: the RBMs, input first
+
+    :type meta: dict
+    :param meta: dataset, folds, pretraining settings ... (JSON types)
+    """
+    arrays = {}
+    for i, (W, hbias, vbias) in enumerate(layers):
+        arrays['W' + str(i)] = np.asarray(W)
+        arrays['hbias' + str(i)] = np.asarray(hbias)
+        arrays['vbias' + str(i)] = np.asarray(vbias)
+
+    info = dict(meta or {})
+    info.update({
+        'version': stack_version,
+        'n_ins': int(layers[0][0].shape[0]),
+        'hidden_layers_sizes': [int(W.shape[1]) for W, hbias, vbias in layers],
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        })
+
+    dir_name = os.path.dirname(prefix)
+    if(len(dir_name) > 0 and not os.path.isdir(dir_name)):
+        os.makedirs(dir_name)
+
+    # the .json last: a stack with its .json is complete
+    with open(prefix + '.npz', 'wb') as f:
+        np.savez(f, **arrays)
+    with open(prefix + '.json', 'w') as f:
+        json.dump(info, f, indent=2, sort_keys=True)
+
+
+
+def load_stack(prefix):
+    """ (layers, info) of a saved stack; layers = [(W, hbias, vbias) ...] """
+    with open(prefix + '.json') as f:
+        info = json.load(f)
+
+    arrays = np.load(prefix + '.npz')
+    layers = [(arrays['W' + str(i)], arrays['hbias' + str(i)],
+        arrays['vbias' + str(i)]) for i in range(len(info['hidden_layers_sizes']))]
+
+    return layers, info
+
+
+
+def has_stack(prefix):
+    """ a complete stack of the current stack_version is at prefix """
+    if(not (os.path.exists(prefix + '.json') and
+            os.path.exists(prefix + '.npz'))):
+        return False
+
+    try:
+        with open(prefix + '.json') as f:
+            info = json.load(f)
+    except (IOError, ValueError):
+        return False
+
+    return info.get('version', 1) == stack_version
+
+
+
+def data_hash(x):
+    """ sha1 of the multiset of fingerprint rows (row order is ignored; """
+    """ the fold loaders shuffle) """
+    packed = np.ascontiguousarray(np.packbits(
+        np.asarray(x).astype(np.uint8), axis=1))
+    rows = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+
+    h = hashlib.sha1(str(packed.shape))
+    h.update(np.sort(rows).tobytes())
+
+    return h.hexdigest()
+
+
+
+class PretrainCache(object):
+    """ on-disk LRU cache of pretrained RBM stacks """
+
+    def __init__(self, cache_dir=None, max_mb=None):
+        """
+        :type cache_dir: string
+        :param cache_dir: defaults to $DBN_PRETRAIN_CACHE
+
+        :type max_mb: float
+        :param max_mb: total size kept; defaults to $DBN_PRETRAIN_CACHE_MB
+        """
+        if(cache_dir is None):
+            cache_dir = os.environ.get(cache_env, 'theano_saved/pretrain_cache')
+        if(max_mb is None):
+            max_mb = float(os.environ.get(cache_size_env, 2048))
+
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    def key(self, **fields):
+        """ hash of the (JSON serializable) fields pretraining depends on """
+        fields = dict(fields, stack_version=stack_version)
+        return hashlib.sha1(json.dumps(fields, sort_keys=True)).hexdigest()
+
+    def prefix(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """ the cached layers or None; a hit marks the stack as used """
+        prefix = self.prefix(key)
+        if(not has_stack(prefix)):
+            return None
+
+        try:
+            layers, info = load_stack(prefix)
+        except (IOError, ValueError, KeyError):
+            # evicted or half written by another job
+            return None
+
+        for ext in ['.npz', '.json']:
+            try:
+                os.utime(prefix + ext, None)
+            except OSError:
+                pass
+
+        return layers
+
+    def put(self, key, layers, meta=None):
+        """ store a stack (written aside & renamed in), then evict """
+        prefix = self.prefix(key)
+        tmp_prefix = prefix + '.tmp.' + str(os.getpid())
+        save_stack(tmp_prefix, layers, meta)
+        os.rename(tmp_prefix + '.npz', prefix + '.npz')
+        os.rename(tmp_prefix + '.json', prefix + '.json')
+
+        self.evict(keep=key)
+
+    def entries(self):
+        """ [(last used, bytes, key) ...] of the complete stacks """
+        if(not os.path.isdir(self.cache_dir)):
+            return []
+
+        entries = []
+        for fname in os.listdir(self.cache_dir):
+            key, ext = os.path.splitext(fname)
+            if(ext != '.npz' or '.tmp.' in key):
+                continue
+            prefix = self.prefix(key)
+            try:
+                entries.append((os.path.getmtime(prefix + '.npz'),
+                    os.path.getsize(prefix + '.npz') +
+                    os.path.getsize(prefix + '.json'), key))
+            except OSError:
+                continue
+
+        return entries
+
+    def evict(self, keep=None):
+        """ remove least recently used stacks until the cache fits """
+        entries = sorted(self.entries())
+        total = sum([size for used, size, key in entries])
+        for used, size, key in entries:
+            if(total <= self.max_bytes):
+                break
+            if(key == keep):
+                continue
+            for ext in ['.json', '.npz']:
+                try:
+                    os.remove(self.prefix(key) + ext)
+                except OSError:
+                    pass
+            total -= size
+
+        return total
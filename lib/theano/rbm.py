@@ -6,11 +6,6 @@ to those without visible-visible and hidden-hidden connections.
 """
 import timeit
 
-try:
-    import PIL.Image as Image
-except ImportError:
-    import Image
-
 import numpy
 
 import theano
@@ -19,8 +14,12 @@ import os
 
 from theano.tensor.shared_randomstreams import RandomStreams
 
-from utils import tile_raster_images
-from logistic_sgd import load_data
+# PIL, the plotting utils & the MNIST loader are only needed by test_rbm; they
+# are imported there so the DBN drivers don't load them
+
+# get_cost_updates builds the Gibbs chain of CD-k / PCD-k as k unrolled steps
+# up to this k & with theano.scan above it (see bench_rbm_unroll.py)
+max_unrolled_k = 5
 
 
 # start-snippet-1
@@ -203,7 +202,7 @@ class RBM(object):
                 pre_sigmoid_v1, v1_mean, v1_sample]
 
     # start-snippet-2
-    def get_cost_updates(self, lr=0.1, persistent=None, k=1):
+    def get_cost_updates(self, lr=0.1, persistent=None, k=1, unroll=None):
         """This functions implements one step of CD-k or PCD-k
 
         :param lr: learning rate used to train the RBM
@@ -214,6 +213,10 @@ class RBM(object):
 
         :param k: number of Gibbs steps to do in CD-k/PCD-k
 
+        :param unroll: build the Gibbs chain as k unrolled steps (True) or
+            with theano.scan (False); None unrolls it for k up to
+            max_unrolled_k
+
         Returns a proxy for the cost and the updates dictionary. The
         dictionary contains the update rules for weights and biases but
         also an update of the shared variable used to store the persistent
@@ -232,34 +235,58 @@ class RBM(object):
         else:
             chain_start = persistent
         # end-snippet-2
+        if unroll is None:
+            unroll = k <= max_unrolled_k
+
         # perform actual negative phase
-        # in order to implement CD-k/PCD-k we need to scan over the
-        # function that implements one gibbs step k times.
-        # Read Theano tutorial on scan for more information :
-        # http://deeplearning.net/software/theano/library/scan.html
-        # the scan will return the entire Gibbs chain
-        (
-            [
-                pre_sigmoid_nvs,
-                nv_means,
-                nv_samples,
-                pre_sigmoid_nhs,
-                nh_means,
-                nh_samples
-            ],
-            updates
-        ) = theano.scan(
-            self.gibbs_hvh,
-            # the None are place holders, saying that
-            # chain_start is the initial state corresponding to the
-            # 6th output
-            outputs_info=[None, None, None, None, None, chain_start],
-            n_steps=k
-        )
+        if unroll:
+            # for small k, chain gibbs_hvh k times in the graph itself: no
+            # scan op to run per call, the sample of the last hidden layer
+            # is pruned unless PCD needs it & the optimizer sees the whole
+            # graph (e.g. log(sigmoid(..)) -> softplus). The random
+            # streams' states update themselves (default updates).
+            updates = theano.OrderedUpdates()
+            nh_sample = chain_start
+            for step in xrange(k):
+                [
+                    pre_sigmoid_nv,
+                    nv_mean,
+                    nv_sample,
+                    pre_sigmoid_nh,
+                    nh_mean,
+                    nh_sample
+                ] = self.gibbs_hvh(nh_sample)
+        else:
+            # in order to implement CD-k/PCD-k we need to scan over the
+            # function that implements one gibbs step k times.
+            # Read Theano tutorial on scan for more information :
+            # http://deeplearning.net/software/theano/library/scan.html
+            # the scan will return the entire Gibbs chain
+            (
+                [
+                    pre_sigmoid_nvs,
+                    nv_means,
+                    nv_samples,
+                    pre_sigmoid_nhs,
+                    nh_means,
+                    nh_samples
+                ],
+                updates
+            ) = theano.scan(
+                self.gibbs_hvh,
+                # the None are place holders, saying that
+                # chain_start is the initial state corresponding to the
+                # 6th output
+                outputs_info=[None, None, None, None, None, chain_start],
+                n_steps=k
+            )
+            pre_sigmoid_nv = pre_sigmoid_nvs[-1]
+            nv_sample = nv_samples[-1]
+            nh_sample = nh_samples[-1]
         # start-snippet-3
         # determine gradients on RBM parameters
         # note that we only need the sample at the end of the chain
-        chain_end = nv_samples[-1]
+        chain_end = nv_sample
 
         cost = T.mean(self.free_energy(self.input)) - T.mean(
             self.free_energy(chain_end))
@@ -275,13 +302,13 @@ class RBM(object):
             )
         if persistent:
             # Note that this works only if persistent is a shared variable
-            updates[persistent] = nh_samples[-1]
+            updates[persistent] = nh_sample
             # pseudo-likelihood is a better proxy for PCD
             monitoring_cost = self.get_pseudo_likelihood_cost(updates)
         else:
             # reconstruction cross-entropy is a better proxy for CD
             monitoring_cost = self.get_reconstruction_cost(updates,
-                                                           pre_sigmoid_nvs[-1])
+                                                           pre_sigmoid_nv)
 
         return monitoring_cost, updates
         # end-snippet-4
@@ -341,7 +368,8 @@ class RBM(object):
         on the last step. Therefore the easiest and more efficient way
         is to get also the pre-sigmoid activation as an output of
         scan, and apply both the log and sigmoid outside scan such
-        that Theano can catch and optimize the expression.
+        that Theano can catch and optimize the expression. (An unrolled
+        chain, see get_cost_updates, has no scan in the way.)
 
         """
 
@@ -378,6 +406,14 @@ def test_rbm(learning_rate=0.1, training_epochs=15,
     :param n_samples: number of samples to plot for each chain
 
     """
+    try:
+        import PIL.Image as Image
+    except ImportError:
+        import Image
+
+    from utils import tile_raster_images
+    from logistic_sgd import load_data
+
     datasets = load_data(dataset)
 
     train_set_x, train_set_y = datasets[0]
@@ -0,0 +1,121 @@
+"""
+**************************************************************************
+Screening Helpers
+**************************************************************************
+
+Reading & ranking for screen_library.py. A compound library is a text file
+with one compound per line:
+
+<compound_id> ... <bitstring>
+
+i.e. the id is the first field & the fingerprint the last one, so both
+plain '<id> <bitstring>' libraries & the fold files
+(hash_id is_active native_id fold bitstring) can be screened.
+
+The library is cut into byte ranges that end on line ends; every worker
+reads & parses its own range, so only scores (never fingerprints) travel
+between processes. This module must not import theano.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 22 Sept 2015
+"""
+
+import heapq, os
+import numpy as np
+
+
+ZERO = ord('0')
+
+
+
+def split_ranges(path, chunk_bytes):
+    """ (start, end) byte ranges of about chunk_bytes, cut at line ends """
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, 'rb') as f:
+        start = 0
+        while start < size:
+            end = min(start + chunk_bytes, size)
+            if(end < size):
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+
+    return ranges
+
+
+
+def read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+
+def parse_library(data):
+    """ ids & (rows, n_bits) uint8 fingerprints of a block of lines """
+    ids = []
+    bits = []
+    for line in data.splitlines():
+        parts = line.split()
+        if(len(parts) < 2):
+            continue
+        ids.append(parts[0])
+        bits.append(parts[-1])
+
+    if(len(bits) == 0):
+        return ids, np.zeros((0, 0), dtype=np.uint8)
+
+    n_bits = len(bits[0])
+    bits = ''.join(bits)
+    if(len(bits) != n_bits * len(ids)):
+        raise ValueError('fingerprints of different lengths in the library')
+
+    x = np.frombuffer(bits, dtype=np.uint8).reshape(-1, n_bits) - ZERO
+
+    return ids, x
+
+
+
+def chunk_top(scores, ids, k):
+    """ the k best (score, id) of one column of scores, unsorted """
+    if(len(scores) > k):
+        rows = np.argpartition(-scores, k - 1)[:k]
+    else:
+        rows = np.arange(len(scores))
+
+    return [(float(scores[i]), ids[i]) for i in rows]
+
+
+
+class TopK(object):
+    """ bounded min-heap of the k best (score, id) pairs seen so far """
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+
+    def push(self, candidates):
+        """ candidates: (score, id) pairs """
+        for item in candidates:
+            if(len(self.heap) < self.k):
+                heapq.heappush(self.heap, item)
+            elif(item > self.heap[0]):
+                heapq.heapreplace(self.heap, item)
+
+    def ranked(self):
+        """ best first """
+        return sorted(self.heap, reverse=True)
+
+
+
+def target_names(info):
+    """ the column names of a saved model's scores (see model_io) """
+    if(info.get('targets')):
+        return list(info['targets'])
+    if(info['num_tasks'] > 1):
+        return ['task' + str(i) for i in range(info['num_tasks'])]
+
+    return [info.get('target', 'score')]
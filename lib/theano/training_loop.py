@@ -0,0 +1,414 @@
+"""
+**************************************************************************
+Training Loop
+**************************************************************************
+
+The minibatch / validation / early stopping loop shared by run_DBN,
+run_DBN_multi, th_logistic_regression & VirtualScreeningDL/LogReg.
+
+EarlyStopping is the patience policy those scripts used to copy around,
+driven by either the validation loss (lower is better) or the validation
+AUC (higher is better).
+
+train() also takes a deadline: before every minibatch it checks that one
+more minibatch plus a validation pass still fit before the deadline & stops
+cleanly (with the best parameters put back) if they don't. The deadline
+comes from the walltime of the job, e.g. for a 10 hour PBS / HTCondor slot:
+
+export DBN_WALLTIME=10:00:00
+
+A margin (5 minutes, or 10% of short walltimes) is kept free for writing
+predictions & results after training.
+
+The best parameters are kept in a ParamSnapshot: preallocated numpy buffers
+the shared values are copied into on every improvement & copied back from
+once training stops. Nothing is pickled or written while training; drivers
+write the best weights once at the end with ParamSnapshot.save.
+
+Both train() & pretrain() take a Checkpoint (lib/theano/checkpoint.py):
+they save their position periodically & on SIGTERM, and pick up from the
+progress returned by Checkpoint.load().
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 16 Sept 2015
+"""
+
+import os, time
+import numpy
+from lib.theano import checkpoint as ckpt
+
+
+walltime_env = 'DBN_WALLTIME'
+
+# the walltime of a job starts with the process, not with the training loop
+process_start = time.time()
+
+
+
+def parse_walltime(walltime):
+    """ seconds from 36000, '36000', '600:00' or '10:00:00' """
+    seconds = 0.
+    for part in str(walltime).split(':'):
+        seconds = seconds * 60 + float(part)
+
+    return seconds
+
+
+
+def get_deadline(walltime=None, margin=None):
+    """ time.time() by which training has to stop; None if no walltime """
+    """ walltime defaults to $DBN_WALLTIME """
+    if(walltime is None):
+        walltime = os.environ.get(walltime_env)
+    if(not walltime):
+        return None
+
+    walltime = parse_walltime(walltime)
+    if(margin is None):
+        margin = min(300., 0.1 * walltime)
+
+    return process_start + walltime - margin
+
+
+
+class EarlyStopping(object):
+    """ patience based early stopping on the validation loss or AUC """
+
+    def __init__(self, metric='loss', patience=5000, patience_increase=2.0,
+                 improvement_threshold=0.995):
+        """
+        :type metric: string
+        :param metric: 'loss' (lower is better) or 'auc' (higher is better)
+
+        :type patience: int
+        :param patience: look at this many minibatches regardless
+
+        :type patience_increase: float
+        :param patience_increase: wait this much longer when a new best is
+                                  found
+
+        :type improvement_threshold: float
+        :param improvement_threshold: a relative improvement of this much (of
+                                      the loss, or of 1 - AUC) is considered
+                                      significant
+        """
+        if(metric not in ['loss', 'auc']):
+            raise ValueError('early stopping metric must be loss or auc, ' +
+                'not: ' + str(metric))
+
+        self.metric = metric
+        self.patience = patience
+        self.patience_increase = patience_increase
+        self.improvement_threshold = improvement_threshold
+        self.best_iter = -1
+        if(metric == 'loss'):
+            self.best = numpy.inf
+        else:
+            self.best = -numpy.inf
+
+    def update(self, score, iteration):
+        """ record a validation score; returns True if it's a new best """
+        if(self.metric == 'loss'):
+            better = score < self.best
+            significant = score < self.best * self.improvement_threshold
+        else:
+            better = score > self.best
+            significant = (1. - score) < (1. - self.best) * \
+                self.improvement_threshold
+
+        if(better and significant):
+            self.patience = max(self.patience, iteration * self.patience_increase)
+
+        if(better):
+            self.best = score
+            self.best_iter = iteration
+
+        return better
+
+    def done(self, iteration):
+        return self.patience <= iteration
+
+
+
+class ParamSnapshot(object):
+    """ best-so-far copy of theano shared parameters """
+
+    def __init__(self, params):
+        """
+        :type params: list of theano shared variables
+        :param params: the parameters to snapshot; the buffers are allocated
+                       once, with their shapes & dtypes
+        """
+        self.params = list(params)
+        self.buffers = [numpy.empty_like(p.get_value(borrow=True))
+            for p in self.params]
+        self.taken = False
+
+    def take(self):
+        """ copy the current values into the buffers """
+        for param, buf in zip(self.params, self.buffers):
+            buf[...] = param.get_value(borrow=True)
+        self.taken = True
+
+    def load(self, values):
+        """ copy saved values (e.g. from a checkpoint) into the buffers """
+        for buf, value in zip(self.buffers, values):
+            buf[...] = value
+        self.taken = True
+
+    def restore(self):
+        """ copy the buffers back into the parameters, in place """
+        if(not self.taken):
+            return
+
+        for param, buf in zip(self.params, self.buffers):
+            value = param.get_value(borrow=True)
+            value[...] = buf
+            param.set_value(value, borrow=True)
+
+    def names(self):
+        """ unique array names: the param name plus its position """
+        return ['%s_%i' % (param.name or 'param', i)
+            for i, param in enumerate(self.params)]
+
+    def save(self, path):
+        """ write the snapshot (or the current values) as one .npz file """
+        values = self.buffers
+        if(not self.taken):
+            values = [param.get_value(borrow=True) for param in self.params]
+
+        dir_name = os.path.dirname(path)
+        if(len(dir_name) > 0 and not os.path.isdir(dir_name)):
+            os.makedirs(dir_name)
+        with open(path, 'wb') as f:
+            numpy.savez(f, **dict(zip(self.names(), values)))
+
+
+
+def train(train_fn, n_train_batches, n_epochs, validate, stopping,
+          validation_frequency=None, deadline=None, params=None,
+          on_epoch=None, on_best=None, verbose=True, checkpoint=None,
+          resume=None, extra=None):
+    """
+    Run minibatch training with early stopping
+
+    :type train_fn: function
+    :param train_fn: train_fn(minibatch_index) does one training step
+
+    :type n_train_batches: int
+    :param n_train_batches: minibatches per epoch
+
+    :type n_epochs: int
+    :param n_epochs: maximal number of epochs
+
+    :type validate: function
+    :param validate: validate() returns a dict of validation metrics; it
+                     must contain stopping.metric ('loss' and / or 'auc')
+
+    :type stopping: EarlyStopping
+    :param stopping: the early stopping policy
+
+    :type validation_frequency: int
+    :param validation_frequency: minibatches between validations; defaults
+                                 to once per epoch (or patience / 2)
+
+    :type deadline: float
+    :param deadline: time.time() by which training must stop (get_deadline)
+
+    :type params: list of theano shared variables
+    :param params: if given, the values of the best validation step are
+                   kept in a ParamSnapshot & put back when training stops
+
+    :type on_epoch: function
+    :param on_epoch: on_epoch(epoch) is called before every epoch
+
+    :type on_best: function
+    :param on_best: on_best(epoch, minibatch_index, metrics) is called on
+                    every new best validation score
+
+    :type checkpoint: lib.theano.checkpoint.Checkpoint
+    :param checkpoint: saved periodically & when SIGTERM is received
+
+    :type resume: dict
+    :param resume: progress of a 'finetune' checkpoint to continue from
+
+    :type extra: dict
+    :param extra: driver state (e.g. best test scores) saved with the
+                  checkpoint & restored in place on resume
+
+    returns a dict: best score & iteration, epochs, iterations, the reason
+    training stopped ('epochs', 'patience', 'walltime' or 'terminated'), its
+    duration & the ParamSnapshot (None without params)
+    """
+    if(validation_frequency is None):
+        validation_frequency = min(n_train_batches, stopping.patience / 2)
+    validation_frequency = max(1, int(validation_frequency))
+
+    snapshot = None
+    if(params is not None):
+        snapshot = ParamSnapshot(params)
+    stopped = 'epochs'
+    start_time = time.time()
+    train_time = 0.
+    valid_time = 0.
+    n_steps = 0
+
+    start_epoch = 1
+    start_minibatch = 0
+    if(resume is not None):
+        start_epoch = resume['epoch']
+        start_minibatch = resume['minibatch']
+        stopping.__dict__.update(resume['stopping'])
+        if(snapshot is not None and resume['best_params'] is not None):
+            snapshot.load(resume['best_params'])
+        if(extra is not None):
+            extra.update(resume['extra'])
+
+    def save(epoch, minibatch_index):
+        # position of the next minibatch to run
+        if(minibatch_index + 1 < n_train_batches):
+            position = (epoch, minibatch_index + 1)
+        else:
+            position = (epoch + 1, 0)
+
+        checkpoint.save({
+            'phase': 'finetune',
+            'epoch': position[0],
+            'minibatch': position[1],
+            'stopping': dict(stopping.__dict__),
+            'best_params': snapshot.buffers if snapshot and snapshot.taken
+                else None,
+            'extra': extra,
+            })
+
+    done_looping = False
+    epoch = start_epoch - 1
+    iter = (start_epoch - 1) * n_train_batches + start_minibatch - 1
+    while (epoch < n_epochs) and (not done_looping):
+        epoch = epoch + 1
+        if(on_epoch is not None):
+            on_epoch(epoch)
+
+        first = start_minibatch if epoch == start_epoch else 0
+        for minibatch_index in xrange(first, n_train_batches):
+
+            # would one more minibatch (& a validation pass) overrun the deadline?
+            if(deadline is not None and n_steps > 0):
+                step_time = train_time / n_steps
+                if(time.time() + step_time + valid_time > deadline):
+                    stopped = 'walltime'
+                    done_looping = True
+                    break
+
+            step_start = time.time()
+            train_fn(minibatch_index)
+            train_time += time.time() - step_start
+            n_steps += 1
+
+            iter = (epoch - 1) * n_train_batches + minibatch_index
+
+            if (iter + 1) % validation_frequency == 0:
+
+                valid_start = time.time()
+                metrics = validate()
+                valid_time = time.time() - valid_start
+
+                if(verbose):
+                    print 'epoch %i, minibatch %i/%i, validation %s' % (
+                        epoch, minibatch_index + 1, n_train_batches,
+                        format_metrics(metrics))
+
+                if(stopping.update(metrics[stopping.metric], iter)):
+                    if(snapshot is not None):
+                        snapshot.take()
+                    if(on_best is not None):
+                        on_best(epoch, minibatch_index, metrics)
+
+            if(checkpoint is not None and checkpoint.due()):
+                save(epoch, minibatch_index)
+                if(ckpt.terminate_requested):
+                    stopped = 'terminated'
+                    done_looping = True
+                    break
+
+            if stopping.done(iter):
+                stopped = 'patience'
+                done_looping = True
+                break
+
+    # put the best parameters back (unless the checkpoint has to hold the
+    # current ones for a resume)
+    if(snapshot is not None and stopped != 'terminated'):
+        snapshot.restore()
+
+    if(verbose and stopped == 'walltime'):
+        print 'stopping early: out of walltime after epoch %i, minibatch %i' % (
+            epoch, iter + 1)
+
+    return {
+        'best_score': stopping.best,
+        'best_iter': stopping.best_iter,
+        'epochs': epoch,
+        'iterations': iter + 1,
+        'stopped': stopped,
+        'seconds': time.time() - start_time,
+        'snapshot': snapshot,
+        }
+
+
+
+def pretrain(pretraining_fns, n_train_batches, n_epochs, pretrain_lr,
+             checkpoint=None, resume=None):
+    """
+    Greedy layer-wise pretraining: every epoch of layer 0, then layer 1 ...
+
+    :type pretraining_fns: list of functions
+    :param pretraining_fns: one per layer; fn(index=minibatch, lr=rate)
+
+    :type checkpoint: lib.theano.checkpoint.Checkpoint
+    :param checkpoint: saved periodically & when SIGTERM is received
+
+    :type resume: dict
+    :param resume: progress of a 'pretrain' checkpoint to continue from
+
+    returns False if pretraining was interrupted by SIGTERM
+    """
+    layer, epoch, batch, costs = 0, 0, 0, []
+    if(resume is not None):
+        layer, epoch, batch = resume['layer'], resume['epoch'], resume['batch']
+        costs = resume['costs']
+
+    for i in xrange(layer, len(pretraining_fns)):
+        # go through pretraining epochs
+        for epoch in xrange(epoch, n_epochs):
+            # go through the training set
+            for batch_index in xrange(batch, n_train_batches):
+                costs.append(pretraining_fns[i](index=batch_index,
+                                                lr=pretrain_lr))
+
+                if(checkpoint is not None and checkpoint.due()):
+                    checkpoint.save({'phase': 'pretrain', 'layer': i,
+                        'epoch': epoch, 'batch': batch_index + 1,
+                        'costs': costs})
+                    if(ckpt.terminate_requested):
+                        return False
+
+            print 'Pre-training layer %i, epoch %d, cost ' % (i, epoch),
+            print numpy.mean(costs)
+            batch, costs = 0, []
+        epoch = 0
+
+    return True
+
+
+
+def format_metrics(metrics):
+    """ 'error 12.000000 %, auc 0.850000' """
+    parts = []
+    if('loss' in metrics):
+        parts.append('error %f %%' % (metrics['loss'] * 100.))
+    for name in sorted(metrics):
+        if(name != 'loss'):
+            parts.append('%s %f' % (name, metrics[name]))
+
+    return ', '.join(parts)
@@ -0,0 +1,148 @@
+"""
+**************************************************************************
+Quantize a Saved Model
+**************************************************************************
+
+Post-training quantization of a saved model (see lib/theano/model_io.py):
+the first layer, the one applied to the fingerprints (1024 x 2000 for the
+DBNs), is stored as per column scaled int8 or int16 weights & scored as an
+integer gather-sum over the on bits.
+
+$ python quantize_model.py <model> <out_model> [int8 or int16]
+
+e.g.
+$ python quantize_model.py theano_saved/deep_belief_net/model.466.0 \
+      theano_saved/deep_belief_net/model.466.0.int8 int8
+
+Then reports, on the held out fold the model was evaluated on (from the fold
+files of its dataset; by compound hash for multitask models trained on the
+compound table's split), the AUC of the float & the quantized model per target
+& the difference, plus file sizes & scoring speed, so each screening
+campaign can pick throughput vs. fidelity.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 24 Sept 2015
+"""
+
+import os, sys, time
+import numpy
+from sklearn import metrics
+from lib.theano import data_helpers
+from lib.theano.compound_table import hash_folds
+from lib.theano.hashmap import compound_hashes
+from lib.theano import model_io
+from lib.theano import screening
+
+
+
+def load_fold(data_type, target, fold, split='file'):
+    """ fingerprints & labels of one fold of a target's fold files; """
+    """ split='hash' picks the fold by compound hash instead """
+    fold_path = data_helpers.get_fold_path(data_type)
+    bits = []
+    labels = []
+    for is_active in ['actives', 'inactives']:
+        fname = fold_path + '/' + target + '_' + is_active + '.fl'
+        with open(fname) as f:
+            for line in f:
+                # row format: [hash_id, is_active, native_id, fold, bitstring]
+                parts = line.split()
+                if(split == 'hash' or int(parts[3]) == fold):
+                    labels.append(int(parts[1]))
+                    bits.append(parts[4])
+
+    if(split == 'hash' and len(bits) > 0):
+        keep = numpy.flatnonzero(hash_folds(compound_hashes(bits)) == fold)
+        bits = [bits[i] for i in keep]
+        labels = [labels[i] for i in keep]
+
+    ids, x = screening.parse_library('\n'.join(
+        [str(i) + ' ' + b for i, b in enumerate(bits)]))
+
+    return x, numpy.array(labels)
+
+
+
+def auc(labels, scores):
+    if(labels.min() == labels.max()):
+        return float('nan')
+
+    return metrics.roc_auc_score(labels, scores)
+
+
+
+def file_size(prefix):
+    return os.path.getsize(prefix + '.npz') / (1024. * 1024.)
+
+
+
+def report(prefix, out_prefix):
+    """ AUC per target of the float vs. the quantized model """
+    model = model_io.load_model(prefix)
+    quantized = model_io.load_model(out_prefix)
+    info = model.info
+
+    print 'model size: %.2f MB float, %.2f MB %s' % (file_size(prefix),
+        file_size(out_prefix), quantized.info['quantized'])
+
+    if('dataset' not in info or 'fold' not in info):
+        print 'no dataset / fold in the model metadata; skipping the AUC report'
+        return
+
+    targets = screening.target_names(info)
+    deltas = []
+    for col, target in enumerate(targets):
+        x, labels = load_fold(info['dataset'], target, info['fold'],
+            info.get('split', 'file'))
+        if(len(labels) == 0):
+            continue
+
+        start = time.time()
+        float_scores = model.score(x).reshape(len(x), -1)[:, col]
+        float_time = time.time() - start
+        start = time.time()
+        quantized_scores = quantized.score(x).reshape(len(x), -1)[:, col]
+        quantized_time = time.time() - start
+
+        float_auc = auc(labels, float_scores)
+        quantized_auc = auc(labels, quantized_scores)
+        deltas.append(quantized_auc - float_auc)
+
+        print '%s, fold %i: %i rows, auc float %.6f, %s %.6f, delta %+.6f, ' \
+            'max score diff %.2e, %.0f vs %.0f compounds/sec' % (
+            target, info['fold'], len(labels), float_auc,
+            quantized.info['quantized'], quantized_auc, deltas[-1],
+            abs(float_scores - quantized_scores).max(),
+            len(x) / max(float_time, 1e-6), len(x) / max(quantized_time, 1e-6))
+
+    deltas = [d for d in deltas if not numpy.isnan(d)]
+    if(len(deltas) > 0):
+        print 'mean auc delta: %+.6f, worst: %+.6f' % (numpy.mean(deltas),
+            min(deltas))
+
+
+
+def main(args):
+
+    if(len(args) < 3):
+        print 'usage: <model> <out_model> [int8 or int16]'
+        return
+
+    prefix = os.path.splitext(args[1])[0] if args[1].endswith('.npz') else args[1]
+    out_prefix = args[2]
+    dtype = args[3] if len(args) > 3 else 'int8'
+
+    model_io.quantize_model(prefix, out_prefix, dtype)
+    print 'wrote ' + out_prefix + '.npz (' + dtype + ')'
+
+    report(prefix, out_prefix)
+
+
+
+if __name__ == '__main__':
+    start_time = time.clock()
+
+    main(sys.argv)
+
+    end_time = time.clock()
+    print 'runtime: %.2f secs.' % (end_time - start_time)
@@ -0,0 +1,244 @@
+"""
+**************************************************************************
+Screen a Compound Library
+**************************************************************************
+
+Scores every compound of a fingerprint library with one or more trained
+models (LR, DBN or multitask DBN; see lib/theano/model_io.py) & ranks them:
+
+$ python screen_library.py <library> <out_dir> <model[,model...]> [top_k]
+      [processes] [chunk_mb] [scores: npz, tsv or none]
+
+e.g.
+$ python screen_library.py zinc.fl screened \
+      theano_saved/deep_belief_net_multi/model.MUV.0 1000
+
+Models joined by '+' (e.g. the five fold models of a target) are scored as
+one ensemble (model_io.score_ensemble) & give two columns per target:
+<target> (the mean score) & <target>.var (the variance over the models).
+The models of an ensemble must share their kind, dataset, target(s), n_ins &
+number of tasks.
+
+The library is streamed in chunks of chunk_mb megabytes (default 64) over a
+pool of processes (default: one per core). Each worker loads the models
+once (in float32; rankings don't need double precision), reads & parses its
+own chunks & runs the numpy forward pass. Writes:
+
+<out_dir>/top.<target>.tsv      the top_k (default 1000) compounds per
+                                target, best first: rank, id, score
+<out_dir>/scores/part-NNNNN.npz every compound, in library order: the
+                                compound x target score matrix stored by
+                                column, 'ids' plus one float32 array per
+                                target (np.load(part)['466'])
+<out_dir>/scores/part-NNNNN.tsv the same as text: id & one score per target
+
+A multitask model scores all of its tasks in one pass (see model_io): the
+hidden layers once per chunk & every task from a single GEMM.
+
+Theano is not needed.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 22 Sept 2015
+"""
+
+import multiprocessing, os, sys, time
+import numpy
+from lib.theano import model_io
+from lib.theano import screening
+
+
+# the models of a worker process (see init_worker)
+models = None
+
+
+
+# what the members of an ensemble must agree on (their model info)
+ensemble_keys = ['kind', 'dataset', 'target', 'targets', 'n_ins', 'num_tasks']
+
+
+
+def load(spec, dtype=None):
+    """ a model, or a list of models for 'prefix+prefix+...' """
+    if('+' in spec):
+        prefixes = spec.split('+')
+        ensemble = [model_io.load_model(prefix, dtype) for prefix in prefixes]
+        for prefix, model in zip(prefixes[1:], ensemble[1:]):
+            for key in ensemble_keys:
+                if(model.info.get(key) != ensemble[0].info.get(key)):
+                    raise ValueError('ensemble model ' + prefix + ' has ' +
+                        key + ' ' + str(model.info.get(key)) + ', not ' +
+                        str(ensemble[0].info.get(key)) + ' as ' + prefixes[0])
+
+        return ensemble
+
+    return model_io.load_model(spec, dtype)
+
+
+
+def init_worker(prefixes):
+    global models
+    models = [load(prefix, 'float32') for prefix in prefixes]
+
+
+
+def score_chunk(x):
+    """ (rows, targets) scores of every model, side by side """
+    scores = []
+    for model in models:
+        if(isinstance(model, list)):
+            mean, var = model_io.score_ensemble(model, x)
+            scores.extend([mean.reshape(len(x), -1), var.reshape(len(x), -1)])
+        else:
+            scores.append(model.score(x).reshape(len(x), -1))
+
+    return numpy.hstack(scores)
+
+
+
+def screen_range(job):
+    """ score one chunk; returns its row count & its top_k per target """
+    path, chunk_id, start, end, top_k, scores_dir, scores_format, columns = job
+
+    ids, x = screening.parse_library(screening.read_range(path, start, end))
+    if(len(ids) == 0):
+        return 0, []
+
+    first = models[0][0] if isinstance(models[0], list) else models[0]
+    n_ins = first.info['n_ins']
+    if(x.shape[1] != n_ins):
+        raise ValueError('library fingerprints have %i bits, the models %i' %
+            (x.shape[1], n_ins))
+
+    scores = score_chunk(x)
+
+    fname = os.path.join(scores_dir or '', 'part-%05d.' % chunk_id)
+    if(scores_format == 'npz'):
+        arrays = dict((name, numpy.asarray(scores[:, col], dtype='float32'))
+            for col, name in enumerate(columns))
+        with open(fname + 'npz', 'wb') as f:
+            numpy.savez(f, ids=numpy.array(ids), **arrays)
+
+    elif(scores_format == 'tsv'):
+        with open(fname + 'tsv', 'w') as f:
+            for compound_id, row in zip(ids, scores):
+                f.write(compound_id + '\t' +
+                    '\t'.join(['%.6f' % s for s in row]) + '\n')
+
+    candidates = [screening.chunk_top(scores[:, col], ids, top_k)
+        for col in range(scores.shape[1])]
+
+    return len(ids), candidates
+
+
+
+def get_columns(prefixes):
+    """ one unique name per score column, in model order """
+    columns = []
+    for prefix in prefixes:
+        model = load(prefix)
+        if(isinstance(model, list)):
+            model = model[0]
+            names = screening.target_names(model.info)
+            names = names + [name + '.var' for name in names]
+        else:
+            names = screening.target_names(model.info)
+        for name in names:
+            if(name in columns):
+                name = name + '.' + str(model.info.get('fold', len(columns)))
+            # the fold suffix can collide too (e.g. a target named 466.0)
+            unique, n = name, 2
+            while(unique in columns):
+                unique = name + '.' + str(n)
+                n += 1
+            columns.append(unique)
+
+    # the npz parts & the top.<name>.tsv files are keyed by column name
+    assert len(set(columns)) == len(columns)
+
+    return columns
+
+
+
+def screen_library(library, out_dir, prefixes, top_k=1000, processes=None,
+                   chunk_mb=64, scores_format='npz'):
+    """ score & rank library with the models saved at prefixes """
+    if(scores_format not in ['npz', 'tsv', 'none']):
+        raise ValueError('scores format must be npz, tsv or none, not: ' +
+            str(scores_format))
+
+    columns = get_columns(prefixes)
+    tops = [screening.TopK(top_k) for col in columns]
+
+    scores_dir = None
+    if(scores_format != 'none'):
+        scores_dir = os.path.join(out_dir, 'scores')
+        if(not os.path.isdir(scores_dir)):
+            os.makedirs(scores_dir)
+    elif(not os.path.isdir(out_dir)):
+        os.makedirs(out_dir)
+
+    ranges = screening.split_ranges(library, int(chunk_mb * 1024 * 1024))
+    jobs = [(library, i, start, end, top_k, scores_dir, scores_format, columns)
+        for i, (start, end) in enumerate(ranges)]
+
+    print 'Screening ' + library + ' (' + str(len(jobs)) + ' chunks) for ' + \
+        str(len(columns)) + ' targets'
+
+    start_time = time.time()
+    num_rows = 0
+    pool = multiprocessing.Pool(processes, init_worker, (prefixes,))
+    try:
+        for i, (rows, candidates) in enumerate(
+                pool.imap_unordered(screen_range, jobs)):
+            num_rows += rows
+            for top, chunk_candidates in zip(tops, candidates):
+                top.push(chunk_candidates)
+
+            seconds = time.time() - start_time
+            print '... chunk %i/%i, %i compounds, %.0f compounds/sec' % (
+                i + 1, len(jobs), num_rows, num_rows / max(seconds, 1e-6))
+    finally:
+        pool.close()
+        pool.join()
+
+    seconds = time.time() - start_time
+
+    for name, top in zip(columns, tops):
+        with open(os.path.join(out_dir, 'top.' + name + '.tsv'), 'w') as f:
+            for rank, (score, compound_id) in enumerate(top.ranked()):
+                f.write('%i\t%s\t%.6f\n' % (rank + 1, compound_id, score))
+
+    print 'Screened %i compounds in %.2f secs: %.0f compounds/sec' % (
+        num_rows, seconds, num_rows / max(seconds, 1e-6))
+
+    return num_rows, seconds
+
+
+
+def main(args):
+
+    if(len(args) < 4):
+        print 'usage: <library> <out_dir> <model[,model...]> [top_k] ' + \
+            '[processes] [chunk_mb] [scores: npz, tsv or none]'
+        return
+
+    library = args[1]
+    out_dir = args[2]
+    prefixes = args[3].split(',')
+    top_k = int(args[4]) if len(args) > 4 else 1000
+    processes = int(args[5]) if len(args) > 5 else None
+    chunk_mb = float(args[6]) if len(args) > 6 else 64
+    scores_format = args[7] if len(args) > 7 else 'npz'
+
+    screen_library(library, out_dir, prefixes, top_k, processes, chunk_mb,
+        scores_format)
+
+
+
+if __name__ == '__main__':
+    start_time = time.clock()
+
+    main(sys.argv)
+
+    end_time = time.clock()
+    print 'runtime: %.2f secs.' % (end_time - start_time)
@@ -11,15 +11,15 @@ import generate_folds, os, sys, random, time
 import numpy as np
 from sklearn import linear_model
 from sklearn import metrics
-from lib.theano import helpers
+from lib.theano import data_helpers
 from sklearn.ensemble import RandomForestClassifier
 
-get_fold_path = helpers.get_fold_path
-get_target = helpers.get_target
-parse_line = helpers.parse_line
-build_targets = helpers.build_targets
-oversample = helpers.oversample
-get_folds = helpers.get_folds
+get_fold_path = data_helpers.get_fold_path
+get_target = data_helpers.get_target
+parse_line = data_helpers.parse_line
+build_targets = data_helpers.build_targets
+oversample = data_helpers.oversample
+get_folds = data_helpers.get_folds
 
 
 def random_forest(target, X, Y, X_test, Y_test, fold_id):
@@ -179,9 +179,9 @@ def main(args):
     print "Running Scikit Learn Random Forests for " \
         + dataset + "........."
 
-    is_numeric = helpers.is_numeric(target)
+    is_numeric = data_helpers.is_numeric(target)
     if(is_numeric):
-        target_list = helpers.get_target_list(dataset)
+        target_list = data_helpers.get_target_list(dataset)
         target = target_list[int(target)]
 
     if(dataset == 'tox21'):
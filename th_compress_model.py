@@ -0,0 +1,313 @@
+"""
+**************************************************************************
+Compress a Trained DBN
+**************************************************************************
+
+Low-rank factorization (truncated SVD) and / or magnitude pruning of the
+first layer of a saved DBN (see lib/theano/compression.py), a brief
+fine-tune of the whole compressed network to recover accuracy & a report of
+the multiply-adds, latency & test AUC of the original, the compressed & the
+fine-tuned model:
+
+$ python th_compress_model.py <model> <out_model> <rank or none>
+      [sparsity] [finetune_epochs] [finetune_lr]
+
+e.g. a rank 64 first layer with half of its factors' weights pruned:
+$ python th_compress_model.py theano_saved/deep_belief_net/model.466.0 \
+      theano_saved/deep_belief_net/model.466.0.r64 64 0.5
+
+The fine-tune uses the folds the model was trained on (its dataset, target
+& fold from the model metadata, split like run_DBN) & keeps pruned weights
+at zero. finetune_epochs defaults to 5 & 0 skips fine-tuning.
+
+MACs are the multiply-adds per compound: with dense inputs & with the
+fingerprints' share of on bits (the first layer is a gather-sum over them,
+see model_io). Pruning cuts both, but only low-rank layers score faster in
+numpy: the pruned layer is still scored as a dense gather-sum.
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 25 Sept 2015
+"""
+
+# use a pre-warmed compile cache ($DBN_COMPILE_CACHE) if there is one; this has
+# to happen before theano is imported
+from lib.theano import compile_cache
+compile_cache.use_compile_cache()
+
+import sys, time, numpy, theano
+import theano.tensor as T
+from sklearn import metrics
+from lib.theano import helpers
+from lib.theano import training_loop
+from lib.theano import model_io
+from lib.theano import compression
+
+
+
+class CompressedDBN(object):
+    """ theano forward pass & SGD of a (compressed) model_io DBN """
+
+    def __init__(self, hidden, output, masks=None):
+        """
+        :type hidden: list of (W, b) numpy pairs
+        :param hidden: the sigmoid hidden layers; the first W may be a
+                       low-rank (U, V) pair
+
+        :type output: (W, b) numpy pair
+        :param output: the softmax output layer
+
+        :type masks: numpy array or (U, V) pair of arrays
+        :param masks: 0/1 masks of the pruned first layer weights
+        """
+        # copies: training updates the shared values in place
+        floatX = theano.config.floatX
+        def shared(value, name):
+            return theano.shared(numpy.array(value, dtype=floatX),
+                name=name, borrow=True)
+
+        self.x = T.matrix('x')
+        self.y = T.ivector('y')
+        self.params = []
+        self.masks = {}
+
+        first, b = hidden[0]
+        first = list(first) if isinstance(first, tuple) else [first]
+        self.n_first = len(first)
+        first_masks = [None] * len(first)
+        if(masks is not None):
+            first_masks = list(masks) if isinstance(masks, tuple) else [masks]
+        names = ['W0'] if len(first) == 1 else ['W0_u', 'W0_v']
+
+        # layer 0: x . W, or (x . U) . V
+        output_0 = self.x
+        for W, mask, name in zip(first, first_masks, names):
+            W = shared(W, name)
+            if(mask is not None):
+                self.masks[W] = shared(mask, W.name + '_mask')
+            self.params.append(W)
+            output_0 = T.dot(output_0, W)
+        b = shared(b, 'b0')
+        self.params.append(b)
+        h = T.nnet.sigmoid(output_0 + b)
+
+        for i, (W, b) in enumerate(hidden[1:]):
+            W, b = shared(W, 'W' + str(i + 1)), shared(b, 'b' + str(i + 1))
+            self.params.extend([W, b])
+            h = T.nnet.sigmoid(T.dot(h, W) + b)
+
+        W, b = shared(output[0], 'W_out'), shared(output[1], 'b_out')
+        self.params.extend([W, b])
+        self.p_y_given_x = T.nnet.softmax(T.dot(h, W) + b)
+
+        self.finetune_cost = -T.mean(
+            T.log(self.p_y_given_x)[T.arange(self.y.shape[0]), self.y])
+
+    def build_functions(self, train_set_x, train_set_y, batch_size):
+        """ compile the train, loss & predict functions """
+        index = T.lscalar('index')
+        learning_rate = T.scalar('lr')
+
+        # pruned weights stay zero: their gradient is masked
+        gparams = T.grad(self.finetune_cost, self.params)
+        updates = []
+        for param, gparam in zip(self.params, gparams):
+            if(param in self.masks):
+                gparam = gparam * self.masks[param]
+            updates.append((param, param - gparam * learning_rate))
+
+        self.train_fn = theano.function(
+            inputs=[index, learning_rate],
+            outputs=self.finetune_cost,
+            updates=updates,
+            givens={
+                self.x: train_set_x[index * batch_size: (index + 1) * batch_size],
+                self.y: train_set_y[index * batch_size: (index + 1) * batch_size]
+            }
+        )
+        self.loss_fn = theano.function([self.x, self.y], self.finetune_cost)
+        self.predict_fn = theano.function([self.x], self.p_y_given_x[:, 1])
+
+    def values(self):
+        """ (hidden, output) numpy layers, in model_io's layout """
+        values = [p.get_value() for p in self.params]
+        n = self.n_first
+        first = values[0] if n == 1 else tuple(values[:n])
+        rest = values[n + 1:]
+
+        return ([(first, values[n])] + model_io.shared_pairs(rest[:-2]),
+                rest[-2:])
+
+
+
+def auc(labels, scores):
+    fpr, tpr, thresholds = metrics.roc_curve(labels, scores)
+    return metrics.auc(fpr, tpr)
+
+
+
+def best_time(fn, repeat=3):
+    """ fastest of repeat runs, in seconds """
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+
+    return min(times)
+
+
+
+def load_folds(info):
+    """ [train, valid, test] (x, y) of a saved model's target, as run_DBN """
+    data_type = info['dataset']
+    target = info['target']
+    fold_path = helpers.get_fold_path(data_type)
+    fnames = helpers.build_targets(fold_path, data_type)[target]
+
+    test_fold = info['fold']
+    valid_fold = (test_fold + 1) % 5
+    datasets, test_y = helpers.th_load_data2_raw(data_type, fold_path, target,
+        fnames, valid_fold, test_fold)
+
+    return datasets
+
+
+
+def finetune(hidden, output, masks, datasets, n_epochs, finetune_lr,
+             batch_size=100):
+    """ SGD on the compressed network; returns its best (hidden, output) """
+    (train_x, train_y), (valid_x, valid_y), test_xy = datasets
+    floatX = theano.config.floatX
+
+    net = CompressedDBN(hidden, output, masks)
+    train_set_x, train_set_y = helpers.shared_dataset((train_x, train_y))
+    net.build_functions(train_set_x, train_set_y, batch_size)
+    n_train_batches = len(train_x) / batch_size
+
+    valid_x = numpy.asarray(valid_x, dtype=floatX)
+    valid_y = numpy.asarray(valid_y, dtype='int32')
+    def validate():
+        return {'loss': float(net.loss_fn(valid_x, valid_y)),
+                'auc': auc(valid_y, net.predict_fn(valid_x))}
+
+    # brief: every epoch runs, the best validation AUC is kept
+    stopping = training_loop.EarlyStopping(metric='auc',
+        patience=n_epochs * n_train_batches + 1)
+    result = training_loop.train(
+        train_fn=lambda minibatch_index: net.train_fn(minibatch_index,
+            finetune_lr),
+        n_train_batches=n_train_batches,
+        n_epochs=n_epochs,
+        validate=validate,
+        stopping=stopping,
+        params=net.params
+    )
+    print '... fine-tuned %i epochs in %.2fs, best validation auc %f' % (
+        result['epochs'], result['seconds'], result['best_score'])
+
+    return net.values()
+
+
+
+def report(name, model, x, labels, timing_rows=10000):
+    """ one row: weights, MACs, latency & test AUC of a model_io.Model """
+    """ latency is timed over the test rows repeated up to timing_rows """
+    density = x.mean()
+    timing_x = numpy.tile(x, (timing_rows / len(x) + 1, 1))[:timing_rows]
+    seconds = best_time(lambda: model.score(timing_x))
+    row = {'weights': compression.num_weights(model),
+        'macs': compression.model_macs(model),
+        'sparse_macs': compression.model_macs(model, density),
+        'us': 1e6 * seconds / len(timing_x), 'auc': auc(labels, model.score(x))}
+
+    print '%-12s %10i %12i %12i %12.2f %10.6f' % (name, row['weights'],
+        row['macs'], row['sparse_macs'], row['us'], row['auc'])
+
+    return row
+
+
+
+def compress_model(prefix, out_prefix, rank=None, sparsity=0., n_epochs=5,
+                   finetune_lr=0.05):
+    """ compress, fine-tune & save a DBN; reports before & after """
+    model = model_io.load_model(prefix, theano.config.floatX)
+    info = model.info
+    if(info['kind'] != 'dbn'):
+        raise ValueError('can only compress dbn models, not: ' + info['kind'])
+    if(model.scale is not None or isinstance(model.hidden[0][0], tuple)):
+        raise ValueError('model is already quantized or factorized: ' + prefix)
+
+    W0, b0 = model.hidden[0]
+    first, masks = compression.compress(W0, rank, sparsity)
+    hidden = [(first, b0)] + model.hidden[1:]
+    output = (model.W_out, model.b_out)
+
+    print '... loading the folds of ' + info['dataset'] + ' ' + \
+        info['target'] + ', fold ' + str(info['fold'])
+    datasets = load_folds(info)
+    test_x, test_y = datasets[2]
+    test_x = numpy.asarray(test_x, dtype=numpy.uint8)
+
+    if(n_epochs > 0):
+        tuned_hidden, tuned_output = finetune(hidden, output, masks, datasets,
+            n_epochs, finetune_lr)
+    else:
+        tuned_hidden, tuned_output = hidden, output
+
+    print '%-12s %10s %12s %12s %12s %10s' % ('model', 'weights', 'MACs',
+        'MACs (bits)', 'us/compound', 'test auc')
+    rows = {}
+    rows['original'] = report('original', model, test_x, test_y)
+    rows['compressed'] = report('compressed',
+        model_io.Model(info, hidden, output), test_x, test_y)
+    rows['fine-tuned'] = report('fine-tuned',
+        model_io.Model(info, tuned_hidden, tuned_output), test_x, test_y)
+
+    print 'auc %+.6f after fine-tuning (%+.6f before), %.2fx fewer MACs ' \
+        '(%.2fx with sparse bits), %.2fx faster' % (
+        rows['fine-tuned']['auc'] - rows['original']['auc'],
+        rows['compressed']['auc'] - rows['original']['auc'],
+        rows['original']['macs'] / float(rows['fine-tuned']['macs']),
+        rows['original']['sparse_macs'] / rows['fine-tuned']['sparse_macs'],
+        rows['original']['us'] / rows['fine-tuned']['us'])
+
+    meta = dict(info)
+    meta['compressed_from'] = prefix
+    meta['compression'] = {'rank': rank, 'sparsity': sparsity,
+        'finetune_epochs': n_epochs, 'finetune_lr': finetune_lr}
+    meta['metrics'] = dict(info.get('metrics', {}))
+    meta['metrics']['test_auc'] = float(rows['fine-tuned']['auc'])
+    model_io.save_model(out_prefix, 'dbn', tuned_hidden, tuned_output, meta)
+    print 'wrote ' + out_prefix + '.npz'
+
+    return rows
+
+
+
+def main(args):
+
+    if(len(args) < 4):
+        print 'usage: <model> <out_model> <rank or none> [sparsity] ' + \
+            '[finetune_epochs] [finetune_lr]'
+        return
+
+    rank = None if args[3] in ['none', '0'] else int(args[3])
+    sparsity = float(args[4]) if len(args) > 4 else 0.
+    n_epochs = int(args[5]) if len(args) > 5 else 5
+    finetune_lr = float(args[6]) if len(args) > 6 else 0.05
+
+    if(rank is None and sparsity == 0):
+        print 'nothing to do: give a rank and / or a sparsity'
+        return
+
+    compress_model(args[1], args[2], rank, sparsity, n_epochs, finetune_lr)
+
+
+
+if __name__ == '__main__':
+    start_time = time.clock()
+
+    main(sys.argv)
+
+    end_time = time.clock()
+    print 'runtime: %.2f secs.' % (end_time - start_time)
@@ -9,14 +9,27 @@ A Pyramidal Single Task Neural Network (P-STNN [2000, 100])
 @date: 20 July 2015
 """
 
+# use a pre-warmed compile cache ($DBN_COMPILE_CACHE) if there is one; this has
+# to happen before theano is imported
+from lib.theano import compile_cache
+compile_cache.use_compile_cache()
+
 import os, sys, timeit, numpy, theano, time, cPickle
 import theano.tensor as T
 from theano.sandbox.rng_mrg import MRG_RandomStreams
+from sklearn import metrics
 
 # lib.theano: our local versions of things (some key things are modified)
 from lib.theano.logistic_sgd import LogisticRegression, load_data
 from lib.theano.mlp import HiddenLayer
 from lib.theano.rbm import RBM
+from lib.theano import training_loop
+from lib.theano import checkpoint
+from lib.theano import model_io
+from lib.theano import pretrained
+from lib.theano import data_parallel
+from lib.theano import optimizers
+from lib.theano.compound_table import load_compound_table
 # helpers is not a theano library
 from lib.theano import helpers
 
@@ -193,7 +206,8 @@ class DBN(object):
 
         return pretrain_fns
 
-    def build_finetune_functions(self, datasets, batch_size, learning_rate):
+    def build_finetune_functions(self, datasets, batch_size, learning_rate,
+                                 optimizer='sgd'):
         '''Generates a function `train` that implements one step of
         finetuning, a function `validate` that computes the error on a
         batch from the validation set, and a function `test` that
@@ -209,6 +223,9 @@ class DBN(object):
         :param batch_size: size of a minibatch
         :type learning_rate: float
         :param learning_rate: learning rate used during finetune stage
+        :type optimizer: string
+        :param optimizer: update rule, see lib/theano/optimizers.py; its
+                          state is kept in self.optimizer_state
 
         '''
 
@@ -228,9 +245,8 @@ class DBN(object):
         gparams = T.grad(self.finetune_cost, self.params)
 
         # compute list of fine-tuning updates
-        updates = []
-        for param, gparam in zip(self.params, gparams):
-            updates.append((param, param - gparam * learning_rate))
+        updates, self.optimizer_state = optimizers.get_updates(optimizer,
+            self.params, gparams, learning_rate)
 
         train_fn = theano.function(
             inputs=[index],
@@ -283,9 +299,302 @@ class DBN(object):
         return train_fn, valid_score, test_score
 
 
+class DBNTemplate(object):
+    """A DBN whose Theano functions are compiled once & reused
+
+    Compiling the pretraining functions (one per layer) & the finetuning
+    functions is a large part of a short MUV / PCBA job. The template builds
+    them once per architecture, batch size & k over its own shared variables;
+    moving to another fold or target only rebinds the data (set_data) & puts
+    the initial weights back (reset) with set_value.
+
+    The validation & test sets live back to back in one shared eval matrix,
+    so one errors function & one predict function serve both.
+    """
+
+    def __init__(self, n_ins, hidden_layers_sizes, n_outs, batch_size, k=1,
+                 seed=123, optimizer='sgd'):
+        """
+        :type n_ins: int
+        :param n_ins: dimension of the input to the DBN
+
+        :type hidden_layers_sizes: list of ints
+        :param hidden_layers_sizes: intermediate layers size
+
+        :type n_outs: int
+        :param n_outs: dimension of the output of the network
+
+        :type batch_size: int
+        :param batch_size: size of a minibatch
+
+        :type k: int
+        :param k: number of Gibbs steps in CD/PCD
+
+        :type seed: int
+        :param seed: seed of the numpy & theano random generators
+
+        :type optimizer: string
+        :param optimizer: fine-tuning update rule (lib/theano/optimizers.py)
+        """
+        self.batch_size = batch_size
+        self.k = k
+        self.seed = seed
+        self.optimizer = optimizer
+        numpy_rng = numpy.random.RandomState(seed)
+        self.theano_rng = MRG_RandomStreams(numpy_rng.randint(2 ** 30))
+        self.dbn = DBN(numpy_rng=numpy_rng, theano_rng=self.theano_rng,
+                       n_ins=n_ins, hidden_layers_sizes=hidden_layers_sizes,
+                       n_outs=n_outs)
+
+        # data is swapped in with set_data; start with one empty minibatch
+        floatX = theano.config.floatX
+        self.train_x = theano.shared(
+            numpy.zeros((batch_size, n_ins), dtype=floatX), borrow=True)
+        self.train_y = theano.shared(
+            numpy.zeros(batch_size, dtype=floatX), borrow=True)
+        self.eval_x = theano.shared(
+            numpy.zeros((batch_size, n_ins), dtype=floatX), borrow=True)
+        self.eval_y = theano.shared(
+            numpy.zeros(batch_size, dtype=floatX), borrow=True)
+
+        self.n_train_batches = 0
+        self.n_valid = 0
+        self.n_test = 0
+
+        self.pretraining_fns = self.dbn.pretraining_functions(
+            train_set_x=self.train_x, batch_size=batch_size, k=k)
+        self.build_finetune_functions()
+        self.grad_fn = None
+
+        # everything reset() puts back: weights, RBM visible biases, the
+        # state of the theano random streams (created while compiling) & of
+        # the optimizer
+        self.shared_state = list(self.dbn.params)
+        for rbm in self.dbn.rbm_layers:
+            self.shared_state.append(rbm.vbias)
+        for update in self.theano_rng.state_updates:
+            self.shared_state.append(update[0])
+        self.shared_state.extend(self.optimizer_state)
+        self.initial_state = [s.get_value() for s in self.shared_state]
+
+    def build_finetune_functions(self):
+        """ compile the train / errors / predict functions """
+        dbn = self.dbn
+        batch_size = self.batch_size
+
+        index = T.lscalar('index')  # index to a [mini]batch
+        begin = T.lscalar('begin')  # first row of an eval range
+        end = T.lscalar('end')  # last row (exclusive) of an eval range
+        learning_rate = T.scalar('lr')
+        train_y = T.cast(self.train_y, 'int32')
+        eval_y = T.cast(self.eval_y, 'int32')
+
+        gparams = T.grad(dbn.finetune_cost, dbn.params)
+        updates, self.optimizer_state = optimizers.get_updates(self.optimizer,
+            dbn.params, gparams, learning_rate)
+
+        self.train_fn = theano.function(
+            inputs=[index, learning_rate],
+            outputs=dbn.finetune_cost,
+            updates=updates,
+            givens={
+                dbn.x: self.train_x[index * batch_size: (index + 1) * batch_size],
+                dbn.y: train_y[index * batch_size: (index + 1) * batch_size]
+            }
+        )
+
+        self.errors_fn = theano.function(
+            [begin, end],
+            dbn.errors,
+            givens={
+                dbn.x: self.eval_x[begin:end],
+                dbn.y: eval_y[begin:end]
+            }
+        )
+
+        self.predict_fn = theano.function(
+            [begin, end],
+            dbn.logLayer.p_y_given_x[:, 1],
+            givens={dbn.x: self.eval_x[begin:end]}
+        )
+
+    def grad_function(self):
+        """ grad_fn(x, y) = [cost] + gradients of dbn.params (compiled once, """
+        """ for data_parallel.DataParallelSGD) """
+        if(self.grad_fn is None):
+            dbn = self.dbn
+            self.grad_fn = theano.function([dbn.x, dbn.y],
+                [dbn.finetune_cost] + T.grad(dbn.finetune_cost, dbn.params))
+
+        return self.grad_fn
+
+    def set_data(self, datasets):
+        """ swap in [train, valid, test] (x, y) numpy pairs """
+        (train_x, train_y), (valid_x, valid_y), (test_x, test_y) = datasets
+        floatX = theano.config.floatX
+
+        self.train_x.set_value(numpy.asarray(train_x, dtype=floatX), borrow=True)
+        self.train_y.set_value(numpy.asarray(train_y, dtype=floatX), borrow=True)
+        self.eval_x.set_value(numpy.concatenate([valid_x, test_x]).astype(floatX),
+            borrow=True)
+        self.eval_y.set_value(numpy.concatenate([valid_y, test_y]).astype(floatX),
+            borrow=True)
+
+        self.n_train_batches = len(train_x) / self.batch_size
+        self.n_valid = len(valid_x)
+        self.n_test = len(test_x)
+        self.valid_labels = numpy.asarray(valid_y)
+        self.test_labels = numpy.asarray(test_y)
+
+    def reset(self):
+        """ back to the weights (& random streams) of a freshly built DBN """
+        for state, value in zip(self.shared_state, self.initial_state):
+            state.set_value(value.copy())
+
+    def rbm_values(self):
+        """ [(W, hbias, vbias) ...] of the RBM stack """
+        return [(rbm.W.get_value(), rbm.hbias.get_value(),
+                 rbm.vbias.get_value()) for rbm in self.dbn.rbm_layers]
+
+    def set_rbm_values(self, layers):
+        """ start from a pretrained stack (see lib/theano/pretrained.py) """
+        if(len(layers) != len(self.dbn.rbm_layers)):
+            raise ValueError('the pretrained stack has %i layers, the DBN %i' %
+                (len(layers), len(self.dbn.rbm_layers)))
+
+        floatX = theano.config.floatX
+        for rbm, values in zip(self.dbn.rbm_layers, layers):
+            for shared, value in zip([rbm.W, rbm.hbias, rbm.vbias], values):
+                if(shared.get_value(borrow=True).shape != value.shape):
+                    raise ValueError('pretrained ' + shared.name + ' is ' +
+                        str(value.shape) + ', the DBN needs ' +
+                        str(shared.get_value(borrow=True).shape))
+                shared.set_value(numpy.asarray(value, dtype=floatX))
+
+    def errors(self, begin, end):
+        """ mean error of each (full) minibatch of eval rows begin:end """
+        n_batches = (end - begin) / self.batch_size
+        return [self.errors_fn(begin + i * self.batch_size,
+                               begin + (i + 1) * self.batch_size)
+                for i in xrange(n_batches)]
+
+    def validate_model(self):
+        return self.errors(0, self.n_valid)
+
+    def test_model(self):
+        return self.errors(self.n_valid, self.n_valid + self.n_test)
+
+    def predict(self, begin, end):
+        """ p(active) for eval rows begin:end """
+        preds = [self.predict_fn(i, min(i + self.batch_size, end))
+                 for i in xrange(begin, end, self.batch_size)]
+
+        return numpy.concatenate(preds or [numpy.zeros(0)])
+
+    def predict_valid(self):
+        return self.predict(0, self.n_valid)
+
+    def predict_test(self):
+        return self.predict(self.n_valid, self.n_valid + self.n_test)
+
+
+# compiled templates, keyed by architecture / batch size / k / optimizer
+templates = {}
+
+
+def get_template(n_ins, hidden_layers_sizes, n_outs, batch_size, k=1,
+                 optimizer='sgd'):
+    """ a compiled DBNTemplate, reset to its initial weights """
+    key = (n_ins, tuple(hidden_layers_sizes), n_outs, batch_size, k, optimizer)
+    if(key in templates):
+        templates[key].reset()
+    else:
+        templates[key] = DBNTemplate(n_ins, hidden_layers_sizes, n_outs,
+                                     batch_size, k, optimizer=optimizer)
+
+    return templates[key]
+
+
+def pretrain_dataset(data_type, test_fold=0, valid_fold=1,
+                     pretraining_epochs=100, pretrain_lr=0.01, k=1,
+                     batch_size=100, chunk_rows=50000, checkpoint_every=600,
+                     hidden_layers_sizes=[2000, 100]):
+    """
+    Pretrain the RBM stack once for a dataset & fold split
+
+    Trains on every deduplicated compound of the dataset that is outside
+    the validation & test folds of every target & saves the stack (see
+    lib/theano/pretrained.py) for the per-target run_DBN jobs to start
+    fine-tuning from.
+
+    :type chunk_rows: int
+    :param chunk_rows: compounds held in the training buffer at once
+
+    returns the prefix the stack was saved at
+    """
+    prefix = pretrained.get_pretrained_path(data_type, test_fold, valid_fold)
+
+    print '... building the compound table'
+    table = load_compound_table(data_type)
+    rows = pretrained.pretraining_rows(table, test_fold, valid_fold)
+    print '... %i of %i compounds are outside folds %i & %i of every ' \
+        'target' % (len(rows), len(table), test_fold, valid_fold)
+    if(len(rows) < batch_size):
+        raise ValueError('too few compounds outside folds %i & %i of every '
+            'target to pretrain a shared stack; pretrain per target '
+            'instead' % (test_fold, valid_fold))
+
+    print '... building the model'
+    template = get_template(n_ins=table.n_bits,
+                            hidden_layers_sizes=hidden_layers_sizes,
+                            n_outs=2, batch_size=batch_size, k=k)
+    feeder = pretrained.ChunkFeeder(table, rows, template.train_x, batch_size,
+        chunk_rows, theano.config.floatX)
+
+    ckpt = checkpoint.Checkpoint(
+        checkpoint.get_checkpoint_path('pretrain.%s.%i.%i' % (data_type,
+            test_fold, valid_fold)),
+        template.shared_state,
+        key={'pretraining_epochs': pretraining_epochs,
+             'pretrain_lr': pretrain_lr, 'k': k, 'batch_size': batch_size,
+             'chunk_rows': chunk_rows, 'num_rows': len(rows),
+             'hidden_layers_sizes': hidden_layers_sizes,
+             'stack_version': pretrained.stack_version},
+        every=checkpoint_every)
+    progress = ckpt.load()
+
+    print '... pre-training the model'
+    start_time = timeit.default_timer()
+    if(not training_loop.pretrain(
+            [feeder.wrap(fn) for fn in template.pretraining_fns],
+            feeder.n_train_batches, pretraining_epochs, pretrain_lr,
+            checkpoint=ckpt, resume=progress)):
+        checkpoint.exit_if_terminated()
+    end_time = timeit.default_timer()
+
+    pretrained.save_stack(prefix, template.rbm_values(),
+        meta={'dataset': data_type, 'test_fold': test_fold,
+              'valid_fold': valid_fold, 'num_compounds': len(rows),
+              'pretraining_epochs': pretraining_epochs,
+              'pretrain_lr': pretrain_lr, 'k': k, 'batch_size': batch_size,
+              'minutes': (end_time - start_time) / 60.})
+    ckpt.remove()
+
+    print >> sys.stderr, ('The dataset pretraining code for file ' +
+                          os.path.split(__file__)[1] +
+                          ' ran for %.2fm' % ((end_time - start_time) / 60.))
+    print 'wrote ' + prefix + '.npz'
+
+    return prefix
+
+
+
 def run_DBN(finetune_lr=0.1, pretraining_epochs=100,
              pretrain_lr=0.01, k=1, training_epochs=1000,
-             batch_size=100, data_type='', target='', patience=5000):
+             batch_size=100, data_type='', target='', patience=None,
+             stop_on='loss', walltime=None, checkpoint_every=600,
+             model_dir=None, pretrained_stack=None, pretrain_cache=True,
+             workers=1, optimizer='sgd', lr_schedule=None):
     """
     Demonstrates how to train and test a Deep Belief Network.
 
@@ -305,11 +614,45 @@ def run_DBN(finetune_lr=0.1, pretraining_epochs=100,
     :param dataset: path the the pickled dataset
     :type batch_size: int
     :param batch_size: the size of a minibatch
+    :type patience: int
+    :param patience: minibatches to look at regardless; defaults to 30 epochs
+    :type stop_on: string
+    :param stop_on: early stopping metric: validation 'loss' or 'auc'
+    :type walltime: string
+    :param walltime: walltime of the job (e.g. '10:00:00'); defaults to
+                     $DBN_WALLTIME. Finetuning stops in time & keeps the best
+                     weights
+    :type checkpoint_every: float
+    :param checkpoint_every: seconds between checkpoints; an interrupted run
+                             resumes from its checkpoint automatically
+    :type model_dir: string
+    :param model_dir: if given, the best weights are written there once
+                      (model.<target>.<fold>.npz & .json, see model_io)
+    :type pretrained_stack: string
+    :param pretrained_stack: prefix of a shared RBM stack (pretrain_dataset)
+                             to fine-tune from instead of pretraining
+    :type pretrain_cache: bool
+    :param pretrain_cache: reuse the stack of an earlier run with the same
+                           training data & pretraining settings (see
+                           pretrained.PretrainCache) & cache new ones
+    :type workers: int
+    :param workers: fine-tune data parallel: every minibatch is split over
+                    this many processes (see lib/theano/data_parallel.py)
+    :type optimizer: string
+    :param optimizer: fine-tuning update rule: sgd, momentum, nesterov,
+                      rmsprop or adam (see lib/theano/optimizers.py)
+    :type lr_schedule: string
+    :param lr_schedule: fine-tuning learning rate schedule, e.g. step:0.5:50
+                        (see optimizers.get_schedule); default constant
     """
 
     # make sure we have something to do
     assert(len(data_type)> 0)
     assert(len(target)> 0)
+    if(workers > 1 and optimizer != 'sgd'):
+        raise ValueError('data parallel fine-tuning only supports sgd, not: ' +
+            optimizer)
+    schedule = optimizers.get_schedule(lr_schedule, finetune_lr)
 
     fold_path = helpers.get_fold_path(data_type)
     targets = helpers.build_targets(fold_path, data_type)
@@ -330,45 +673,80 @@ def run_DBN(finetune_lr=0.1, pretraining_epochs=100,
     # @todo: loop through train / test folds (convert this to a 5-fold loop)
     test_fold = 0 #xxxxxxxxxxxx TEMP XXXXXXXXXXXXXXXX
     valid_fold = 1 #xxxxxxxxxxxx TEMP XXXXXXXXXXXXXXXX
-    datasets, test_set_labels = helpers.th_load_data2(data_type, fold_path, target, fnames, test_fold, valid_fold)
+    # th_load_data2_raw takes (fold_valid, fold_test)
+    datasets, test_set_labels = helpers.th_load_data2_raw(data_type, fold_path, target, fnames, valid_fold, test_fold)
 
-    train_set_x, train_set_y = datasets[0]
-    valid_set_x, valid_set_y = datasets[1]
-    test_set_x, test_set_y = datasets[2]
+    # the graph is compiled once per architecture / batch size; other folds &
+    # targets only swap the data & reset the weights
+    print '... building the model'
+    template = get_template(n_ins=1024 * 1, hidden_layers_sizes=[2000, 100],
+                            n_outs=2, batch_size=batch_size, k=k,
+                            optimizer=optimizer)
+    template.set_data(datasets)
+    dbn = template.dbn
 
     # compute number of minibatches for training, validation and testing
-    n_train_batches = train_set_x.get_value(borrow=True).shape[0] / batch_size
-
-    # numpy random generator
-    numpy_rng = numpy.random.RandomState(123)
-    print '... building the model'
-    # construct the Deep Belief Network
-    dbn = DBN(numpy_rng=numpy_rng, n_ins=1024 * 1,
-              hidden_layers_sizes=[2000, 100],
-              n_outs=2)
+    n_train_batches = template.n_train_batches
+
+    # pick up an interrupted run of the same settings
+    ckpt = checkpoint.Checkpoint(
+        checkpoint.get_checkpoint_path('dbn.%s.%s.%i' % (data_type, target,
+            test_fold)),
+        template.shared_state,
+        key={'finetune_lr': finetune_lr, 'pretraining_epochs': pretraining_epochs,
+             'pretrain_lr': pretrain_lr, 'k': k, 'batch_size': batch_size,
+             'training_epochs': training_epochs, 'patience': patience,
+             'stop_on': stop_on, 'test_fold': test_fold,
+             'valid_fold': valid_fold, 'pretrained_stack': pretrained_stack, 'optimizer': optimizer,
+             'lr_schedule': lr_schedule},
+        every=checkpoint_every)
+    progress = ckpt.load()
 
     # start-snippet-2
     #########################
     # PRETRAINING THE MODEL #
     #########################
-    print '... getting the pretraining functions'
-    pretraining_fns = dbn.pretraining_functions(train_set_x=train_set_x,
-                                                batch_size=batch_size,
-                                                k=k)
+    pretraining_fns = template.pretraining_fns
 
-    print '... pre-training the model'
     start_time = timeit.default_timer()
-    ## Pre-train layer-wise
-    for i in xrange(dbn.n_layers):
-        # go through pretraining epochs
-        for epoch in xrange(pretraining_epochs):
-            # go through the training set
-            c = []
-            for batch_index in xrange(n_train_batches):
-                c.append(pretraining_fns[i](index=batch_index,
-                                            lr=pretrain_lr))
-            print 'Pre-training layer %i, epoch %d, cost ' % (i, epoch),
-            print numpy.mean(c)
+    if(pretrained_stack is not None and progress is None):
+        # the dataset's shared stack (a resumed run has it in its weights)
+        print '... starting from the pretrained stack ' + pretrained_stack
+        layers, info = pretrained.load_stack(pretrained_stack)
+        template.set_rbm_values(layers)
+    elif(pretrained_stack is None and
+            (progress is None or progress['phase'] == 'pretrain')):
+        # everything pretraining depends on; fine-tuning settings aren't
+        cache = pretrained.PretrainCache() if pretrain_cache else None
+        cache_key = None
+        layers = None
+        if(cache is not None):
+            cache_key = cache.key(data=pretrained.data_hash(datasets[0][0]),
+                n_ins=dbn.sigmoid_layers[0].W.get_value(borrow=True).shape[0],
+                hidden_layers_sizes=[len(rbm.hbias.get_value(borrow=True))
+                    for rbm in dbn.rbm_layers],
+                pretrain_lr=pretrain_lr, pretraining_epochs=pretraining_epochs,
+                k=template.k, batch_size=batch_size, seed=template.seed,
+                floatX=theano.config.floatX)
+            if(progress is None):
+                layers = cache.get(cache_key)
+
+        if(layers is not None):
+            print '... pretrained stack found in the cache: ' + cache_key
+            template.set_rbm_values(layers)
+        else:
+            ## Pre-train layer-wise (already done if we resume the finetuning)
+            print '... pre-training the model'
+            if(not training_loop.pretrain(pretraining_fns, n_train_batches,
+                    pretraining_epochs, pretrain_lr, checkpoint=ckpt,
+                    resume=progress)):
+                checkpoint.exit_if_terminated()
+            if(cache is not None):
+                cache.put(cache_key, template.rbm_values(),
+                    meta={'dataset': data_type, 'target': target,
+                          'pretrain_lr': pretrain_lr, 'k': k,
+                          'pretraining_epochs': pretraining_epochs})
+        progress = None
 
     end_time = timeit.default_timer()
     # end-snippet-2
@@ -379,121 +757,125 @@ def run_DBN(finetune_lr=0.1, pretraining_epochs=100,
     # FINETUNING THE MODEL #
     ########################
 
-    # get the training, validation and testing function for the model
-    print '... getting the finetuning functions'
-    train_fn, validate_model, test_model = dbn.build_finetune_functions(
-        datasets=datasets,
-        batch_size=batch_size,
-        learning_rate=finetune_lr
-    )
+    # the training, validation and testing functions of the template
+    train_fn = template.train_fn
+    validate_model = template.validate_model
+    test_model = template.test_model
 
     print '... finetuning the model'
     # early-stopping parameters
-    patience = 30 * n_train_batches  # look as this many examples regardless
-    patience_increase = 2.0   # wait this much longer when a new best is found
-    improvement_threshold = 0.995  # a relative improvement of this much is
-                                   # considered significant
-    validation_frequency = min(n_train_batches, patience / 2)
-                                  # go through this many
-                                  # minibatches before checking the network
-                                  # on the validation set; in this case we
-                                  # check every epoch
-
-    best_validation_loss = numpy.inf
-    test_score = 0.
-    start_time = timeit.default_timer()
-
-    done_looping = False
-    epoch = 0
-    auc = 0
-    best_auc = 0
-    while (epoch < training_epochs) and (not done_looping):
-        epoch = epoch + 1
-        for minibatch_index in xrange(n_train_batches):
-
-            minibatch_avg_cost = train_fn(minibatch_index)
-            iter = (epoch - 1) * n_train_batches + minibatch_index
-
-            if (iter + 1) % validation_frequency == 0:
-
-                validation_losses = validate_model()
-                this_validation_loss = numpy.mean(validation_losses)
-                print(
-                    'epoch %i, minibatch %i/%i, validation error %f %%'
-                    % (
-                        epoch,
-                        minibatch_index + 1,
-                        n_train_batches,
-                        this_validation_loss * 100.
-                    )
-                )
-
-                # get the ROC / AUC 
-                auc = helpers.th_calc_auc(dbn, test_set_labels, test_set_x)
-                if(auc > best_auc and best_auc > 0):
-
-                    #improve patience if loss improvement is good enough
-                    if (
-                        auc > best_auc *
-                        improvement_threshold
-                    ):
-                        patience = max(patience, iter * patience_increase)
-                        # print 'increased patience!!! (for AUC)'
-
-                    best_auc = auc
-                    print '     new best AUC!: ' + str(auc)
-                elif(auc > best_auc):
-                    best_auc = auc
-
-
-                # !!!!!!!! @todo: this needs to be based on AUC, not raw accuracy
-                # if we got the best validation score until now
-                if this_validation_loss < best_validation_loss:
-
-                    #improve patience if loss improvement is good enough
-                    if (
-                        this_validation_loss < best_validation_loss *
-                        improvement_threshold
-                    ):
-                        patience = max(patience, iter * patience_increase)
-
-                    # save best validation score and iteration number
-                    best_validation_loss = this_validation_loss
-                    best_iter = iter
-
-                    # test it on the test set
-                    test_losses = test_model()
-                    test_score = numpy.mean(test_losses)
-
-
-                    print(('     epoch %i, minibatch %i/%i, best error %f %%, best_auc: %f') %
-                          (epoch, minibatch_index + 1, n_train_batches, test_score * 100., best_auc))
-
-            if patience <= iter:
-                done_looping = True
-                break
+    if(patience is None):
+        patience = 30 * n_train_batches  # look as this many examples regardless
+    stopping = training_loop.EarlyStopping(metric=stop_on, patience=patience,
+                                           patience_increase=2.0,
+                                           improvement_threshold=0.995)
+
+    def validate():
+        fpr, tpr, thresholds = metrics.roc_curve(template.valid_labels,
+            template.predict_valid())
+        return {'loss': numpy.mean(validate_model()),
+                'auc': metrics.auc(fpr, tpr)}
+
+    best = {'test_score': 0., 'auc': 0.}
+    def on_best(epoch, minibatch_index, scores):
+        # test it on the test set
+        best['test_score'] = numpy.mean(test_model())
+
+        # get the ROC / AUC
+        fpr, tpr, thresholds = metrics.roc_curve(template.test_labels,
+            template.predict_test())
+        best['auc'] = metrics.auc(fpr, tpr)
+
+        print(('     epoch %i, minibatch %i/%i, best error %f %%, test auc: %f') %
+              (epoch, minibatch_index + 1, n_train_batches,
+               best['test_score'] * 100., best['auc']))
+
+    sgd = None
+    if(workers > 1):
+        # synchronous data parallel steps: gradients of minibatch shards
+        # averaged over workers processes
+        sgd = data_parallel.DataParallelSGD(dbn.params,
+            template.grad_function(), template.train_x.get_value(borrow=True),
+            template.train_y.get_value(borrow=True).astype('int32'),
+            batch_size, workers).start()
+        train_fn = sgd.step
+
+    learning_rate = {'value': finetune_lr}
+    def on_epoch(epoch):
+        learning_rate['value'] = schedule(epoch)
+
+    try:
+        result = training_loop.train(
+            train_fn=lambda minibatch_index: train_fn(minibatch_index,
+                learning_rate['value']),
+            n_train_batches=n_train_batches,
+            n_epochs=training_epochs,
+            validate=validate,
+            stopping=stopping,
+            deadline=training_loop.get_deadline(walltime),
+            params=dbn.params,
+            on_epoch=on_epoch,
+            on_best=on_best,
+            checkpoint=ckpt,
+            resume=progress,
+            extra=best
+        )
+    finally:
+        if(sgd is not None):
+            sgd.stop()
+    checkpoint.exit_if_terminated()
+    ckpt.remove()
+
+    # the DBN holds the best weights again; write them once
+    if(model_dir is not None):
+        values = [p.get_value(borrow=True) for p in dbn.params]
+        model_io.save_model(
+            os.path.join(model_dir, 'model.%s.%i' % (target, test_fold)),
+            'dbn', hidden=model_io.shared_pairs(values[:-2]),
+            output=values[-2:],
+            meta={'dataset': data_type, 'target': target, 'fold': test_fold,
+                  'n_bits': int(values[0].shape[0]),
+                  'trainer': {'optimizer': optimizer,
+                              'finetune_lr': finetune_lr,
+                              'lr_schedule': lr_schedule or 'constant'},
+                  'metrics': {'valid_' + stop_on: float(result['best_score']),
+                              'test_error': float(best['test_score']),
+                              'test_auc': float(best['auc'])}})
 
-    end_time = timeit.default_timer()
     print(
         (
-            'Optimization complete with best validation score of %f %%, '
+            'Optimization complete (%s) with best validation %s of %f, '
             'obtained at iteration %i, '
-            'with test performance %f %%, and best_auc: %f'
-        ) % (best_validation_loss * 100., best_iter + 1, test_score * 100., best_auc)
+            'with test performance %f %%, and test auc: %f'
+        ) % (result['stopped'], stop_on, result['best_score'],
+             result['best_iter'] + 1, best['test_score'] * 100., best['auc'])
     )
     print >> sys.stderr, ('The fine tuning code for file ' +
                           os.path.split(__file__)[1] +
-                          ' ran for %.2fm' % ((end_time - start_time)
-                                              / 60.))
+                          ' ran for %.2fm' % (result['seconds'] / 60.))
 
 
 
-def run_predictions(data_type, target, p_epochs, t_epochs, f_lr, p_lr):
+def run_predictions(data_type, target, p_epochs, t_epochs, f_lr, p_lr,
+                    workers=1, optimizer='sgd', lr_schedule=None):
 
     """ Run the Theano DBN Model """
+    if(target == 'pretrain'):
+        pretrain_dataset(data_type, 0, 1, pretraining_epochs=p_epochs,
+            pretrain_lr=p_lr)
+        return
+
+    # fine-tune from the dataset's shared stack if it was pretrained
+    # (python th_deep_belief_net.py <dataset> pretrain)
+    stack = pretrained.get_pretrained_path(data_type, 0, 1)
+    if(not pretrained.has_stack(stack)):
+        stack = None
+
     run_DBN(pretraining_epochs=p_epochs, training_epochs=t_epochs, 
         data_type=data_type, target=target, finetune_lr=f_lr, 
-        pretrain_lr=p_lr, patience=2000)
+        pretrain_lr=p_lr, # patience: 30 epochs (2000 was never applied)
+        model_dir='theano_saved/deep_belief_net', pretrained_stack=stack,
+        workers=workers, optimizer=optimizer, lr_schedule=lr_schedule)
 
 
 
@@ -506,11 +888,20 @@ def main(args):
     p_lr = 0.01 # unserupvised pre-training learning rate
 
     if(len(args) < 3 or len(args[2]) < 1):
-        print 'usage: <tox21, dud_e, muv, or pcba> <target> '
+        print 'usage: <tox21, dud_e, muv, or pcba> <target or pretrain> ' + \
+            '[workers] [optimizer[:lr]] [lr schedule]'
         return
 
     dataset = args[1]
     target = args[2]
+    # data parallel fine-tuning over this many processes
+    workers = int(args[3]) if len(args) > 3 else 1
+    # fine-tuning update rule & learning rate schedule (lib/theano/optimizers.py)
+    optimizer_spec = args[4] if len(args) > 4 else 'sgd'
+    lr_schedule = args[5] if len(args) > 5 else None
+
+    # checkpoint & exit when the scheduler preempts the job
+    checkpoint.install_sigterm_handler()
 
     # in case of typos
     if(dataset == 'dude'):
@@ -531,18 +922,23 @@ def main(args):
     t_epochs = 1000
     f_lr = 0.05
     p_lr = 0.0000003
+    optimizer, f_lr = optimizers.parse_optimizer(optimizer_spec, f_lr)
 
     if(dataset == 'tox21'):
-        run_predictions('Tox21', target, p_epochs, t_epochs, f_lr, p_lr)
+        run_predictions('Tox21', target, p_epochs, t_epochs, f_lr, p_lr,
+            workers, optimizer, lr_schedule)
 
     elif(dataset == 'dud_e'):
-        run_predictions('DUD-E', target, p_epochs, t_epochs, f_lr, p_lr)
+        run_predictions('DUD-E', target, p_epochs, t_epochs, f_lr, p_lr,
+            workers, optimizer, lr_schedule)
 
     elif(dataset == 'muv'):
-        run_predictions('MUV', target, p_epochs, t_epochs, f_lr, p_lr)
+        run_predictions('MUV', target, p_epochs, t_epochs, f_lr, p_lr,
+            workers, optimizer, lr_schedule)
 
     elif(dataset == 'pcba'):
-        run_predictions('PCBA', target, p_epochs, t_epochs, f_lr, p_lr)
+        run_predictions('PCBA', target, p_epochs, t_epochs, f_lr, p_lr,
+            workers, optimizer, lr_schedule)
     else:
         print 'dataset param not found. options: tox21, dud_e, muv, or pcba'
 
@@ -9,6 +9,11 @@ A Pyramidal Multitask Neural Network (P-MTNN [2000, 100])
 @date: 20 July 2015
 """
 
+# use a pre-warmed compile cache ($DBN_COMPILE_CACHE) if there is one; this has
+# to happen before theano is imported
+from lib.theano import compile_cache
+compile_cache.use_compile_cache()
+
 import os, sys, timeit, numpy, theano, time, cPickle
 import theano.tensor as T
 from theano.sandbox.rng_mrg import MRG_RandomStreams
@@ -19,6 +24,12 @@ from lib.theano.mlp import HiddenLayer
 from lib.theano.rbm import RBM
 # helpers is not a theano library
 from lib.theano import helpers
+from lib.theano import training_loop
+from lib.theano import checkpoint
+from lib.theano import model_io
+from lib.theano import optimizers
+from lib.theano.compound_table import load_compound_table
+from lib.theano.multitask_sampler import MultitaskSampler
 
 
 # start-snippet-1
@@ -67,6 +78,8 @@ class DBN_multi(object):
         self.rbm_layers = []
         self.params = []
         self.n_layers = len(hidden_layers_sizes)
+        self.num_tasks = num_tasks
+        self.score_fn = None
 
         assert self.n_layers > 0
 
@@ -140,9 +153,9 @@ class DBN_multi(object):
             n_in=hidden_layers_sizes[-1],
             n_out=n_outs, num_tasks=num_tasks)
 
-
-        # for i in range(num_tasks):
-        #     self.params.extend(self.multiLogLayer.multi['LogLayer' + str(i)])
+        # every task's output layer is fine-tuned with the hidden layers
+        for i in range(num_tasks):
+            self.params.extend(self.multiLogLayer.multi['LogLayer' + str(i)].params)
 
 
         # compute the cost for second phase of training, defined as the
@@ -204,7 +217,8 @@ class DBN_multi(object):
 
         return pretrain_fns
 
-    def build_finetune_functions(self, datasets, batch_size, learning_rate):
+    def build_finetune_functions(self, datasets, batch_size, learning_rate,
+                                 optimizer='sgd'):
         '''Generates a function `train` that implements one step of
         finetuning, a function `validate` that computes the error on a
         batch from the validation set, and a function `test` that
@@ -218,8 +232,12 @@ class DBN_multi(object):
                         datapoints, the other for the labels
         :type batch_size: int
         :param batch_size: size of a minibatch
-        :type learning_rate: float
-        :param learning_rate: learning rate used during finetune stage
+        :type learning_rate: float or theano shared scalar
+        :param learning_rate: learning rate used during finetune stage; a
+                              shared one can follow a schedule
+        :type optimizer: string
+        :param optimizer: update rule, see lib/theano/optimizers.py; its
+                          state is kept in self.optimizer_state
 
         '''
 
@@ -240,9 +258,8 @@ class DBN_multi(object):
         gparams = T.grad(self.finetune_cost, self.params)
 
         # compute list of fine-tuning updates
-        updates = []
-        for param, gparam in zip(self.params, gparams):
-            updates.append((param, param - gparam * learning_rate))
+        updates, self.optimizer_state = optimizers.get_updates(optimizer,
+            self.params, gparams, learning_rate)
 
 
         train_fn = theano.function(
@@ -295,10 +312,39 @@ class DBN_multi(object):
 
         return train_fn, valid_score, test_score
 
+    def build_score_function(self):
+        '''Returns a (compiled once) function mapping a matrix of
+        fingerprints to a (rows, num_tasks) matrix of P(active).
+
+        The hidden layers are computed once for all tasks & the weights of
+        every task's output layer are concatenated into one matrix, so the
+        scores of all tasks come from a single GEMM instead of num_tasks
+        separate softmax layers.
+        '''
+        if(self.score_fn is not None):
+            return self.score_fn
+
+        heads = [self.multiLogLayer.multi['LogLayer' + str(i)]
+            for i in range(self.num_tasks)]
+        W = T.concatenate([head.W for head in heads], axis=1)
+        b = T.concatenate([head.b for head in heads])
+        n_outs = heads[0].b.get_value(borrow=True).shape[0]
+
+        # (rows, num_tasks * n_outs) -> softmax per task -> column 1
+        z = T.dot(self.sigmoid_layers[-1].output, W) + b
+        p_y = T.nnet.softmax(z.reshape((-1, n_outs)))
+        scores = p_y[:, 1].reshape((z.shape[0], self.num_tasks))
+
+        self.score_fn = theano.function(inputs=[self.x], outputs=scores)
+        return self.score_fn
+
 
 def run_DBN_multi(finetune_lr=0.1, pretraining_epochs=100,
              pretrain_lr=0.01, k=1, training_epochs=1000,
-             batch_size=100, data_type='', patience=5000):
+             batch_size=100, data_type='', patience=None, batch_files=False,
+             batches_per_epoch=100, eval_rows=10000, stop_on='loss',
+             walltime=None, checkpoint_every=600, model_dir=None,
+             optimizer='sgd', lr_schedule=None):
     """
     Demonstrates how to train and test a Deep Belief Network.
 
@@ -318,6 +364,34 @@ def run_DBN_multi(finetune_lr=0.1, pretraining_epochs=100,
     :param dataset: path the the pickled dataset
     :type batch_size: int
     :param batch_size: the size of a minibatch
+    :type batch_files: bool
+    :param batch_files: train on the multitask/<data_type> batch files
+                        written by generate_multitask instead of sampling
+                        minibatches on the fly
+    :type batches_per_epoch: int
+    :param batches_per_epoch: fresh minibatches sampled per epoch (on the fly)
+    :type eval_rows: int
+    :param eval_rows: size of the validation & test sets (on the fly)
+    :type patience: int
+    :param patience: minibatches to look at regardless; defaults to 30 epochs
+    :type stop_on: string
+    :param stop_on: early stopping metric: validation 'loss' or mean 'auc'
+    :type walltime: string
+    :param walltime: walltime of the job (e.g. '10:00:00'); defaults to
+                     $DBN_WALLTIME. Finetuning stops in time & keeps the best
+                     weights
+    :type checkpoint_every: float
+    :param checkpoint_every: seconds between checkpoints; an interrupted run
+                             resumes from its checkpoint automatically
+    :type model_dir: string
+    :param model_dir: if given, the best weights are written there once
+                      (model.<data_type>.<fold>.npz & .json, see model_io)
+    :type optimizer: string
+    :param optimizer: fine-tuning update rule: sgd, momentum, nesterov,
+                      rmsprop or adam (see lib/theano/optimizers.py)
+    :type lr_schedule: string
+    :param lr_schedule: fine-tuning learning rate schedule, e.g. step:0.5:50
+                        (see optimizers.get_schedule); default constant
     """
 
     # make sure we have something to do
@@ -351,17 +425,57 @@ def run_DBN_multi(finetune_lr=0.1, pretraining_epochs=100,
 
 
 
-    # XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX REMOVE XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
-    # enable lines above / remove this line..... (temp)
-    # num_labels, datasets, test_set_labels = helpers.th_load_multi_raw(data_type, fold_path, fnames[0], test_fold, valid_fold)
-    num_labels, datasets, test_set_labels = helpers.th_load_multi(data_type, fold_path, fnames[0], test_fold, valid_fold)
-    fnames = [fnames[0]]
-    train_set_x, train_set_y = datasets[0]
-    valid_set_x, valid_set_y = datasets[1]
-    test_set_x, test_set_y = datasets[2]
+    if(batch_files):
+        # XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX REMOVE XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+        # enable lines above / remove this line..... (temp)
+        # num_labels, datasets, test_set_labels = helpers.th_load_multi_raw(data_type, fold_path, fnames[0], test_fold, valid_fold)
+        num_labels, datasets, test_set_labels = helpers.th_load_multi_raw(data_type, fold_path, fnames[0], valid_fold, test_fold)
+        valid_set_labels = datasets[1][1]
+        datasets = [helpers.shared_dataset(data_xy) for data_xy in datasets]
+        fnames = [fnames[0]]
+        train_set_x, train_set_y = datasets[0]
+        valid_set_x, valid_set_y = datasets[1]
+        test_set_x, test_set_y = datasets[2]
 
-    # XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX REMOVE XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
+        # XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX REMOVE XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX
 
+        n_train_batches = train_set_x.get_value(borrow=True).shape[0] / batch_size
+        train_sampler = None
+    else:
+        # build the minibatches on the fly from the fold files instead
+        print '... building the compound table'
+        table = load_compound_table(data_type)
+        num_labels = len(table.actives)
+
+        train_folds = [fl for fl in range(5) if fl not in (test_fold, valid_fold)]
+        train_sampler = MultitaskSampler(table, train_folds)
+
+        # fixed (stratified) validation & test sets from their own folds
+        floatX = theano.config.floatX
+        valid_sampler = MultitaskSampler(table, [valid_fold], seed=valid_fold)
+        valid_x, valid_y = valid_sampler.fill(
+            *valid_sampler.allocate(eval_rows, floatX, floatX))
+        test_sampler = MultitaskSampler(table, [test_fold], seed=test_fold)
+        test_x, test_y = test_sampler.fill(
+            *test_sampler.allocate(eval_rows, floatX, floatX))
+        valid_set_labels = valid_y.astype('int32')
+        test_set_labels = test_y.astype('int32')
+
+        # one epoch = batches_per_epoch fresh minibatches; the buffers are
+        # preallocated & refilled in place at the start of every epoch
+        n_train_batches = batches_per_epoch
+        train_x, train_y = train_sampler.allocate(
+            n_train_batches * batch_size, floatX, floatX)
+        train_sampler.fill(train_x, train_y)
+
+        train_set_x = theano.shared(train_x, borrow=True)
+        train_shared_y = theano.shared(train_y, borrow=True)
+        train_set_y = T.cast(train_shared_y, 'int32')
+        valid_set_x, valid_set_y = helpers.shared_dataset((valid_x, valid_y))
+        test_set_x, test_set_y = helpers.shared_dataset((test_x, test_y))
+
+        datasets = [(train_set_x, train_set_y), (valid_set_x, valid_set_y),
+            (test_set_x, test_set_y)]
 
     # numpy random generator
     numpy_rng = numpy.random.RandomState(123)
@@ -421,119 +535,133 @@ def run_DBN_multi(finetune_lr=0.1, pretraining_epochs=100,
 
     # get the training, validation and testing function for the model
     print '... getting the finetuning functions'
+    # shared: the schedule sets it before every epoch
+    schedule = optimizers.get_schedule(lr_schedule, finetune_lr)
+    learning_rate = theano.shared(numpy.asarray(finetune_lr,
+        dtype=theano.config.floatX), name='lr')
     train_fn, validate_model, test_model = dbn.build_finetune_functions(
         datasets=datasets,
         batch_size=batch_size,
-        learning_rate=finetune_lr
+        learning_rate=learning_rate,
+        optimizer=optimizer
     )
 
+    # pick up an interrupted run of the same settings: weights of the
+    # hidden layers & of every task's output layer (dbn.params), the
+    # optimizer state, plus the sampler state
+    shared_state = list(dbn.params)
+    shared_state.extend(dbn.optimizer_state)
+    ckpt = checkpoint.Checkpoint(
+        checkpoint.get_checkpoint_path('dbn_multi.%s.%i' % (data_type,
+            test_fold)),
+        shared_state,
+        rngs=[train_sampler.rng] if train_sampler is not None else [],
+        key={'finetune_lr': finetune_lr, 'batch_size': batch_size,
+             'training_epochs': training_epochs, 'patience': patience,
+             'batch_files': batch_files, 'stop_on': stop_on,
+             'batches_per_epoch': batches_per_epoch, 'eval_rows': eval_rows,
+             'valid_fold': valid_fold, 'optimizer': optimizer,
+             'lr_schedule': lr_schedule},
+        every=checkpoint_every)
+    progress = ckpt.load()
+
     print '... finetuning the model'
     # early-stopping parameters
-    patience = 30 * n_train_batches  # look as this many examples regardless
-    patience_increase = 2.0   # wait this much longer when a new best is found
-    improvement_threshold = 0.995  # a relative improvement of this much is
-                                   # considered significant
-    validation_frequency = min(n_train_batches, patience / 2)
-                                  # go through this many
-                                  # minibatches before checking the network
-                                  # on the validation set; in this case we
-                                  # check every epoch
-
-    best_validation_loss = numpy.inf
-    test_score = 0.
-    start_time = timeit.default_timer()
-
-    done_looping = False
-    epoch = 0
-    auc = 0
-    best_auc = 0
-    while (epoch < training_epochs) and (not done_looping):
-        epoch = epoch + 1
-        for minibatch_index in xrange(n_train_batches):
-
-            minibatch_avg_cost = train_fn(minibatch_index)
-            iter = (epoch - 1) * n_train_batches + minibatch_index
-
-            if (iter + 1) % validation_frequency == 0:
-
-                validation_losses = validate_model()
-                this_validation_loss = numpy.mean(validation_losses)
-                print(
-                    'epoch %i, minibatch %i/%i, validation error %f %%'
-                    % (
-                        epoch,
-                        minibatch_index + 1,
-                        n_train_batches,
-                        this_validation_loss * 100.
-                    )
-                )
-
-                # get the ROC / AUC 
-                auc = helpers.th_calc_auc(dbn, test_set_labels, test_set_x)
-                if(auc > best_auc and best_auc > 0):
-
-                    #improve patience if loss improvement is good enough
-                    if (
-                        auc > best_auc *
-                        improvement_threshold
-                    ):
-                        patience = max(patience, iter * patience_increase)
-                        # print 'increased patience!!! (for AUC)'
-
-                    best_auc = auc
-                    print '     new best AUC!: ' + str(auc)
-                elif(auc > best_auc):
-                    best_auc = auc
-
-
-                # !!!!!!!! @todo: this needs to be based on AUC, not raw accuracy
-                # if we got the best validation score until now
-                if this_validation_loss < best_validation_loss:
-
-                    #improve patience if loss improvement is good enough
-                    if (
-                        this_validation_loss < best_validation_loss *
-                        improvement_threshold
-                    ):
-                        patience = max(patience, iter * patience_increase)
-
-                    # save best validation score and iteration number
-                    best_validation_loss = this_validation_loss
-                    best_iter = iter
-
-                    # test it on the test set
-                    test_losses = test_model()
-                    test_score = numpy.mean(test_losses)
-
-
-                    print(('     epoch %i, minibatch %i/%i, best error %f %%, best_auc: %f') %
-                          (epoch, minibatch_index + 1, n_train_batches, test_score * 100., best_auc))
-
-            if patience <= iter:
-                done_looping = True
-                break
-
-    end_time = timeit.default_timer()
+    if(patience is None):
+        patience = 30 * n_train_batches  # look as this many examples regardless
+    stopping = training_loop.EarlyStopping(metric=stop_on, patience=patience,
+                                           patience_increase=2.0,
+                                           improvement_threshold=0.995)
+
+    def validate():
+        return {'loss': numpy.mean(validate_model()),
+                'auc': helpers.th_calc_multi_auc(dbn, valid_set_labels, valid_set_x)}
+
+    def on_epoch(epoch):
+        learning_rate.set_value(numpy.asarray(schedule(epoch),
+            dtype=theano.config.floatX))
+        if(train_sampler is not None and epoch > 1):
+            # draw fresh training samples into the same buffers
+            train_sampler.fill(train_x, train_y)
+            train_set_x.set_value(train_x, borrow=True)
+            train_shared_y.set_value(train_y, borrow=True)
+
+    best = {'test_score': 0., 'auc': 0.}
+    def on_best(epoch, minibatch_index, scores):
+        # test it on the test set
+        best['test_score'] = numpy.mean(test_model())
+
+        # get the ROC / AUC
+        best['auc'] = helpers.th_calc_multi_auc(dbn, test_set_labels, test_set_x)
+
+        print(('     epoch %i, minibatch %i/%i, best error %f %%, test auc: %f') %
+              (epoch, minibatch_index + 1, n_train_batches,
+               best['test_score'] * 100., best['auc']))
+
+    result = training_loop.train(
+        train_fn=train_fn,
+        n_train_batches=n_train_batches,
+        n_epochs=training_epochs,
+        validate=validate,
+        stopping=stopping,
+        deadline=training_loop.get_deadline(walltime),
+        params=shared_state,
+        on_epoch=on_epoch,
+        on_best=on_best,
+        checkpoint=ckpt,
+        resume=progress,
+        extra=best
+    )
+    checkpoint.exit_if_terminated()
+    ckpt.remove()
+
+    # the DBN holds the best weights again; write them once
+    if(model_dir is not None):
+        values = [p.get_value(borrow=True) for layer in dbn.sigmoid_layers
+            for p in layer.params]
+        heads = [dbn.multiLogLayer.multi['LogLayer' + str(i)]
+            for i in range(num_labels)]
+        model_io.save_model(
+            os.path.join(model_dir, 'model.%s.%i' % (data_type, test_fold)),
+            'dbn_multi', hidden=model_io.shared_pairs(values),
+            output=(numpy.array([h.W.get_value(borrow=True) for h in heads]),
+                    numpy.array([h.b.get_value(borrow=True) for h in heads])),
+            meta={'dataset': data_type, 'fold': test_fold,
+                  # the sampler's folds aren't the fold files'
+                  'split': 'file' if train_sampler is None else 'hash',
+                  'targets': helpers.get_target_list(data_type)[:num_labels],
+                  'n_bits': int(values[0].shape[0]),
+                  'trainer': {'optimizer': optimizer,
+                              'finetune_lr': finetune_lr,
+                              'lr_schedule': lr_schedule or 'constant'},
+                  'metrics': {'valid_' + stop_on: float(result['best_score']),
+                              'test_error': float(best['test_score']),
+                              'test_auc': float(best['auc'])}})
+
     print(
         (
-            'Optimization complete with best validation score of %f %%, '
+            'Optimization complete (%s) with best validation %s of %f, '
             'obtained at iteration %i, '
-            'with test performance %f %%, and best_auc: %f'
-        ) % (best_validation_loss * 100., best_iter + 1, test_score * 100., best_auc)
+            'with test performance %f %%, and test auc: %f'
+        ) % (result['stopped'], stop_on, result['best_score'],
+             result['best_iter'] + 1, best['test_score'] * 100., best['auc'])
     )
     print >> sys.stderr, ('The fine tuning code for file ' +
                           os.path.split(__file__)[1] +
-                          ' ran for %.2fm' % ((end_time - start_time)
-                                              / 60.))
+                          ' ran for %.2fm' % (result['seconds'] / 60.))
 
 
 
-def run_predictions(data_type, p_epochs, t_epochs, f_lr, p_lr):
+def run_predictions(data_type, p_epochs, t_epochs, f_lr, p_lr,
+                    optimizer_spec='sgd', lr_schedule=None):
 
     """ Run the Theano DBN Model """
+    optimizer, f_lr = optimizers.parse_optimizer(optimizer_spec, f_lr)
     run_DBN_multi(pretraining_epochs=p_epochs, training_epochs=t_epochs, 
         data_type=data_type, finetune_lr=f_lr, 
-        pretrain_lr=p_lr, patience=2000)
+        pretrain_lr=p_lr, # patience: 30 epochs (2000 was never applied)
+        model_dir='theano_saved/deep_belief_net_multi',
+        optimizer=optimizer, lr_schedule=lr_schedule)
 
 
 
@@ -547,10 +675,17 @@ def main(args):
     p_lr = 0.01 # unserupvised pre-training learning rate
 
     if(len(args) < 2):
-        print 'usage: <tox21, dud_e, muv, or pcba> <target> '
+        print 'usage: <tox21, dud_e, muv, or pcba> [optimizer[:lr]] ' + \
+            '[lr schedule]'
         return
 
     dataset = args[1]
+    # fine-tuning update rule & learning rate schedule (lib/theano/optimizers.py)
+    optimizer_spec = args[2] if len(args) > 2 else 'sgd'
+    lr_schedule = args[3] if len(args) > 3 else None
+
+    # checkpoint & exit when the scheduler preempts the job
+    checkpoint.install_sigterm_handler()
 
     # in case of typos
     if(dataset == 'dude'):
@@ -569,15 +704,18 @@ def main(args):
             t_epochs = 1000 #default 1000 training_epochs
             f_lr = 0.1 # fine_tune learning rate
             p_lr = 0.01 # unserupvised pre-training learning rate
-            run_predictions('Tox21', p_epochs, t_epochs, f_lr, p_lr) # patience = 2000
+            run_predictions('Tox21', p_epochs, t_epochs, f_lr, p_lr,
+                optimizer_spec, lr_schedule) # patience = 2000
 
     elif(dataset == 'dud_e'):
 
-        run_predictions('DUD-E', 2, t_epochs, f_lr, p_lr)
+        run_predictions('DUD-E', 2, t_epochs, f_lr, p_lr, optimizer_spec,
+            lr_schedule)
 
     elif(dataset == 'muv'):
 
-        run_predictions('MUV', 4, t_epochs, f_lr, 0.04) # patience = 4000
+        run_predictions('MUV', 4, t_epochs, f_lr, 0.04, optimizer_spec,
+            lr_schedule) # patience = 4000
 
     elif(dataset == 'pcba'):
 
@@ -585,7 +723,8 @@ def main(args):
             t_epochs = 1000
             f_lr = 0.1
             p_lr = 0.001
-            run_predictions('PCBA', p_epochs, t_epochs, f_lr, p_lr)
+            run_predictions('PCBA', p_epochs, t_epochs, f_lr, p_lr,
+                optimizer_spec, lr_schedule)
 
     else:
         print 'dataset param not found. options: tox21, dud_e, muv, or pcba'
@@ -0,0 +1,413 @@
+"""
+**************************************************************************
+Theano Deep Belief Net Seed Ensembles
+**************************************************************************
+
+Fine-tunes N seeds of one single-task network (P-STNN [2000, 100], the same
+architecture as th_deep_belief_net.py) for one target in a single process:
+the target's folds are loaded & the graph is compiled once, & the seeds are
+stacked into one batched model fed the same minibatches. The first layer of
+all seeds is one (100, 1024) x (1024, N * 2000) GEMM; the upper layers are
+stacked along a leading network axis & run as batched dot products.
+
+This is a convenience for training seed ensembles (e.g. to score with
+screen_library.py's 'model+model+...'), not a speedup: on one core a step
+of N seeds takes as long as N single-network steps (0.94x - 1.03x for N = 2
+to 8), since the flops are the same.
+
+The networks never mix: the cost is the sum of their own costs, so each
+gradient only sees its own network. Every network keeps its own
+EarlyStopping, best weights & test scores; a network that has stopped is
+masked out of the cost (its weights stay put) while the others keep
+training, until all have stopped. The seeds differ in their initial
+weights: the random initialization of the DBN or, when starting from a
+pretrained stack, a small random output layer.
+
+$ python th_deep_belief_net_seeds.py <dataset> <target> [seeds]
+
+The target is a name or an index into the dataset's target list, e.g. 4
+seeds of MUV 466:
+$ python th_deep_belief_net_seeds.py muv 466 4
+
+Networks start from the dataset's shared pretrained stack if there is one
+(python th_deep_belief_net.py <dataset> pretrain), otherwise from the DBN's
+random initialization. The best weights of every network are written to
+theano_saved/deep_belief_net as model.<target>.<fold>[.seed<seed>].
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 27 Sept 2015
+"""
+
+# use a pre-warmed compile cache ($DBN_COMPILE_CACHE) if there is one; this has
+# to happen before theano is imported
+from lib.theano import compile_cache
+compile_cache.use_compile_cache()
+
+import os, sys, time, numpy, theano
+import theano.tensor as T
+from sklearn import metrics
+from lib.theano import training_loop
+from lib.theano import model_io
+from lib.theano import pretrained
+# helpers is not a theano library
+from lib.theano import helpers
+
+
+
+class BatchedDBN(object):
+    """ N independent sigmoid MLPs (the seeds of one target) with stacked """
+    """ parameters, fed the same minibatches """
+
+    def __init__(self, num_nets, n_ins=1024, hidden_layers_sizes=[2000, 100],
+                 n_outs=2, seeds=None, stack=None):
+        """
+        :type num_nets: int
+        :param num_nets: number of independent networks (N)
+
+        :type seeds: list of ints
+        :param seeds: one seed per network for its initial weights
+
+        :type stack: list of (W, hbias, vbias) numpy arrays
+        :param stack: a pretrained RBM stack all networks start from
+        """
+        floatX = theano.config.floatX
+        if(seeds is None):
+            seeds = range(num_nets)
+        self.num_nets = num_nets
+        self.n_ins = n_ins
+        self.hidden_layers_sizes = hidden_layers_sizes
+
+        # (rows, n_ins) inputs & (rows,) labels, shared by the networks
+        self.x = T.matrix('x')
+        self.y = T.ivector('y')
+        # 1 for networks still training, 0 for stopped ones
+        self.active = theano.shared(numpy.ones(num_nets, dtype=floatX),
+            name='active')
+
+        sizes = [n_ins] + hidden_layers_sizes
+        rngs = [numpy.random.RandomState(seed) for seed in seeds]
+        self.params = []
+        # W0 is one (n_ins, N * n_out) matrix & b0 one (N * n_out) vector,
+        # network after network, so the update folds into the backward GEMM;
+        # the other params are stacked along a leading network axis
+        self.widths = []
+        h = None
+        for i, (n_in, n_out) in enumerate(zip(sizes[:-1], sizes[1:])):
+            if(stack is not None):
+                W = numpy.array([stack[i][0]] * num_nets)
+                b = numpy.array([stack[i][1]] * num_nets)
+            else:
+                # HiddenLayer's initialization for sigmoid units
+                bound = 4 * numpy.sqrt(6. / (n_in + n_out))
+                W = numpy.array([rng.uniform(low=-bound, high=bound,
+                    size=(n_in, n_out)) for rng in rngs])
+                b = numpy.zeros((num_nets, n_out))
+
+            if(i == 0):
+                W = theano.shared(numpy.ascontiguousarray(
+                    W.transpose(1, 0, 2).reshape(n_in, num_nets * n_out),
+                    dtype=floatX), name='W0', borrow=True)
+                b = theano.shared(b.reshape(num_nets * n_out).astype(floatX),
+                    name='b0', borrow=True)
+                self.widths.extend([n_out, n_out])
+                # one GEMM for every network: (rows, N * n_out)
+                h = T.nnet.sigmoid(T.dot(self.x, W) + b)
+                h = h.reshape((self.x.shape[0], num_nets, n_out)).dimshuffle(
+                    1, 0, 2)
+            else:
+                W = theano.shared(W.astype(floatX), name='W' + str(i),
+                    borrow=True)
+                b = theano.shared(b.astype(floatX), name='b' + str(i),
+                    borrow=True)
+                self.widths.extend([None, None])
+                h = T.nnet.sigmoid(T.batched_dot(h, W) +
+                    b.dimshuffle(0, 'x', 1))
+            self.params.extend([W, b])
+
+        # LogisticRegression's zero initialization; seeds of a pretrained
+        # stack would be identical networks, so they get a small random one
+        W = numpy.zeros((num_nets, sizes[-1], n_outs))
+        if(stack is not None):
+            W = numpy.array([rng.normal(0., 0.01, size=(sizes[-1], n_outs))
+                for rng in rngs])
+        W = theano.shared(W.astype(floatX), name='W_out', borrow=True)
+        b = theano.shared(numpy.zeros((num_nets, n_outs), dtype=floatX),
+            name='b_out', borrow=True)
+        self.params.extend([W, b])
+        self.widths.extend([None, None])
+        z = T.batched_dot(h, W) + b.dimshuffle(0, 'x', 1)
+
+        # softmax over the classes of every (network, row)
+        shape = z.shape
+        self.p_y_given_x = T.nnet.softmax(
+            z.reshape((shape[0] * shape[1], shape[2]))).reshape(shape)
+
+        # each network's mean negative log likelihood, summed over the
+        # active networks
+        log_p = T.log(self.p_y_given_x.reshape((shape[0] * shape[1], shape[2])))
+        nll = -log_p[T.arange(shape[0] * shape[1]), T.tile(self.y, (num_nets,))]
+        self.costs = nll.reshape((shape[0], shape[1])).mean(axis=1)
+        self.finetune_cost = T.sum(self.costs * self.active)
+
+    def build_functions(self):
+        """ compile the train & predict functions """
+        learning_rate = T.scalar('lr')
+
+        gparams = T.grad(self.finetune_cost, self.params)
+        updates = []
+        for param, gparam in zip(self.params, gparams):
+            updates.append((param, param - gparam * learning_rate))
+
+        self.train_fn = theano.function(
+            inputs=[self.x, self.y, learning_rate],
+            outputs=self.costs,
+            updates=updates
+        )
+        self.predict_fn = theano.function([self.x], self.p_y_given_x[:, :, 1])
+
+    def net_index(self, param, net):
+        """ index of one network's slice of param """
+        width = self.widths[self.params.index(param)]
+        if(width is None):
+            return (net,)
+
+        # its columns of W0 / entries of b0
+        return (Ellipsis, slice(net * width, (net + 1) * width))
+
+    def net_values(self, net):
+        """ numpy (hidden, output) of one network, in model_io's layout """
+        values = [p.get_value(borrow=True)[self.net_index(p, net)]
+            for p in self.params]
+        return model_io.shared_pairs(values[:-2]), values[-2:]
+
+
+
+class NetData(object):
+    """ the target's train / valid / test rows & its minibatch cursor """
+
+    def __init__(self, datasets, seed):
+        (self.train_x, self.train_y), (self.valid_x, self.valid_y), \
+            (self.test_x, self.test_y) = datasets
+        self.rng = numpy.random.RandomState(seed)
+        self.order = self.rng.permutation(len(self.train_x))
+        self.position = 0
+
+    def next_rows(self, batch_size):
+        """ the next minibatch's training rows; reshuffles every epoch """
+        if(self.position + batch_size > len(self.order)):
+            self.order = self.rng.permutation(len(self.train_x))
+            self.position = 0
+        rows = self.order[self.position:self.position + batch_size]
+        self.position += batch_size
+
+        return rows
+
+
+
+def predict_set(net, x, eval_rows=1000):
+    """ (N, rows) P(active) of every network for the rows of x """
+    floatX = theano.config.floatX
+    preds = [net.predict_fn(numpy.asarray(x[begin:begin + eval_rows],
+        dtype=floatX)) for begin in xrange(0, len(x), eval_rows)]
+
+    return numpy.concatenate(preds, axis=1)
+
+
+
+def scores(labels, p):
+    """ zero-one error & AUC """
+    fpr, tpr, thresholds = metrics.roc_curve(labels, p)
+    return {'loss': numpy.mean((p > 0.5) != labels),
+            'auc': metrics.auc(fpr, tpr)}
+
+
+
+def fine_tune_seeds(data_type, target, seeds, datasets, stack, finetune_lr,
+                    training_epochs, batch_size, patience, stop_on,
+                    test_fold, model_dir, suffix):
+    """ fine-tune one batched network per seed of target; see """
+    """ run_DBN_seeds """
+    num_nets = len(seeds)
+    d = NetData(datasets, seeds[0])
+
+    print '... building %i networks for %s' % (num_nets, target)
+    net = BatchedDBN(num_nets, n_ins=1024 * 1, hidden_layers_sizes=[2000, 100],
+                     n_outs=2, seeds=seeds, stack=stack)
+    net.build_functions()
+
+    n_train_batches = len(d.train_x) / batch_size
+    if(patience is None):
+        patience = 30 * n_train_batches
+    stoppings = [training_loop.EarlyStopping(metric=stop_on,
+        patience=patience, patience_increase=2.0, improvement_threshold=0.995)
+        for seed in seeds]
+    validation_frequency = max(1, min(n_train_batches, patience / 2))
+
+    # every network's best weights (its slice of the stacked params)
+    best_values = [numpy.array(p.get_value()) for p in net.params]
+    best = [{'test_score': 0., 'auc': 0.} for seed in seeds]
+    active = numpy.ones(num_nets, dtype=theano.config.floatX)
+
+    x = numpy.empty((batch_size, net.n_ins), dtype=theano.config.floatX)
+    y = numpy.empty(batch_size, dtype='int32')
+
+    print '... finetuning %i networks for %s' % (num_nets, target)
+    start_time = time.time()
+    iteration = 0
+    for epoch in xrange(1, training_epochs + 1):
+        for minibatch_index in xrange(n_train_batches):
+            rows = d.next_rows(batch_size)
+            x[...] = d.train_x[rows]
+            y[...] = d.train_y[rows]
+            net.train_fn(x, y, finetune_lr)
+
+            if((iteration + 1) % validation_frequency == 0):
+                valid_p = predict_set(net, d.valid_x)
+                test_p = None
+                for i in range(num_nets):
+                    if(active[i] == 0):
+                        continue
+                    valid = scores(d.valid_y, valid_p[i])
+                    if(stoppings[i].update(valid[stop_on], iteration)):
+                        for value, param in zip(best_values, net.params):
+                            index = net.net_index(param, i)
+                            value[index] = param.get_value(borrow=True)[index]
+                        if(test_p is None):
+                            test_p = predict_set(net, d.test_x)
+                        test = scores(d.test_y, test_p[i])
+                        best[i] = {'test_score': test['loss'],
+                                   'auc': test['auc']}
+                    if(stoppings[i].done(iteration)):
+                        active[i] = 0
+                net.active.set_value(active)
+
+                print 'epoch %i, minibatch %i/%i, %i/%i networks training' % (
+                    epoch, minibatch_index + 1, n_train_batches,
+                    int(active.sum()), num_nets)
+
+            iteration += 1
+            if(active.sum() == 0):
+                break
+        if(active.sum() == 0):
+            break
+    seconds = time.time() - start_time
+
+    # every network gets its best weights back
+    for value, param in zip(best_values, net.params):
+        param.set_value(value, borrow=True)
+
+    results = []
+    for i, seed in enumerate(seeds):
+        results.append({'target': target, 'seed': seed,
+            'best_score': stoppings[i].best, 'best_iter': stoppings[i].best_iter,
+            'test_score': best[i]['test_score'], 'auc': best[i]['auc']})
+        print(('%s (seed %i): best validation %s of %f at iteration %i, '
+               'test performance %f %%, test auc: %f') % (target, seed,
+               stop_on, stoppings[i].best, stoppings[i].best_iter + 1,
+               best[i]['test_score'] * 100., best[i]['auc']))
+
+        if(model_dir is not None):
+            name = 'model.%s.%i' % (target, test_fold)
+            if(suffix):
+                name += '.seed%i' % seed
+            hidden, output = net.net_values(i)
+            model_io.save_model(os.path.join(model_dir, name), 'dbn',
+                hidden=hidden, output=output,
+                meta={'dataset': data_type, 'target': target,
+                      'fold': test_fold, 'seed': seed,
+                      'n_bits': int(hidden[0][0].shape[0]),
+                      'metrics': {'valid_' + stop_on: float(stoppings[i].best),
+                                  'test_error': float(best[i]['test_score']),
+                                  'test_auc': float(best[i]['auc'])}})
+
+    print >> sys.stderr, ('The fine tuning code for file ' +
+                          os.path.split(__file__)[1] +
+                          ' ran for %.2fm (%s, %i networks, %i iterations)' %
+                          (seconds / 60., target, num_nets, iteration))
+
+    return results
+
+
+
+def run_DBN_seeds(data_type, target, seeds=[0], finetune_lr=0.1,
+                  training_epochs=1000, batch_size=100, patience=None,
+                  stop_on='loss', model_dir=None):
+    """
+    Fine-tune one network per seed of target, as one batched model
+
+    :type seeds: list of ints
+    :param seeds: the seed of every network
+
+    :type training_epochs: int
+    :param training_epochs: maximal number of epochs of each network
+
+    :type patience: int
+    :param patience: minibatches each network looks at regardless; defaults
+                     to 30 of its epochs
+
+    returns one result dict per seed: target, seed, best validation score &
+    iteration, test error & AUC
+    """
+    fold_path = helpers.get_fold_path(data_type)
+    fnames = helpers.build_targets(fold_path, data_type)
+    test_fold = 0
+    valid_fold = 1
+
+    stack = None
+    stack_path = pretrained.get_pretrained_path(data_type, test_fold,
+        valid_fold)
+    if(pretrained.has_stack(stack_path)):
+        print '... starting from the pretrained stack ' + stack_path
+        stack = [(W, hbias) for W, hbias, vbias in
+            pretrained.load_stack(stack_path)[0]]
+
+    print '... loading ' + data_type + ' ' + target
+    datasets, test_y = helpers.th_load_data2_raw(data_type, fold_path,
+        target, fnames[target], valid_fold, test_fold)
+
+    return fine_tune_seeds(data_type, target, seeds, datasets, stack,
+        finetune_lr, training_epochs, batch_size, patience, stop_on,
+        test_fold, model_dir, suffix=len(seeds) > 1)
+
+
+
+def main(args):
+
+    if(len(args) < 3 or len(args[2]) < 1):
+        print 'usage: <tox21, dud_e, muv, or pcba> <target> [seeds]'
+        return
+
+    dataset = args[1]
+    target = args[2]
+    num_seeds = int(args[3]) if len(args) > 3 else 1
+
+    # in case of typos
+    if(dataset == 'dude'):
+        dataset = 'dud_e'
+    data_types = {'tox21': 'Tox21', 'dud_e': 'DUD-E', 'muv': 'MUV',
+                  'pcba': 'PCBA'}
+    if(dataset not in data_types):
+        print 'dataset param not found. options: tox21, dud_e, muv, or pcba'
+        return
+
+    target_list = helpers.get_target_list(data_types[dataset])
+    # names first: MUV's target names are numbers
+    if(target not in target_list):
+        target = target_list[int(target)]
+
+    print "Running Theano Deep Belief Net Seeds for " + dataset + \
+        ", target: " + target + ", " + str(num_seeds) + " seeds........."
+
+    run_DBN_seeds(data_types[dataset], target, range(num_seeds),
+        finetune_lr=0.05, training_epochs=1000,
+        model_dir='theano_saved/deep_belief_net')
+
+
+
+if __name__ == '__main__':
+    start_time = time.clock()
+
+    main(sys.argv)
+
+    end_time = time.clock()
+    print 'runtime: %.2f secs.' % (end_time - start_time)
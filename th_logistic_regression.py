@@ -22,10 +22,20 @@ The output of the model or prediction is then done by taking the argmax of the v
 This tutorial presents a stochastic gradient descent optimization method suitable for large datasets.
 """
 
-import cPickle, time, os, sys, numpy, theano
+# use a pre-warmed compile cache ($DBN_COMPILE_CACHE) if there is one; this has
+# to happen before theano is imported
+from lib.theano import compile_cache
+compile_cache.use_compile_cache()
+
+import time, os, sys, numpy, theano
+import scipy.sparse, scipy.optimize
 from sklearn import metrics
 import theano.tensor as T
 from lib.theano import helpers
+from lib.theano import training_loop
+from lib.theano import checkpoint
+from lib.theano import model_io
+from lib.theano import hogwild
 
 class LogisticRegression(object):
     """Multi-class Logistic Regression Class
@@ -114,49 +124,20 @@ class LogisticRegression(object):
 
 
 
-def sgd_optimization(data_type, target, model_dir, learning_rate=0.1, n_epochs=10, batch_size=100):
+def build_model(datasets, batch_size, learning_rate, n_in=32 * 32):
     """
-    Demonstrate stochastic gradient descent optimization of a log-linear model
+    Build the LR classifier & compile its train / validate / test functions
+    :type datasets: list of pairs of theano variables
+    :param datasets: [train, valid, test] (x, y) pairs
+    :type batch_size: int
+    :param batch_size: size of a minibatch
     :type learning_rate: float
     :param learning_rate: learning rate used (factor for the stochastic gradient)
-    :type n_epochs: int
-    :param n_epochs: maximal number of epochs to run the optimizer
     """
+    (train_set_x, train_set_y) = datasets[0]
+    (valid_set_x, valid_set_y) = datasets[1]
+    (test_set_x, test_set_y) = datasets[2]
 
-    test_fold = 1 #xxxxxxxxxxxx TEMP XXXXXXXXXXXXXXXX
-    write_model_file = model_dir + '/model.' + target + '.' + str(test_fold) +'.pkl'
-    fold_path = helpers.get_fold_path(data_type)
-    targets = helpers.build_targets(fold_path, data_type)
-    fnames = targets[target]
-
-    fold_accuracies = {}
-    did_something = False
-
-    # pct_ct = []
-    # roc_auc = []
-    # run 4 folds vs 1 fold with each possible scenario
-    # for curr_fl in range(5):
-    #     print 'Building data for target: ' + target + ', fold: ' + str(curr_fl)
-
-    # loop through all folds, for now just do 1!
-    datasets, test_set_labels = helpers.th_load_data(data_type, fold_path, target, fnames, 0, test_fold)
-
-    train_set_x, train_set_y = datasets[0]
-    test_set_x, test_set_y = datasets[1]
-    valid_set_x = train_set_x
-    valid_set_y = train_set_y
-
-    # compute number of rows for training, validation and testing
-    rows_train = train_set_x.get_value(borrow=True).shape[0]
-    rows_valid = valid_set_x.get_value(borrow=True).shape[0]
-    rows_test = test_set_x.get_value(borrow=True).shape[0]
-
-    # compute number of minibatches for training, validation and testing
-    n_train_batches = rows_train / batch_size
-    n_valid_batches = rows_valid / batch_size
-    n_test_batches = rows_test / batch_size
-
-    ####################### BUILD ACTUAL MODEL #######################
     # allocate symbolic variables for the data
     index = T.lscalar()  # index to a [mini]batch
 
@@ -167,7 +148,7 @@ def sgd_optimization(data_type, target, model_dir, learning_rate=0.1, n_epochs=1
     # construct the logistic regression class
     # n_in: Each MNIST image has size 32*32 = 1024
     # n_out: 10 different digits - multi-task LR
-    classifier = LogisticRegression(input=x, n_in=32 * 32, n_out=2)
+    classifier = LogisticRegression(input=x, n_in=n_in, n_out=2)
 
     # the cost we minimize during training is the negative log likelihood of the model in symbolic format
     cost = classifier.negative_log_likelihood(y)
@@ -210,78 +191,215 @@ def sgd_optimization(data_type, target, model_dir, learning_rate=0.1, n_epochs=1
     )
     # end-snippet-3
 
-    ################ TRAIN MODEL ################
-    # early-stopping parameters
-    patience = 5000  # look as this many examples regardless
-    patience_increase = 2  # wait this much longer when a new best is found
-    improvement_threshold = 0.995  # a relative improvement of this much is considered significant
-    validation_frequency = min(n_train_batches, patience / 2)
-    # go through this many minibatches before checking the network on the validation set; in this case we check every epoch
-
-    best_validation_loss = numpy.inf
-    test_score = 0.
-    start_time = time.clock()
+    return classifier, train_model, validate_model, test_model
 
-    done_looping = False
-    epoch = 0
-    while (epoch < n_epochs) and (not done_looping):
-        epoch = epoch + 1
-        for minibatch_index in xrange(n_train_batches):
 
-            minibatch_avg_cost = train_model(minibatch_index)
 
-            # iteration number
-            iter = (epoch - 1) * n_train_batches + minibatch_index
+def build_predict_function(classifier):
+    """ compile a predictor function: (y_pred, p_y_given_x) """
+    return theano.function(inputs=[classifier.input], outputs=[classifier.y_pred,classifier.p_y_given_x])
 
-            if (iter + 1) % validation_frequency == 0:
-                # compute zero-one loss on validation set
-                validation_losses = [validate_model(i)
-                                     for i in xrange(n_valid_batches)]
-                this_validation_loss = numpy.mean(validation_losses)
 
-                # print( 'epoch %i, minibatch %i/%i, validation error %f %%' %
-                #    (epoch,  minibatch_index + 1, n_train_batches, this_validation_loss * 100.) )
 
-                # if we got the best validation score until now
-                if this_validation_loss < best_validation_loss:
-                    #improve patience if loss improvement is good enough
-                    if this_validation_loss < best_validation_loss *  \
-                       improvement_threshold:
-                        patience = max(patience, iter * patience_increase)
+def lbfgs_fit(classifier, x, y, train_set_x, train_set_y, l2=1e-4, max_iter=200, tol=1e-5):
+    """
+    Full-batch L-BFGS (scipy's L-BFGS-B) of the L2 penalized negative log likelihood; every cost & gradient is one
+    compiled pass over the shared training set. Leaves the solution in the classifier.
+    :type l2: float
+    :param l2: weight of 0.5 * ||W||^2 (keeps separable targets from diverging)
+    :type tol: float
+    :param tol: stop once the largest gradient component is below tol
+    returns {'iterations', 'passes', 'cost', 'converged', 'seconds'}; seconds leave out compiling
+    """
+    cost = classifier.negative_log_likelihood(y) + 0.5 * l2 * T.sum(T.sqr(classifier.W))
+    cost_grad = theano.function(inputs=[], outputs=[cost] + T.grad(cost, classifier.params),
+        givens={x: train_set_x, y: train_set_y})
+
+    floatX = theano.config.floatX
+    shapes = [p.get_value(borrow=True).shape for p in classifier.params]
+    sizes = [int(numpy.prod(shape)) for shape in shapes]
+
+    def set_theta(theta):
+        for param, part, shape in zip(classifier.params, numpy.split(theta, numpy.cumsum(sizes)[:-1]), shapes):
+            param.set_value(part.reshape(shape).astype(floatX), borrow=True)
+
+    def f(theta):
+        set_theta(theta)
+        outputs = cost_grad()
+        return float(outputs[0]), numpy.concatenate([g.ravel() for g in outputs[1:]]).astype('float64')
 
-                    best_validation_loss = this_validation_loss
-                    # test it on the test set
+    start_time = time.time()
+    theta0 = numpy.concatenate([p.get_value().ravel() for p in classifier.params]).astype('float64')
+    theta, final_cost, info = scipy.optimize.fmin_l_bfgs_b(f, theta0, m=10, maxiter=max_iter, pgtol=tol)
+    set_theta(theta)
 
-                    test_losses = [test_model(i)
-                                   for i in xrange(n_test_batches)]
-                    test_score = numpy.mean(test_losses)
+    return {'iterations': info['nit'], 'passes': info['funcalls'], 'cost': float(final_cost),
+            'converged': info['warnflag'] == 0, 'seconds': time.time() - start_time}
 
-                    # print( ('     epoch %i, minibatch %i/%i, test error of best model %f %%' ) %
-                    #   ( epoch,  minibatch_index + 1,  n_train_batches, test_score * 100. )  )
 
-                    # save the best model
-                    with open(write_model_file, 'w') as f:
-                        cPickle.dump(classifier, f)
 
-            if patience <= iter:
-                done_looping = True
+def irls_fit(classifier, x, y, train_set_x, train_set_y, l2=1e-4, max_iter=50, tol=1e-5):
+    """
+    Full-batch Newton's method / IRLS of the same (2 class) model as a binary logistic regression: weights w &
+    bias c with W = [0, w] & b = [0, c]. Every iteration solves H step = grad with the (n_in + 1)^2 Hessian
+    X' S X / n + l2 I, so it suits the 1024 bit fingerprints but not much wider inputs. Steps are halved until the
+    cost decreases. Leaves the solution in the classifier.
+    returns {'iterations', 'passes', 'cost', 'converged', 'seconds'}; seconds leave out compiling
+    """
+    floatX = theano.config.floatX
+    n_in = classifier.W.get_value(borrow=True).shape[0]
+    w = theano.shared(numpy.zeros(n_in, dtype=floatX), name='w', borrow=True)
+    c = theano.shared(numpy.asarray(0., dtype=floatX), name='c')
+
+    z = T.dot(x, w) + c
+    p = T.nnet.sigmoid(z)
+    s = p * (1 - p)
+    n = T.cast(x.shape[0], floatX)
+    cost = T.mean(T.nnet.softplus(z) - y * z) + 0.5 * l2 * T.sum(T.sqr(w))
+    givens = {x: train_set_x, y: train_set_y}
+
+    newton_terms = theano.function(inputs=[], givens=givens,
+        outputs=[cost, T.dot(x.T, p - y) / n + l2 * w, T.mean(p - y),
+                 T.dot(x.T * s, x) / n, T.dot(x.T, s) / n, T.mean(s)])
+    cost_fn = theano.function(inputs=[], outputs=cost, givens=givens)
+
+    start_time = time.time()
+    passes = 0
+    converged = False
+    for iteration in xrange(1, max_iter + 1):
+        current, g_w, g_c, H_ww, H_wc, H_cc = newton_terms()
+        passes += 1
+        grad = numpy.append(g_w, g_c)
+        if(numpy.abs(grad).max() < tol):
+            converged = True
+            break
+
+        hessian = numpy.empty((n_in + 1, n_in + 1))
+        hessian[:n_in, :n_in] = H_ww + l2 * numpy.eye(n_in)
+        hessian[:n_in, n_in] = H_wc
+        hessian[n_in, :n_in] = H_wc
+        hessian[n_in, n_in] = H_cc
+        step = numpy.linalg.solve(hessian, grad)
+
+        theta = numpy.append(w.get_value(), c.get_value())
+        t = 1.
+        while True:
+            new_theta = theta - t * step
+            w.set_value(new_theta[:n_in].astype(floatX), borrow=True)
+            c.set_value(numpy.asarray(new_theta[n_in], dtype=floatX))
+            new_cost = cost_fn()
+            passes += 1
+            if(new_cost <= current or t < 1e-4):
                 break
+            t /= 2.
+        current = new_cost
 
-    end_time = time.clock()
+    W = numpy.zeros((n_in, 2), dtype=floatX)
+    W[:, 1] = w.get_value()
+    classifier.W.set_value(W, borrow=True)
+    classifier.b.set_value(numpy.array([0., c.get_value()], dtype=floatX), borrow=True)
+
+    return {'iterations': iteration, 'passes': passes, 'cost': float(current), 'converged': converged,
+            'seconds': time.time() - start_time}
+
+
+
+def sgd_optimization(data_type, target, model_dir, learning_rate=0.1, n_epochs=10, batch_size=100, walltime=None, checkpoint_every=600):
+    """
+    Demonstrate stochastic gradient descent optimization of a log-linear model
+    :type learning_rate: float
+    :param learning_rate: learning rate used (factor for the stochastic gradient)
+    :type n_epochs: int
+    :param n_epochs: maximal number of epochs to run the optimizer
+    :type walltime: string
+    :param walltime: walltime of the job (e.g. '10:00:00'); defaults to $DBN_WALLTIME
+    :type checkpoint_every: float
+    :param checkpoint_every: seconds between checkpoints; an interrupted run resumes from its checkpoint
+    """
+
+    test_fold = 1 #xxxxxxxxxxxx TEMP XXXXXXXXXXXXXXXX
+    write_model_file = model_dir + '/model.' + target + '.' + str(test_fold)
+    fold_path = helpers.get_fold_path(data_type)
+    targets = helpers.build_targets(fold_path, data_type)
+    fnames = targets[target]
+
+    fold_accuracies = {}
+    did_something = False
+
+    # pct_ct = []
+    # roc_auc = []
+    # run 4 folds vs 1 fold with each possible scenario
+    # for curr_fl in range(5):
+    #     print 'Building data for target: ' + target + ', fold: ' + str(curr_fl)
+
+    # loop through all folds, for now just do 1!
+    datasets, test_set_labels = helpers.th_load_data(data_type, fold_path, target, fnames, 0, test_fold)
+
+    train_set_x, train_set_y = datasets[0]
+    test_set_x, test_set_y = datasets[1]
+    valid_set_x = train_set_x
+    valid_set_y = train_set_y
+
+    # compute number of rows for training, validation and testing
+    rows_train = train_set_x.get_value(borrow=True).shape[0]
+    rows_valid = valid_set_x.get_value(borrow=True).shape[0]
+    rows_test = test_set_x.get_value(borrow=True).shape[0]
+
+    # compute number of minibatches for training, validation and testing
+    n_train_batches = rows_train / batch_size
+    n_valid_batches = rows_valid / batch_size
+    n_test_batches = rows_test / batch_size
 
-    print( ('Optimization complete for %d with best validation score of %f %% with test performance %f %%')
-        % (test_fold, best_validation_loss * 100., test_score * 100.) )
-    print 'The code ran for %d epochs, with %f epochs/sec' % (epoch, 1. * epoch / (end_time - start_time))
-    # print >> sys.stderr, ('The code for file ' + os.path.split(__file__)[1] + ' ran for %.1fs' % ((end_time - start_time)))
+    ####################### BUILD ACTUAL MODEL #######################
+    datasets = [(train_set_x, train_set_y), (valid_set_x, valid_set_y),
+        (test_set_x, test_set_y)]
+    classifier, train_model, validate_model, test_model = build_model(datasets,
+        batch_size, learning_rate)
+
+    # pick up an interrupted run of the same settings
+    ckpt = checkpoint.Checkpoint(
+        checkpoint.get_checkpoint_path('lr.%s.%s.%i' % (data_type, target, test_fold)),
+        classifier.params,
+        key={'learning_rate': learning_rate, 'n_epochs': n_epochs,
+             'batch_size': batch_size},
+        every=checkpoint_every)
+    progress = ckpt.load()
+
+    ################ TRAIN MODEL ################
+    # early-stopping parameters
+    stopping = training_loop.EarlyStopping(metric='loss', patience=5000,
+        patience_increase=2, improvement_threshold=0.995)
+
+    def validate():
+        # compute zero-one loss on validation set
+        validation_losses = [validate_model(i) for i in xrange(n_valid_batches)]
+        return {'loss': numpy.mean(validation_losses)}
+
+    best = {'test_score': 0.}
+    def on_best(epoch, minibatch_index, scores):
+        # test it on the test set
+        test_losses = [test_model(i) for i in xrange(n_test_batches)]
+        best['test_score'] = numpy.mean(test_losses)
+
+    result = training_loop.train(train_model, n_train_batches, n_epochs,
+        validate, stopping, deadline=training_loop.get_deadline(walltime),
+        params=classifier.params, on_best=on_best, verbose=False,
+        checkpoint=ckpt, resume=progress,
+        extra=best)
+    checkpoint.exit_if_terminated()
+    ckpt.remove()
+    epoch = result['epochs']
+
+    print( ('Optimization complete for %d (%s) with best validation score of %f %% with test performance %f %%')
+        % (test_fold, result['stopped'], stopping.best * 100., best['test_score'] * 100.) )
+    print 'The code ran for %d epochs, with %f epochs/sec' % (epoch, 1. * epoch / result['seconds'])
+    # print >> sys.stderr, ('The code for file ' + os.path.split(__file__)[1] + ' ran for %.1fs' % (result['seconds']))
 
     # end-snippet-4
     # Now we do the predictions
 
-    # load the saved best model for this fold
-    classifier = cPickle.load(open(write_model_file))
-
     # compile a predictor function
-    predict_model = theano.function(inputs=[classifier.input], outputs=[classifier.y_pred,classifier.p_y_given_x])
+    predict_model = build_predict_function(classifier)
     # compile a confidence predictor function
     # predict_conf_model = theano.function( inputs=[classifier.input], outputs=classifier.p_y_given_x)
     # We can test it on some examples from test test
@@ -301,6 +419,15 @@ def sgd_optimization(data_type, target, model_dir, learning_rate=0.1, n_epochs=1
     auc = metrics.auc(fpr, tpr) # e.g. 0.855
     """ *********************************************** """
 
+    # the classifier holds the best weights again; write them once
+    model_io.save_model(write_model_file, 'lr', hidden=[],
+        output=[p.get_value(borrow=True) for p in classifier.params],
+        meta={'dataset': data_type, 'target': target, 'fold': test_fold,
+              'n_bits': int(test_set.shape[1]),
+              'metrics': {'valid_error': float(stopping.best),
+                          'test_error': float(best['test_score']),
+                          'test_auc': float(auc)}})
+
     num_correct = 0
     num_false = 0
     for i in range(len(predicted_values)):
@@ -423,14 +550,164 @@ def sgd_optimization(data_type, target, model_dir, learning_rate=0.1, n_epochs=1
     # print ' overall accuracy: ' + str(overall_acc) + ', overall auc: ' + str(overall_auc)
     print '############################################################'
 
+
+
+def hogwild_optimization(data_type, target, model_dir, learning_rate=0.1, n_epochs=10, batch_size=100, num_workers=2, target_auc=None):
+    """
+    Lock-free asynchronous SGD of the same model over num_workers processes (lib/theano/hogwild.py)
+    :type num_workers: int
+    :param num_workers: number of training processes sharing W & b
+    :type target_auc: float
+    :param target_auc: stop as soon as the validation AUC reaches it
+    Trains on the folds outside the test & validation folds; the validation AUC picks the weights that are kept.
+    """
+
+    test_fold = 1
+    valid_fold = 2
+    write_model_file = model_dir + '/model.' + target + '.' + str(test_fold)
+    fold_path = helpers.get_fold_path(data_type)
+    targets = helpers.build_targets(fold_path, data_type)
+    fnames = targets[target]
+
+    datasets, test_set_labels = helpers.th_load_data2_raw(data_type, fold_path, target, fnames, valid_fold, test_fold)
+    (train_x, train_y), (valid_x, valid_y), (test_x, test_y) = datasets
+
+    floatX = theano.config.floatX
+    valid_x = scipy.sparse.csr_matrix(valid_x, dtype=floatX)
+    test_x = scipy.sparse.csr_matrix(test_x, dtype=floatX)
+
+    def validate(W, b):
+        fpr, tpr, thresholds = metrics.roc_curve(valid_y, hogwild.predict(W, b, valid_x)[:, 1])
+        return metrics.auc(fpr, tpr)
+
+    model = hogwild.HogwildLR(train_x.shape[1], 2, floatX)
+    result = model.train(train_x, train_y, validate, n_epochs=n_epochs,
+        learning_rate=learning_rate, batch_size=batch_size,
+        num_workers=num_workers, target_score=target_auc)
+
+    print 'Optimization complete for %d (%s) with best validation auc of %f' % (test_fold, result['stopped'], result['best_score'])
+    print 'The code ran for %.2f epochs on %d workers in %.2fs' % (result['epochs'], num_workers, result['seconds'])
+
+    # the model holds the best weights
+    conf_predictions = model.predict(test_x)
+    fpr, tpr, thresholds = metrics.roc_curve(test_set_labels, conf_predictions)
+    auc = metrics.auc(fpr, tpr)
+    predicted_values = (conf_predictions > 0.5).astype(int)
+    test_error = float(numpy.mean(predicted_values != test_set_labels))
+
+    W, b = model.values()
+    model_io.save_model(write_model_file, 'lr', hidden=[], output=[W, b],
+        meta={'dataset': data_type, 'target': target, 'fold': test_fold,
+              'n_bits': int(test_x.shape[1]),
+              'trainer': {'hogwild_workers': num_workers,
+                          'learning_rate': learning_rate,
+                          'batch_size': batch_size},
+              'metrics': {'valid_auc': float(result['best_score']),
+                          'test_error': test_error,
+                          'test_auc': float(auc)}})
+
+    fold_results = ''
+    fold_results += '####################  Results for ' + data_type + ' ####################' + '\n'
+    fold_results += 'target:' + target + ' fold:' + str(test_fold) + ' predicted: ' + \
+        str(len(predicted_values)) + ' pct correct: ' + str(1. - test_error) + ', auc: ' + str(auc)
+
+    print fold_results
+
+    write_predictions_file = model_dir + '/predictions.' + target + '.' + str(test_fold) +'.txt'
+    with open(write_predictions_file, 'w') as f:
+        f.write(fold_results + "\n")
+
+
+
+def full_batch_optimization(data_type, target, model_dir, solver='lbfgs', l2=1e-4, max_iter=None, tol=1e-5):
+    """
+    Fit the same model with a full-batch solver instead of minibatch SGD (the problem is convex)
+    :type solver: string
+    :param solver: 'lbfgs' (lbfgs_fit) or 'irls' (irls_fit, Newton's method)
+    :type l2: float
+    :param l2: L2 penalty of the weights
+    :type max_iter: int
+    :param max_iter: defaults to 200 for lbfgs & 50 for irls
+    Uses the same folds as sgd_optimization & reports the iterations, passes over the training set & time to
+    convergence.
+    """
+    fits = {'lbfgs': lbfgs_fit, 'irls': irls_fit}
+    if(solver not in fits):
+        raise ValueError('unknown solver: ' + str(solver) + '. options: lbfgs or irls')
+
+    test_fold = 1
+    write_model_file = model_dir + '/model.' + target + '.' + str(test_fold)
+    fold_path = helpers.get_fold_path(data_type)
+    targets = helpers.build_targets(fold_path, data_type)
+    fnames = targets[target]
+
+    datasets, test_set_labels = helpers.th_load_data(data_type, fold_path, target, fnames, 0, test_fold)
+    train_set_x, train_set_y = datasets[0]
+    test_set_x, test_set_y = datasets[1]
+
+    x = T.matrix('x')
+    y = T.ivector('y')
+    classifier = LogisticRegression(input=x, n_in=train_set_x.get_value(borrow=True).shape[1], n_out=2)
+
+    settings = {'l2': l2, 'tol': tol}
+    if(max_iter is not None):
+        settings['max_iter'] = max_iter
+
+    result = fits[solver](classifier, x, y, train_set_x, train_set_y, **settings)
+    seconds = result['seconds']
+
+    print '%s %s in %d iterations (%d passes over the training set), %.2fs, cost %f' % (solver,
+        'converged' if result['converged'] else 'stopped', result['iterations'], result['passes'], seconds,
+        result['cost'])
+
+    predict_model = build_predict_function(classifier)
+    test_set = test_set_x.get_value()
+    predicted_values, conf_preds = predict_model(test_set)
+    fpr, tpr, thresholds = metrics.roc_curve(test_set_labels, conf_preds[:, 1])
+    auc = metrics.auc(fpr, tpr)
+    test_error = float(numpy.mean(predicted_values != numpy.asarray(test_set_labels)))
+
+    model_io.save_model(write_model_file, 'lr', hidden=[],
+        output=[p.get_value(borrow=True) for p in classifier.params],
+        meta={'dataset': data_type, 'target': target, 'fold': test_fold,
+              'n_bits': int(test_set.shape[1]),
+              'trainer': {'solver': solver, 'l2': l2,
+                          'iterations': int(result['iterations']),
+                          'passes': int(result['passes']),
+                          'seconds': seconds,
+                          'converged': bool(result['converged'])},
+              'metrics': {'test_error': test_error,
+                          'test_auc': float(auc)}})
+
+    fold_results = ''
+    fold_results += '####################  Results for ' + data_type + ' ####################' + '\n'
+    fold_results += 'target:' + target + ' fold:' + str(test_fold) + ' predicted: ' + \
+        str(len(predicted_values)) + ' pct correct: ' + str(1. - test_error) + ', auc: ' + str(auc)
+
+    print fold_results
+
+    write_predictions_file = model_dir + '/predictions.' + target + '.' + str(test_fold) +'.txt'
+    with open(write_predictions_file, 'w') as f:
+        f.write(fold_results + "\n")
+
+
+
 def main(args):
 
     if(len(args) < 3 or len(args[2]) < 1):
-        print 'usage: <tox21, dud_e, muv, or pcba> <target> '
+        print 'usage: <tox21, dud_e, muv, or pcba> <target> [workers, lbfgs or irls]'
         return
 
     dataset = args[1]
     target = args[2]
+    # more than 1 worker: asynchronous lock-free SGD (hogwild_optimization);
+    # lbfgs / irls: a full-batch solver (full_batch_optimization)
+    solver = args[3] if len(args) > 3 and args[3] in ['lbfgs', 'irls'] else None
+    workers = int(args[3]) if len(args) > 3 and solver is None else 1
+
+    # checkpoint & exit when the scheduler preempts the job
+    checkpoint.install_sigterm_handler()
+
     # in case of typos
     if(dataset == 'dude'):
         dataset = 'dud_e'
@@ -444,17 +721,24 @@ def main(args):
         target = target_list[int(target)]
 
     model_dir = 'theano_saved/logistic_regression'
+    if(solver is not None):
+        optimize = lambda data_type: full_batch_optimization(data_type, target, model_dir, solver)
+    elif(workers > 1):
+        optimize = lambda data_type: hogwild_optimization(data_type, target, model_dir, num_workers=workers)
+    else:
+        optimize = lambda data_type: sgd_optimization(data_type, target, model_dir)
+
     if(dataset == 'tox21'):
-        sgd_optimization('Tox21', target, model_dir)
+        optimize('Tox21')
 
     elif(dataset == 'dud_e'):
-        sgd_optimization('DUD-E', target, model_dir)
+        optimize('DUD-E')
 
     elif(dataset == 'muv'):
-        sgd_optimization('MUV', target, model_dir)
+        optimize('MUV')
 
     elif(dataset == 'pcba'):
-        sgd_optimization('PCBA', target, model_dir)
+        optimize('PCBA')
     else:
         print 'dataset param not found. options: tox21, dud_e, muv, or pcba'
 
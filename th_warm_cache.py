@@ -0,0 +1,155 @@
+"""
+**************************************************************************
+Theano Compile Cache Warmer
+**************************************************************************
+
+Compiles every graph the Theano drivers need (th_deep_belief_net,
+th_deep_belief_net_multi & th_logistic_regression) for one architecture &
+float type into <cache_dir>. Run it once before submitting a job array,
+then point the jobs at the cache (see lib/theano/compile_cache.py):
+
+$ python th_warm_cache.py /scratch/theano-cache float64 2000,100
+$ export DBN_COMPILE_CACHE=/scratch/theano-cache
+
+The DBN fine-tuning graphs differ per optimizer (lib/theano/optimizers.py),
+so they are compiled for each of sgd, momentum, nesterov, rmsprop & adam, or
+only for the optimizers listed, e.g.:
+
+$ python th_warm_cache.py /scratch/theano-cache float64 2000,100 17 100 1 \
+      sgd,adam
+
+The graphs are built over small dummy datasets; the compiled C code only
+depends on the ops & their types (not on the number of rows).
+
+@author: Jason Feriante <feriante@cs.wisc.edu>
+@date: 14 Sept 2015
+"""
+
+import sys, time
+from lib.theano import compile_cache
+
+# theano (and everything that imports it) is imported inside the functions
+# below, after warm_compile_cache has set the compiledir & floatX flags
+
+# the optimizers of lib/theano/optimizers.py
+optimizer_names = ['sgd', 'momentum', 'nesterov', 'rmsprop', 'adam']
+
+
+
+def dummy_datasets(n_ins, num_rows, num_labels=None):
+    """ [train, valid, test] shared sets with both classes in every column """
+    import numpy
+    from lib.theano import helpers
+
+    x = numpy.zeros((num_rows, n_ins))
+    x[::3] = 1
+    if(num_labels is None):
+        y = numpy.arange(num_rows) % 2
+    else:
+        y = numpy.zeros((num_rows, num_labels))
+        y[::2] = 1
+
+    return [helpers.shared_dataset((x, y)) for i in range(3)], y
+
+
+
+def warm_dbn(n_ins, hidden_layers_sizes, batch_size, k, optimizer='sgd'):
+    """ single task DBN: pretraining, finetuning & predict functions """
+    import th_deep_belief_net
+
+    th_deep_belief_net.get_template(n_ins, hidden_layers_sizes, 2, batch_size,
+                                    k, optimizer=optimizer)
+
+
+
+def warm_dbn_multi(n_ins, hidden_layers_sizes, batch_size, k, num_tasks,
+                   optimizers=['sgd']):
+    """ multitask DBN: pretraining, finetuning (once per optimizer) & the """
+    """ multitask AUC predictor """
+    import numpy, theano
+    from th_deep_belief_net_multi import DBN_multi
+    from lib.theano import helpers
+
+    datasets, test_y = dummy_datasets(n_ins, 2 * batch_size, num_tasks)
+    dbn = DBN_multi(numpy_rng=numpy.random.RandomState(123), n_ins=n_ins,
+                    hidden_layers_sizes=hidden_layers_sizes, n_outs=2,
+                    num_tasks=num_tasks)
+
+    dbn.pretraining_functions(train_set_x=datasets[0][0],
+                              batch_size=batch_size, k=k)
+    # a shared learning rate, as in the driver (a constant is another graph)
+    learning_rate = theano.shared(numpy.asarray(0.1,
+        dtype=theano.config.floatX), name='lr')
+    for optimizer in optimizers:
+        dbn.build_finetune_functions(datasets=datasets, batch_size=batch_size,
+                                     learning_rate=learning_rate,
+                                     optimizer=optimizer)
+    helpers.th_calc_multi_auc(dbn, test_y.astype('int32'), datasets[2][0])
+
+
+
+def warm_lr(n_ins, batch_size):
+    """ theano logistic regression: train / validate / test & predict """
+    import th_logistic_regression
+
+    datasets, test_y = dummy_datasets(n_ins, 2 * batch_size)
+    classifier, train_model, validate_model, test_model = \
+        th_logistic_regression.build_model(datasets, batch_size, 0.1, n_ins)
+    th_logistic_regression.build_predict_function(classifier)
+
+
+
+def main(args):
+
+    if(len(args) < 2):
+        print 'usage: <cache_dir> [float32 or float64] [hidden layer sizes, ' + \
+            'e.g. 2000,100] [num_tasks] [batch_size] [k] [optimizers, ' + \
+            'e.g. sgd,adam]'
+        return
+
+    cache_dir = args[1]
+    floatX = args[2] if len(args) > 2 else 'float64'
+    hidden_layers_sizes = [2000, 100]
+    if(len(args) > 3):
+        hidden_layers_sizes = [int(size) for size in args[3].split(',')]
+    num_tasks = int(args[4]) if len(args) > 4 else 17
+    batch_size = int(args[5]) if len(args) > 5 else 100
+    k = int(args[6]) if len(args) > 6 else 1
+    optimizers = args[7].split(',') if len(args) > 7 else optimizer_names
+    n_ins = 1024
+
+    if(floatX not in ['float32', 'float64']):
+        print 'float type must be float32 or float64'
+        return
+    for optimizer in optimizers:
+        if(optimizer not in optimizer_names):
+            print 'unknown optimizer: ' + optimizer + '. options: ' + \
+                ', '.join(optimizer_names)
+            return
+
+    cache_dir = compile_cache.warm_compile_cache(cache_dir, floatX)
+    print 'Warming ' + cache_dir + ' for ' + floatX + ', layers: ' + \
+        str(hidden_layers_sizes)
+
+    steps = [('DBN (' + optimizer + ')', lambda optimizer=optimizer:
+        warm_dbn(n_ins, hidden_layers_sizes, batch_size, k, optimizer))
+        for optimizer in optimizers]
+    steps += [
+        ('multitask DBN', lambda: warm_dbn_multi(n_ins, hidden_layers_sizes,
+            batch_size, k, num_tasks, optimizers)),
+        ('logistic regression', lambda: warm_lr(n_ins, batch_size)),
+        ]
+    for name, step in steps:
+        start = time.time()
+        step()
+        print '... compiled ' + name + ' in %.2f secs.' % (time.time() - start)
+
+
+
+if __name__ == '__main__':
+    start_time = time.clock()
+
+    main(sys.argv)
+
+    end_time = time.clock()
+    print 'runtime: %.2f secs.' % (end_time - start_time)
@@ -6,6 +6,11 @@ echo Cluster $cluster
 echo Process $process
 echo RunningOn $runningon
 
+# skip theano compilation: use a cache filled by th_warm_cache.py (each job
+# works on its own copy, so there is no compiledir lock contention); it
+# covers the optimizers it was warmed for, all of them by default
+# export DBN_COMPILE_CACHE=/path/to/theano-cache
+
 # $process is your 0-indexed job index that you can use for looping
 CMD="python th_deep_belief_net.py dud_e $process"
 echo $CMD